@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""
+Compares the per-query latency of the database backends of `dbconfig.py` on the queries the bot runs on every
+update: looking a user up, checking if they are admin, counting their files, and the admin statistics.
+
+The tables are created by the migrations in `migrations/` in a scratch database which is dropped afterwards. SQLite
+uses a temporary file. MySQL is only measured when `--mysql-database` names a scratch database on the server of
+`DB_HOST`; never point it at the database of the bot.
+
+Usage: python benchmarks/database_benchmark.py --users 10000 --queries 2000 --mysql-database music_tool_bot_bench
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orator import DatabaseManager, Model
+
+import dbconfig
+from utils import is_user_admin, increment_usage_counter_for_user
+from utils.usage import UsageRecorder, DATETIME_FORMAT
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_migrations() -> list:
+    migrations = []
+
+    for path in sorted(glob.glob(os.path.join(PROJECT_DIR, 'migrations', '[0-9]*.py'))):
+        spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migration_class = next(value for name, value in vars(module).items()
+                               if isinstance(value, type) and name != 'Migration' and hasattr(value, 'up'))
+        migrations.append(migration_class())
+
+    return migrations
+
+
+def populate(db: DatabaseManager, users: int) -> None:
+    now = datetime.now().strftime(DATETIME_FORMAT)
+    rows = [
+        {'user_id': user_id, 'username': f"user{user_id}", 'language': 'fa' if user_id % 3 else 'en',
+         'number_of_files_sent': 0, 'created_at': now, 'updated_at': now}
+        for user_id in range(1, users + 1)
+    ]
+
+    for start in range(0, len(rows), 500):
+        db.table('users').insert(rows[start:start + 500])
+
+    db.table('admins').insert({'admin_user_id': 1, 'is_owner': True, 'created_at': now, 'updated_at': now})
+
+
+def measure(query, queries: int) -> list:
+    latencies = []
+
+    for _ in range(queries):
+        start = time.perf_counter()
+        query()
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+def benchmark_backend(name: str, config: dict, users: int, queries: int) -> dict:
+    from models.user import User
+
+    db = DatabaseManager({'default': name, name: config})
+    Model.set_connection_resolver(db)
+
+    migrations = load_migrations()
+
+    for migration in migrations:
+        migration.set_connection(db.connection())
+        migration.up()
+
+    try:
+        populate(db, users)
+
+        def random_user_id():
+            return random.randint(1, users)
+
+        usage_recorder = UsageRecorder(batch_size=500, max_buffered=500)
+
+        def record_usage_batch():
+            for _ in range(500):
+                usage_recorder.record(random_user_id(), 'tag_editor')
+
+        patterns = {
+            'find user': lambda: User.where('user_id', '=', random_user_id()).first(),
+            'is admin': lambda: is_user_admin(random_user_id()),
+            'count a file': lambda: increment_usage_counter_for_user(random_user_id()),
+            'count users': lambda: User.where('language', 'fa').count(),
+            'insert 500 usage events': record_usage_batch,
+        }
+
+        return {
+            pattern: measure(query, queries if pattern != 'insert 500 usage events' else max(1, queries // 100))
+            for pattern, query in patterns.items()
+        }
+    finally:
+        for migration in reversed(migrations):
+            migration.down()
+
+        db.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000, help='Rows in the users table')
+    parser.add_argument('--queries', type=int, default=2000, help='Queries per pattern')
+    parser.add_argument('--mysql-database', default='', help='A scratch MySQL database to measure MySQL on')
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sqlite_config = dict(dbconfig.DATABASES['sqlite'], database=os.path.join(temp_dir, 'bench.sqlite3'))
+        results['sqlite'] = benchmark_backend('sqlite', sqlite_config, args.users, args.queries)
+
+    if args.mysql_database:
+        mysql_config = dict(dbconfig.DATABASES['mysql'], database=args.mysql_database)
+        results['mysql'] = benchmark_backend('mysql', mysql_config, args.users, args.queries)
+    else:
+        print("MySQL skipped, pass --mysql-database to measure it\n")
+
+    print(f"{'query':<24}" + ''.join(f"{backend + ' p50':>14}{backend + ' p99':>14}" for backend in results))
+
+    for pattern in results['sqlite']:
+        row = f"{pattern:<24}"
+
+        for backend in results:
+            latencies = sorted(results[backend][pattern])
+            row += f"{statistics.median(latencies) * 1000:11.3f} ms"
+            row += f"{latencies[int(len(latencies) * 0.99)] * 1000:11.3f} ms"
+
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
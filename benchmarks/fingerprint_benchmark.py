@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Measures the cost of the acoustic fingerprints of `utils/fingerprint.py`.
+
+ - compute cost: seconds of CPU per minute of audio, on synthetic PCM so that the decoding by ffmpeg is left out
+ - lookup latency: how long it takes to find a noisy copy of a music in an index of `--index-size` others
+
+Usage: python benchmarks/fingerprint_benchmark.py --minutes 1.5 --index-size 200 --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.fingerprint import FingerprintIndex, compute_fingerprint, SAMPLE_RATE
+
+
+def generate_melody(seed: int, seconds: float):
+    random = numpy.random.default_rng(seed)
+    time_axis = numpy.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    notes = int(seconds * 4) + 1
+    frequencies = random.uniform(200, 1800, size=(notes, 3)).repeat(SAMPLE_RATE // 4 + 1, axis=0)[:len(time_axis)]
+
+    return (numpy.sin(2 * numpy.pi * frequencies * time_axis[:, numpy.newaxis]).sum(axis=1) * 6000).astype('<i2')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, default=1.5, help='Length of the fingerprinted audio')
+    parser.add_argument('--index-size', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    melody = generate_melody(0, args.minutes * 60)
+
+    compute_times = []
+
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        fingerprint = compute_fingerprint(melody)
+        compute_times.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = FingerprintIndex(os.path.join(temp_dir, 'fingerprints.sqlite3'), max_entries=args.index_size + 1)
+
+        for seed in range(1, args.index_size):
+            index.save(compute_fingerprint(generate_melody(seed, 30)), {'title': str(seed)}, '')
+
+        fingerprint_id = index.save(fingerprint, {'title': 'wanted'}, '')
+
+        noise = numpy.random.default_rng(0).normal(0, 300, len(melody) - 1000)
+        copy_fingerprint = compute_fingerprint((melody[1000:] + noise).clip(-32768, 32767).astype('<i2'))
+
+        lookup_times = []
+
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            found_id, _, _ = index.find(copy_fingerprint)
+            lookup_times.append(time.perf_counter() - start)
+
+    print(f"compute cost:   {statistics.median(compute_times) / args.minutes * 1000:8.1f} ms per minute of audio "
+          f"({len(fingerprint)} sub-fingerprints)")
+    print(f"lookup latency: {statistics.median(lookup_times) * 1000:8.1f} ms in an index of {args.index_size} "
+          f"({'found' if found_id == fingerprint_id else 'NOT found'})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+Load-tests the bot without Telegram: the bot runs as it does in production, but against a fake Bot API server on
+localhost, and on a fresh SQLite database. Scripted users start, pick English, then walk through the tag editor, the
+music cutter or the voice converter in turn, while the latency of every step is collected.
+
+The fake server can add latency to the requests of the bot and fail some of them, with a server error or with
+`RetryAfter`. The outbound limits of the bot still apply; raise `OUTBOUND_GLOBAL_PER_SECOND` and
+`OUTBOUND_CHAT_PER_SECOND` to take them out of the picture. The cutter and the converter need ffmpeg.
+
+Besides the steps which time out, the report counts the steps which fail: the bot replies that it failed, or logs
+an exception while handling the update of the step. The output of the bot is written to `bot.log` in the work
+directory; its last lines are printed if a step failed and the work directory is a temporary one.
+
+Usage: python benchmarks/load_benchmark.py --users 1000 --ramp-up 30 --latency 0.05 --retry-after-rate 0.01
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(PROJECT_DIR)
+
+from tests.integration.fake_bot_api import FakeBotApi, FaultInjection, write_silent_mp3, OUTCOME_OK
+from tests.integration.load_driver import LoadDriver, ONBOARDING, FLOWS, percentile
+
+BOT_SCRIPT = '''
+import glob
+import importlib
+import os
+import sys
+
+from orator import DatabaseManager
+
+import bot
+from dbconfig import DATABASES
+from telegram import ParseMode
+from telegram.ext import Updater, Defaults
+from utils.persistence import SessionPersistence
+from utils.upload import StreamingRequest
+
+db = DatabaseManager(DATABASES)
+
+for path in sorted(glob.glob(os.path.join(sys.argv[3], 'migrations/[0-9]*.py'))):
+    module = importlib.import_module(f"migrations.{os.path.basename(path)[:-3]}")
+    migration = next(value for name, value in vars(module).items()
+                     if isinstance(value, type) and name != 'Migration' and hasattr(value, 'up'))()
+    migration.set_connection(db.connection())
+    migration.up()
+
+db.disconnect()
+
+bot.setup_logging()
+
+updater = Updater(
+    bot=bot.ScheduledBot(
+        sys.argv[1],
+        base_url=sys.argv[2],
+        base_file_url=sys.argv[2].replace('/bot', '/file/bot'),
+        request=StreamingRequest(con_pool_size=4 + 4),
+        defaults=Defaults(parse_mode=ParseMode.MARKDOWN, timeout=120),
+    ),
+    persistence=SessionPersistence('persistence_storage'),
+)
+bot.setup_database(pool_size=updater.dispatcher.workers + 2)
+bot.register_handlers(updater.dispatcher)
+bot.schedule_jobs(updater.dispatcher)
+updater.start_polling(poll_interval=0)
+updater.idle()
+'''
+
+
+# What `handle_error` logs when a handler raises
+BOT_ERROR_PATTERN = re.compile(r'Error on handling update (\d+)\.')
+
+
+def start_bot(api: FakeBotApi, work_dir: str) -> subprocess.Popen:
+    os.makedirs(os.path.join(work_dir, 'logs'), exist_ok=True)
+
+    return subprocess.Popen(
+        [sys.executable, '-c', BOT_SCRIPT, api.token, api.base_url, PROJECT_DIR],
+        cwd=work_dir,
+        env={
+            **os.environ,
+            'PYTHONPATH': PROJECT_DIR,
+            'DB_CONNECTION': 'sqlite',
+            'DB_SQLITE_PATH': os.path.join(work_dir, 'database.sqlite3'),
+            # The errors are read from the output as they happen
+            'PYTHONUNBUFFERED': '1',
+        },
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+
+def follow_output(process: subprocess.Popen, log_path: str, on_bot_error) -> threading.Thread:
+    """Copy the output of the bot to a log file, and pass the id of every update it fails on to `on_bot_error`."""
+
+    def follow():
+        with open(log_path, 'w') as log:
+            for line in process.stdout:
+                log.write(line)
+
+                match = BOT_ERROR_PATTERN.search(line)
+
+                if match:
+                    on_bot_error(int(match.group(1)))
+
+    thread = threading.Thread(target=follow, name='bot-output', daemon=True)
+    thread.start()
+
+    return thread
+
+
+def print_log_tail(log_path: str, lines: int = 50) -> None:
+    with open(log_path) as log:
+        tail = deque(log, maxlen=lines)
+
+    print(f"Last {len(tail)} lines of the output of the bot:")
+    print(''.join(tail))
+
+
+def wait_until_polling(api: FakeBotApi, process: subprocess.Popen) -> None:
+    while not api.outcomes['getUpdates', OUTCOME_OK]:
+        if process.poll() is not None:
+            raise RuntimeError('The bot exited before polling')
+        time.sleep(0.05)
+
+
+def print_report(driver: LoadDriver, api: FakeBotApi) -> None:
+    print(f"{'step':<44}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'timeouts':>10}{'failures':>10}")
+
+    for name in dict.fromkeys(f"{flow}: {step.name}" for flow in driver.flows for step in ONBOARDING + FLOWS[flow]):
+        latencies = driver.latencies[name]
+        ended = f"{driver.timeouts[name]:>10}{driver.failures[name]:>10}"
+
+        if latencies:
+            print(f"{name:<44}{len(latencies):>7}{percentile(latencies, 50):>8.3f}s{percentile(latencies, 90):>8.3f}s"
+                  f"{percentile(latencies, 99):>8.3f}s{max(latencies):>8.3f}s{ended}")
+        else:
+            print(f"{name:<44}{0:>7}{'-':>9}{'-':>9}{'-':>9}{'-':>9}{ended}")
+
+    print()
+    print(f"{driver.finished} of {driver.users} users finished in {driver.elapsed:.1f}s "
+          f"({driver.finished / driver.elapsed:.1f} flows/s)")
+    print('requests of the bot: ' + ', '.join(
+        f"{method} {outcome} {count}" for (method, outcome), count in sorted(api.outcomes.items())
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--flows', nargs='+', choices=list(FLOWS), default=list(FLOWS))
+    parser.add_argument('--ramp-up', type=float, default=10.0, help='Seconds over which the users start')
+    parser.add_argument('--think-time', type=float, default=0.5, help='Seconds between the steps of a user')
+    parser.add_argument('--step-timeout', type=float, default=60.0, help='Seconds')
+    parser.add_argument('--music', help='The music the users send, a silent MP3 by default')
+    parser.add_argument('--music-duration', type=int, default=10, help='Seconds')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request of the bot')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1, help='Seconds')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--work-dir', help='Where to run the bot and keep its database and log, a temporary directory '
+                                           'by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = os.path.abspath(args.work_dir) if args.work_dir else temp_dir
+        log_path = os.path.join(work_dir, 'bot.log')
+        music_path = args.music and os.path.abspath(args.music)
+
+        os.makedirs(work_dir, exist_ok=True)
+
+        if not music_path:
+            music_path = os.path.join(work_dir, 'music.mp3')
+            write_silent_mp3(music_path, args.music_duration)
+
+        faults = FaultInjection(args.latency, args.jitter, args.error_rate, args.retry_after_rate, args.retry_after,
+                                seed=args.seed)
+        api = FakeBotApi(music_path, faults).start()
+        driver = LoadDriver(api, args.users, args.flows, args.ramp_up, args.think_time, args.step_timeout,
+                            args.music_duration)
+        process = start_bot(api, work_dir)
+        output = follow_output(process, log_path, driver.on_bot_error)
+
+        try:
+            wait_until_polling(api, process)
+            driver.run()
+        finally:
+            process.kill()
+            process.wait()
+            output.join()
+            api.stop()
+
+        if any(driver.failures.values()) and not args.work_dir:
+            print_log_tail(log_path)
+
+    print_report(driver, api)
+
+    if args.work_dir:
+        print(f"The output of the bot is in {log_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+Compares how long `download_file` takes to get a music from a cloud-like Bot API (downloaded over HTTP) and from a
+Bot API server in local mode (taken from the disk).
+
+Both are played by a stand-in server on localhost, so the HTTP numbers leave out the real network and are the best
+case of the cloud path.
+
+Usage: python benchmarks/local_bot_api_benchmark.py --sizes 1 20 100 --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot
+
+from utils import download_file, delete_file
+
+FAKE_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+class StandInBotApi(BaseHTTPRequestHandler):
+    file_path = None
+    local_mode = False
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(StandInBotApi.file_path)))
+        self.end_headers()
+
+        with open(StandInBotApi.file_path, 'rb') as served_file:
+            while True:
+                chunk = served_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        file_path = StandInBotApi.file_path if StandInBotApi.local_mode else 'music/file.mp3'
+        body = json.dumps({
+            'ok': True,
+            'result': {'file_id': 'file-id', 'file_unique_id': 'unique', 'file_path': file_path},
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(bot: Bot, runs: int) -> float:
+    timings = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        path = download_file(1, bot.get_file('file-id'), 'audio', None)
+        timings.append(time.perf_counter() - start)
+
+        delete_file(path)
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 20, 100], help='MB')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        os.makedirs('downloads/1')
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StandInBotApi)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        bot = Bot(
+            FAKE_TOKEN,
+            base_url=f"http://127.0.0.1:{server.server_port}/bot",
+            base_file_url=f"http://127.0.0.1:{server.server_port}/file/bot",
+        )
+
+        print(f"{'size':>8} {'http':>10} {'local':>10} {'speedup':>8}")
+
+        for size in args.sizes:
+            StandInBotApi.file_path = os.path.join(temp_dir, f"file_{size}.mp3")
+
+            with open(StandInBotApi.file_path, 'wb') as served_file:
+                served_file.write(os.urandom(size * 1024 * 1024))
+
+            StandInBotApi.local_mode = False
+            http_time = measure(bot, args.runs)
+
+            StandInBotApi.local_mode = True
+            local_time = measure(bot, args.runs)
+
+            print(f"{size:>5} MB {http_time * 1000:>7.1f} ms {local_time * 1000:>7.1f} ms {http_time / local_time:>7.1f}x")
+
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+Measures how the voice conversion of a long music speeds up with the number of segments encoded in parallel.
+
+A music of `--duration` seconds is generated with ffmpeg (a melody of sine tones over pink noise, so the encoder has
+something to work on) and converted once per segment count. The output of every run is checked to last as long as
+the input.
+
+Usage: python benchmarks/segment_benchmark.py --duration 1800 --segments 1 2 4 8
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.media import convert_to_voice
+
+
+def generate_music(path: str, duration: int) -> None:
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f"sine=frequency=440:beep_factor=3:duration={duration}",
+         '-f', 'lavfi', '-i', f"anoisesrc=color=pink:amplitude=0.1:duration={duration}",
+         '-filter_complex', 'amix=inputs=2', '-ac', '2', '-ar', '44100', '-b:a', '192k', path],
+        check=True,
+    )
+
+
+def probe_duration(path: str) -> float:
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', path],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    return float(output.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=int, default=1800, help='Seconds')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        sys.exit('ffmpeg and ffprobe are needed for this benchmark')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        music_path = os.path.join(temp_dir, 'music.mp3')
+        generate_music(music_path, args.duration)
+
+        baseline = None
+
+        print(f"{os.cpu_count()} cores, {args.duration} s of music")
+
+        for segments in args.segments:
+            voice_path = os.path.join(temp_dir, f"voice_{segments}.ogg")
+
+            start = time.perf_counter()
+            succeeded = convert_to_voice(music_path, voice_path, args.duration, segments)
+            elapsed = time.perf_counter() - start
+
+            if not succeeded:
+                sys.exit(f"Conversion with {segments} segments failed")
+
+            baseline = baseline or elapsed
+            duration_error = probe_duration(voice_path) - args.duration
+
+            print(f"{segments:3} segments: {elapsed:7.2f} s  speedup {baseline / elapsed:5.2f}x  "
+                  f"duration error {duration_error * 1000:+7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Measures the memory and the persisted size of a session, as the `dict` the bot used to keep in `user_data` and as
+a `Session`, in three states:
+
+ - new: right after `/start`, i.e. reset and empty
+ - active: with a music loaded and its tags being edited
+ - evicted: what `sweep_sessions` leaves of an idle session
+
+Usage: python benchmarks/session_benchmark.py --sessions 10000
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import reset_user_data
+from utils.session import Session, evict_session
+
+
+def new_session(factory, user_id: int):
+    user_data = factory()
+    reset_user_data(user_data)
+
+    return user_data
+
+
+def active_session(factory, user_id: int):
+    user_data = new_session(factory, user_id)
+    user_data['music_path'] = f"downloads/{user_id}/AgADBAADrq0xG{user_id:08}.mp3"
+    user_data['music_file_id'] = f"CQACAgQAAxkBAAI{user_id:08}BX2v4lXLrzGzgbxNPAAE2AAE"
+    user_data['music_file_unique_id'] = f"AgADNgADc{user_id:08}"
+    user_data['music_file_size'] = 7340032 + user_id
+    user_data['music_duration'] = 215 + user_id % 100
+    user_data['music_message_id'] = 1000 + user_id
+    # Only the id of the fingerprint is kept in the session, the fingerprint itself is in the fingerprint index
+    user_data['music_fingerprint_id'] = user_id
+    user_data['current_active_module'] = 'tag_editor'
+    user_data['tag_editor'] = {
+        'artist': f"Artist {user_id}", 'title': f"Title {user_id}", 'album': f"Album {user_id}", 'genre': 'Pop',
+        'year': '2021', 'disknumber': '1', 'tracknumber': str(user_id % 12), 'current_tag': 'title',
+    }
+
+    return user_data
+
+
+def evicted_session(factory, user_id: int):
+    user_data = active_session(factory, user_id)
+    user_data['music_path'] = ''
+    evict_session(user_id, user_data)
+
+    return user_data
+
+
+def measure(make, factory, sessions: int) -> (float, float):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    user_data = {user_id: make(factory, user_id) for user_id in range(sessions)}
+
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    memory = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    persisted = len(pickle.dumps(user_data))
+
+    return memory / sessions, persisted / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'state':<10}{'dict memory':>14}{'Session memory':>17}{'dict pickled':>15}{'Session pickled':>18}")
+
+    for state, make in [('new', new_session), ('active', active_session), ('evicted', evicted_session)]:
+        dict_memory, dict_pickled = measure(make, dict, args.sessions)
+        session_memory, session_pickled = measure(make, Session, args.sessions)
+
+        print(f"{state:<10}{dict_memory:>12.0f} B{session_memory:>15.0f} B{dict_pickled:>13.0f} B"
+              f"{session_pickled:>16.0f} B")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+Measures how the throughput of the sharded deployment (`cluster.py`) scales with the number of workers.
+
+Synthetic text updates of `--users` users go through the same routing and worker code as production. The handler
+burns a fixed amount of CPU per update, like parsing tags or building a reply would, and checks that the updates of
+each user arrive in order.
+
+Usage: python benchmarks/sharding_benchmark.py --updates 4000 --users 200 --workers 1 2 4 8
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.ext import Dispatcher, MessageHandler, Filters
+
+from cluster import start_workers, stop_workers, dispatch_update
+
+FAKE_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+WORK_ROUNDS = 2000
+
+last_sequence_of_user = {}
+
+
+def handle_synthetic_message(update: Update, context) -> None:
+    user_id = update.effective_user.id
+    sequence = int(update.message.text)
+
+    if last_sequence_of_user.get(user_id, -1) >= sequence:
+        print(f"Out of order update for user {user_id}: {sequence}", file=sys.stderr)
+
+    last_sequence_of_user[user_id] = sequence
+
+    digest = update.message.text.encode()
+    for _ in range(WORK_ROUNDS):
+        digest = hashlib.sha256(digest).digest()
+
+
+def register_benchmark_handlers(dispatcher: Dispatcher) -> None:
+    dispatcher.add_handler(MessageHandler(Filters.text, handle_synthetic_message))
+
+
+def generate_updates(number_of_updates: int, number_of_users: int) -> [Update]:
+    updates = []
+
+    for update_id in range(number_of_updates):
+        user_id = 1000 + update_id % number_of_users
+        updates.append(Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+                'text': str(update_id),
+            },
+        }, None))
+
+    return updates
+
+
+def measure(workers: int, updates: [Update]) -> float:
+    # No `run_async` threads, so the workers never call `getMe`
+    shard_queues, processes = start_workers(workers, FAKE_TOKEN, register_benchmark_handlers, async_threads=0)
+
+    start = time.perf_counter()
+
+    for update in updates:
+        dispatch_update(update, shard_queues)
+
+    stop_workers(shard_queues, processes)
+
+    return len(updates) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=4000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    updates = generate_updates(args.updates, args.users)
+    baseline = None
+
+    print(f"{'workers':>8} {'updates/s':>12} {'speedup':>8}")
+
+    for workers in args.workers:
+        throughput = measure(workers, updates)
+        baseline = baseline if baseline else throughput
+
+        print(f"{workers:>8} {throughput:>12.1f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
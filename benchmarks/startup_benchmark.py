@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+Measures the cold start of the bot and fails when it grows past a budget.
+
+ - import time: how long `import bot` takes in a fresh interpreter
+ - time to first update: from spawning a fresh interpreter to the first reply of the bot. The bot goes through the
+   same steps as `main()`, but polls a local stand-in of the Bot API which hands out a single `/language` update.
+
+Usage: python benchmarks/startup_benchmark.py --runs 5 --import-budget 0.5 --first-update-budget 3
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import bot
+print(time.perf_counter() - start)
+'''
+
+FIRST_UPDATE_SCRIPT = '''
+import sys
+import bot
+from telegram import ParseMode
+from telegram.ext import Updater, Defaults
+from utils.persistence import SessionPersistence
+from utils.upload import StreamingRequest
+
+bot.setup_logging()
+
+updater = Updater(
+    bot=bot.ScheduledBot(
+        sys.argv[1],
+        base_url=sys.argv[2],
+        request=StreamingRequest(con_pool_size=8),
+        defaults=Defaults(parse_mode=ParseMode.MARKDOWN, timeout=120),
+    ),
+    persistence=SessionPersistence(sys.argv[3]),
+)
+bot.setup_database(pool_size=updater.dispatcher.workers + 2)
+bot.register_handlers(updater.dispatcher)
+updater.start_polling(poll_interval=0)
+updater.idle()
+'''
+
+
+class StandInBotApi(BaseHTTPRequestHandler):
+    """Answers the few Bot API methods the bot calls until its first reply."""
+    first_reply_at = None
+    update_sent = False
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        user = {'id': 1, 'is_bot': False, 'first_name': 'user'}
+        message = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': 1, 'type': 'private'}, 'from': user}
+
+        if method == 'getMe':
+            result = {'id': 123456789, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}
+        elif method == 'getUpdates':
+            if StandInBotApi.update_sent:
+                time.sleep(0.1)
+                result = []
+            else:
+                StandInBotApi.update_sent = True
+                result = [{
+                    'update_id': 1,
+                    'message': {
+                        **message,
+                        'text': '/language',
+                        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 9}],
+                    },
+                }]
+        elif method == 'sendMessage':
+            StandInBotApi.first_reply_at = StandInBotApi.first_reply_at or time.perf_counter()
+            result = {**message, 'text': 'reply'}
+        else:
+            result = True
+
+        body = json.dumps({'ok': True, 'result': result}).encode()
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except BrokenPipeError:
+            # The bot has been killed in the middle of a long poll
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def measure_import_time() -> float:
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=PROJECT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def measure_time_to_first_update() -> float:
+    StandInBotApi.first_reply_at = None
+    StandInBotApi.update_sent = False
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInBotApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Keep the log files of the runs out of the project
+        os.mkdir(os.path.join(temp_dir, 'logs'))
+
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [
+                sys.executable, '-c', FIRST_UPDATE_SCRIPT,
+                FAKE_TOKEN,
+                f"http://127.0.0.1:{server.server_port}/bot",
+                os.path.join(temp_dir, 'persistence_storage'),
+            ],
+            cwd=temp_dir,
+            env={**os.environ, 'PYTHONPATH': PROJECT_DIR},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        try:
+            while StandInBotApi.first_reply_at is None:
+                if process.poll() is not None:
+                    raise RuntimeError('The bot exited before replying')
+                time.sleep(0.01)
+        finally:
+            process.kill()
+            process.wait()
+            server.shutdown()
+
+    return StandInBotApi.first_reply_at - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget', type=float, default=0.5, help='Seconds')
+    parser.add_argument('--first-update-budget', type=float, default=3.0, help='Seconds')
+    args = parser.parse_args()
+
+    import_time = statistics.median(measure_import_time() for _ in range(args.runs))
+    first_update_time = statistics.median(measure_time_to_first_update() for _ in range(args.runs))
+
+    print(f"import time:          {import_time * 1000:8.1f} ms (budget {args.import_budget * 1000:.0f} ms)")
+    print(f"time to first update: {first_update_time * 1000:8.1f} ms (budget {args.first_update_budget * 1000:.0f} ms)")
+
+    if import_time > args.import_budget or first_update_time > args.first_update_budget:
+        print('Startup is over budget', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,19 +3,27 @@
 """
 Built-in modules
 """
+from __future__ import annotations
+
 import logging
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import TYPE_CHECKING
 
 """
 Third-party modules
 """
-import music_tag
-from orator import Model
+from dotenv import load_dotenv
 from telegram.error import TelegramError
-from telegram import Update, ReplyKeyboardMarkup, ChatAction, ParseMode
-from telegram.ext import Updater, CommandHandler, CallbackContext, Filters, MessageHandler, Defaults, PicklePersistence
+from telegram import Update, ReplyKeyboardMarkup, ChatAction, ParseMode, InputMediaAudio
+
+if TYPE_CHECKING:
+    from telegram.ext import CallbackContext, Dispatcher
+
+load_dotenv(verbose=True)
 
 """
 My modules
@@ -23,33 +31,68 @@ My modules
 from utils import download_file, create_user_directory, convert_seconds_to_human_readable_form, generate_music_info, \
     is_user_owner, is_user_admin, reset_user_data_context, save_text_into_tag, increment_usage_counter_for_user, \
     translate_key_to, delete_file, generate_back_button_keyboard, generate_start_over_keyboard, \
-    generate_module_selector_keyboard, generate_tag_editor_keyboard, save_tags_to_file, parse_cutting_range
-
-from models.admin import Admin
-from models.user import User
-from dbconfig import db
-
-
-Model.set_connection_resolver(db)
+    generate_module_selector_keyboard, generate_tag_editor_keyboard, save_tags_to_file, parse_cutting_ranges, \
+    generate_batch_keyboard, open_for_upload, link_or_clone_file
+from utils.artwork import extract_artwork, generate_thumbnail, normalize_artwork, cache_artwork
+from utils.batch import save_batch_tags_to_files, BATCH_MAX_FILES, BATCH_SHARED_TAGS, BATCH_DOWNLOAD_THREADS
+from utils.jobs import get_job_journal, run_job, resume_orphaned_jobs, maintain_job_journal, JOBS_HEARTBEAT_SECONDS
+from utils.admission import admission_controller, AdmissionTicket
+from utils.media import count_encoding_processes
+from utils.rate_limit import rate_limiter
+from utils.metrics import metrics, start_metrics_server
+from utils.waveform import generate_waveform
+from utils.fingerprint import fingerprint_file, get_fingerprint_index
+from utils.outbound import ScheduledBot
+from utils.db_pool import setup_connection_pool, release_database_connection
+from utils.session import touch_session, sweep_sessions, SESSION_SWEEP_SECONDS
+from utils.tracing import tracer, start_trace, finish_trace, handle_error
+from utils.usage import usage_recorder, flush_usage, roll_up_usage_job, get_usage_summary, USAGE_FLUSH_SECONDS, \
+    USAGE_ROLLUP_SECONDS, MODULE_TAG_EDITOR, MODULE_MUSIC_CUTTER, MODULE_VOICE_CONVERTER
 
 """
 Global variables
 """
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_USERNAME = os.getenv("BOT_USERNAME")
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL") if os.getenv("BOT_API_BASE_URL") else None
+BOT_API_FILE_URL = os.getenv("BOT_API_FILE_URL") if os.getenv("BOT_API_FILE_URL") else None
+DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE") if os.getenv("DOWNLOAD_MODE") else 'deferred'
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+# The clips of a cut are sent as a media group, which can hold up to 10 items
+MUSIC_CUTTER_MAX_CLIPS = 10
+
+# The music downloads in progress by user and file id, each with an event which is set once it is over. The lock
+# is only held to look a download up or to add one, never while downloading
+downloads_lock = threading.Lock()
+downloads_in_progress = {}
 
 """
 Logger
 """
-now = datetime.now()
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
-output_file_handler = logging.FileHandler(f"logs/{now}.log")
-stdout_handler = logging.StreamHandler(sys.stdout)
 
-logger.addHandler(output_file_handler)
-logger.addHandler(stdout_handler)
+def setup_logging() -> None:
+    """Log to stdout and to a new file in `logs/` named after the current time."""
+    now = datetime.now()
+    logger.setLevel(logging.INFO)
+
+    output_file_handler = logging.FileHandler(f"logs/{now}.log")
+    stdout_handler = logging.StreamHandler(sys.stdout)
+
+    logger.addHandler(output_file_handler)
+    logger.addHandler(stdout_handler)
+
+
+def setup_database(pool_size: int) -> None:
+    """Make the models use a pool of connections to the database defined in `dbconfig.py`.
+
+    **Keyword arguments:**
+     - pool_size (int) -- The number of connections, one for every thread which may run a query
+    """
+    from dbconfig import DATABASES
+
+    setup_connection_pool(DATABASES, pool_size)
 
 
 """
@@ -58,6 +101,8 @@ Handlers
 
 
 def command_start(update: Update, context: CallbackContext) -> None:
+    from models.user import User
+
     user_id = update.effective_user.id
     username = update.effective_user.username
 
@@ -108,6 +153,8 @@ def show_module_selector(update: Update, context: CallbackContext) -> None:
 
 
 def handle_music_message(update: Update, context: CallbackContext) -> None:
+    from models.user import User
+
     message = update.message
     user_id = update.effective_user.id
     user_data = context.user_data
@@ -120,10 +167,8 @@ def handle_music_message(update: Update, context: CallbackContext) -> None:
         message.reply_text(translate_key_to('ERR_TOO_LARGE_FILE', user_data['language']))
         return
 
-    context.bot.send_chat_action(
-        chat_id=message.chat_id,
-        action=ChatAction.TYPING
-    )
+    if not check_rate_limit(update, context, 'upload'):
+        return
 
     try:
         create_user_directory(user_id)
@@ -132,56 +177,38 @@ def handle_music_message(update: Update, context: CallbackContext) -> None:
         logger.error(f"Couldn't create directory for user {user_id}", exc_info=True)
         return
 
-    try:
-        file_download_path = download_file(
-            user_id=user_id,
-            file_to_download=message.audio,
-            file_type='audio',
-            context=context
-        )
-    except ValueError:
-        message.reply_text(translate_key_to('ERR_ON_DOWNLOAD_AUDIO_MESSAGE', user_data['language']))
-        logger.error(f"Error on downloading {user_id}'s file. File type: Audio", exc_info=True)
-        return
-
-    try:
-        music = music_tag.load_file(file_download_path)
-    except (OSError, NotImplementedError):
-        message.reply_text(translate_key_to('ERR_ON_READING_TAGS', user_data['language']))
-        logger.error(f"Error on reading the tags {user_id}'s file. File path: {file_download_path}", exc_info=True)
+    if user_data['current_active_module'] == 'batch':
+        add_track_to_batch(update, context)
         return
 
     reset_user_data_context(context)
 
-    user_data['music_path'] = file_download_path
-    user_data['art_path'] = ''
+    user_data['music_file_id'] = message.audio.file_id
+    user_data['music_file_unique_id'] = message.audio.file_unique_id
+    user_data['music_file_size'] = message.audio.file_size or 0
     user_data['music_message_id'] = message.message_id
     user_data['music_duration'] = message.audio.duration
 
     tag_editor_context = user_data['tag_editor']
 
-    artist = music['artist']
-    title = music['title']
-    album = music['album']
-    genre = music['genre']
-    art = music['artwork']
-    year = music.raw['year']
-    disknumber = music.raw['disknumber']
-    tracknumber = music.raw['tracknumber']
-
-    if art:
-        art_path = user_data['art_path'] = f"{file_download_path}.jpg"
-        art_file = open(art_path, 'wb')
-        art_file.write(art.first.data)
-        art_file.close()
-
-    tag_editor_context['artist'] = str(artist)
-    tag_editor_context['title'] = str(title)
-    tag_editor_context['album'] = str(album)
-    tag_editor_context['genre'] = str(genre)
-    tag_editor_context['year'] = str(year)
-    tag_editor_context['disknumber'] = str(disknumber)
-    tag_editor_context['tracknumber'] = str(tracknumber)
+    tag_editor_context['artist'] = message.audio.performer if message.audio.performer else ''
+    tag_editor_context['title'] = message.audio.title if message.audio.title else ''
+    tag_editor_context['album'] = ''
+    tag_editor_context['genre'] = ''
+    tag_editor_context['year'] = ''
+    tag_editor_context['disknumber'] = ''
+    tag_editor_context['tracknumber'] = ''
+
+    if DOWNLOAD_MODE == 'eager':
+        context.bot.send_chat_action(
+            chat_id=message.chat_id,
+            action=ChatAction.TYPING
+        )
+
+        if not ensure_music_downloaded(update, context):
+            return
+    elif DOWNLOAD_MODE == 'speculative':
+        context.dispatcher.run_async(tracer.bind(prefetch_music), update, context, update=update)
 
     show_module_selector(update, context)
 
@@ -196,7 +223,377 @@ def handle_music_message(update: Update, context: CallbackContext) -> None:
     delete_file(old_new_art_path)
 
 
+def ensure_music_downloaded(update: Update, context: CallbackContext, reply_on_error: bool = True) -> bool:
+    """Download the music of the current session and read its tags, unless it is already downloaded. Tags that
+    were prefilled from `message.audio` are replaced with the ones in the file.
+
+    **Keyword arguments:**
+     - update (Update) -- The update which needs the music
+     - context (CallbackContext) -- The context object of the user
+     - reply_on_error (bool) -- Whether to tell the user if something goes wrong
+
+    **Returns:**
+     `True` if the music is on the disk
+    """
+    user_id = update.effective_user.id
+    user_data = context.user_data
+
+    while True:
+        music_file_id = user_data['music_file_id']
+
+        if user_data['music_path']:
+            return True
+        if not music_file_id:
+            return False
+
+        download_key = (user_id, music_file_id)
+
+        with downloads_lock:
+            download_over = downloads_in_progress.get(download_key)
+
+            if not download_over:
+                downloads_in_progress[download_key] = threading.Event()
+                break
+
+        # Another thread is already downloading the music; if it fails, this one tries again
+        download_over.wait()
+
+    try:
+        return download_music(update, context, music_file_id, reply_on_error)
+    finally:
+        with downloads_lock:
+            downloads_in_progress.pop(download_key).set()
+
+
+def download_music(update: Update, context: CallbackContext, music_file_id: str, reply_on_error: bool) -> bool:
+    """Download a music for `ensure_music_downloaded` and read its tags into the current session.
+
+    **Keyword arguments:**
+     - update (Update) -- The update which needs the music
+     - context (CallbackContext) -- The context object of the user
+     - music_file_id (str) -- The file id of the music
+     - reply_on_error (bool) -- Whether to tell the user if something goes wrong
+
+    **Returns:**
+     `True` if the music is on the disk
+    """
+    import music_tag
+
+    user_id = update.effective_user.id
+    user_data = context.user_data
+    lang = user_data['language']
+
+    ticket = admit_media_work(update, context, user_data['music_file_size'], 0, reply_on_error)
+
+    if not ticket:
+        return False
+
+    try:
+        file_download_path = download_file(
+            user_id=user_id,
+            file_to_download=context.bot.get_file(music_file_id),
+            file_type='audio',
+            context=context
+        )
+    except (ValueError, BaseException):
+        if reply_on_error:
+            update.effective_message.reply_text(translate_key_to('ERR_ON_DOWNLOAD_AUDIO_MESSAGE', lang))
+        logger.error(f"Error on downloading {user_id}'s file. File type: Audio", exc_info=True)
+        return False
+    finally:
+        admission_controller.release(ticket)
+
+    try:
+        with tracer.span('read_tags'):
+            music = music_tag.load_file(file_download_path)
+    except (OSError, NotImplementedError):
+        if reply_on_error:
+            update.effective_message.reply_text(translate_key_to('ERR_ON_READING_TAGS', lang))
+        logger.error(f"Error on reading the tags {user_id}'s file. File path: {file_download_path}", exc_info=True)
+        delete_file(file_download_path)
+        return False
+
+    if user_data['music_file_id'] != music_file_id:
+        # The user has sent another file in the meantime
+        delete_file(file_download_path)
+        return False
+
+    user_data['music_path'] = file_download_path
+
+    tag_editor_context = user_data['tag_editor']
+
+    for tag, value in (
+            ('artist', music['artist']),
+            ('title', music['title']),
+            ('album', music['album']),
+            ('genre', music['genre']),
+            ('year', music.raw['year']),
+            ('disknumber', music.raw['disknumber']),
+            ('tracknumber', music.raw['tracknumber']),
+    ):
+        if str(value):
+            tag_editor_context[tag] = str(value)
+
+    return True
+
+
+def prefetch_music(update: Update, context: CallbackContext) -> None:
+    ensure_music_downloaded(update, context, reply_on_error=False)
+
+
+def admit_media_work(update: Update, context: CallbackContext, file_size: int, duration: int,
+                     reply_on_error: bool = True, processes: int = 1) -> AdmissionTicket:
+    """Ask the admission controller for room for a piece of media work. If the bot is too busy, the user is told
+    how long to wait before trying again.
+
+    **Keyword arguments:**
+     - update (Update) -- The update which needs the work
+     - context (CallbackContext) -- The context object of the user
+     - file_size (int) -- The size of the file to download in bytes, 0 if it is already downloaded
+     - duration (int) -- The duration of the audio to encode in seconds, 0 if nothing is encoded
+     - reply_on_error (bool) -- Whether to tell the user if the work is not admitted
+     - processes (int) -- The most processes the work can run on at once
+
+    **Returns:**
+     The ticket to release once the work is done, or `None` if the work is not admitted
+    """
+    ticket, retry_after = admission_controller.try_admit(file_size, duration, processes)
+
+    if not ticket:
+        logger.warning(f"Rejected media work of user {update.effective_user.id}, retry after {retry_after}s. "
+                       f"Queue depth: {admission_controller.queue_depth}")
+
+        if reply_on_error:
+            update.effective_message.reply_text(
+                translate_key_to('ERR_BUSY', context.user_data['language']).format(retry_after)
+            )
+
+    return ticket
+
+
+def run_admitted_job(bot: ScheduledBot, job: dict, ticket: AdmissionTicket, module: str) -> None:
+    """Run a media job on a thread of `run_async`, so that the dispatcher goes on with the updates of other users
+    in the meantime, and give its room back to the admission controller once it is done.
+
+    **Keyword arguments:**
+     - bot (ScheduledBot) -- The bot to download and send the files with
+     - job (dict) -- The job, created from the user's session
+     - ticket (AdmissionTicket) -- The ticket the job was admitted with
+     - module (str) -- The module to record the usage of if the result is sent
+    """
+    try:
+        if run_job(bot, job):
+            usage_recorder.record(job['user_id'], module)
+    finally:
+        admission_controller.release(ticket)
+
+
+def check_rate_limit(update: Update, context: CallbackContext, kind: str) -> bool:
+    """Take a token from the user's bucket for an expensive operation. If the bucket is empty, the user is told
+    how long to wait before trying again. Admins are not limited.
+
+    **Keyword arguments:**
+     - update (Update) -- The update which asks for the operation
+     - context (CallbackContext) -- The context object of the user
+     - kind (str) -- The kind of the operation, either 'upload', 'conversion' or 'cut'
+
+    **Returns:**
+     `True` if the operation is allowed
+    """
+    retry_after = rate_limiter.try_acquire(kind, update.effective_user.id)
+
+    if retry_after:
+        logger.info(f"Rate limited {kind} of user {update.effective_user.id}, retry after {retry_after}s.")
+        update.effective_message.reply_text(
+            translate_key_to('ERR_RATE_LIMITED', context.user_data['language']).format(retry_after)
+        )
+        return False
+
+    return True
+
+
+def command_batch(update: Update, context: CallbackContext) -> None:
+    user_id = update.effective_user.id
+    user_data = context.user_data
+
+    reset_user_data_context(context)
+
+    try:
+        create_user_directory(user_id)
+    except OSError:
+        update.message.reply_text(translate_key_to('ERR_CREATING_USER_FOLDER', user_data['language']))
+        logger.error(f"Couldn't create directory for user {user_id}", exc_info=True)
+        return
+
+    user_data['current_active_module'] = 'batch'
+
+    tag_editor_context = user_data['tag_editor']
+    tag_editor_context['current_tag'] = ''
+
+    for tag in ['artist', 'title', 'album', 'genre', 'year', 'disknumber', 'tracknumber']:
+        tag_editor_context[tag] = ''
+
+    update.message.reply_text(
+        translate_key_to('BATCH_STARTED', user_data['language']),
+        reply_markup=generate_batch_keyboard(user_data['language'])
+    )
+
+
+def add_track_to_batch(update: Update, context: CallbackContext) -> None:
+    message = update.message
+    user_data = context.user_data
+    batch_files = user_data['batch_files']
+    lang = user_data['language']
+
+    if len(batch_files) >= BATCH_MAX_FILES:
+        message.reply_text(translate_key_to('ERR_BATCH_FULL', lang).format(BATCH_MAX_FILES))
+        return
+
+    batch_files.append({
+        'file_id': message.audio.file_id,
+        'file_size': message.audio.file_size or 0,
+        'duration': message.audio.duration,
+        'message_id': message.message_id,
+    })
+
+    message.reply_text(
+        translate_key_to('BATCH_TRACK_ADDED', lang).format(len(batch_files)),
+        reply_to_message_id=message.message_id,
+        reply_markup=generate_batch_keyboard(lang)
+    )
+
+
+def finish_batch(update: Update, context: CallbackContext) -> None:
+    message = update.message
+    user_data = context.user_data
+    batch_files = user_data['batch_files']
+    lang = user_data['language']
+
+    if not batch_files:
+        message.reply_text(translate_key_to('ERR_BATCH_EMPTY', lang))
+        return
+
+    ticket = admit_media_work(update, context, sum(track['file_size'] for track in batch_files), 0)
+
+    if not ticket:
+        return
+
+    # The downloads, the tagging and the uploads of a batch take long, the dispatcher goes on with the updates of
+    # other users in the meantime
+    context.dispatcher.run_async(tracer.bind(run_admitted_batch), update, context, ticket, update=update)
+
+
+def run_admitted_batch(update: Update, context: CallbackContext, ticket: AdmissionTicket) -> None:
+    """Process a batch on a thread of `run_async`, and give its room back to the admission controller once it is
+    done.
+
+    **Keyword arguments:**
+     - update (Update) -- The update which finished the batch
+     - context (CallbackContext) -- The context object of the user
+     - ticket (AdmissionTicket) -- The ticket the batch was admitted with
+    """
+    try:
+        process_batch(update, context)
+    finally:
+        admission_controller.release(ticket)
+
+
+def process_batch(update: Update, context: CallbackContext) -> None:
+    message = update.message
+    user_id = update.effective_user.id
+    user_data = context.user_data
+    # The user may go on sending messages while the batch is processed
+    batch_files = list(user_data['batch_files'])
+    new_art_path = user_data['new_art_path']
+    shared_tags = {tag: user_data['tag_editor'][tag] for tag in BATCH_SHARED_TAGS}
+    lang = user_data['language']
+
+    start_over_button_keyboard = generate_start_over_keyboard(lang)
+
+    context.bot.send_chat_action(
+        chat_id=message.chat_id,
+        action=ChatAction.UPLOAD_AUDIO
+    )
+
+    def download_track(track: dict) -> str:
+        return download_file(
+            user_id=user_id,
+            file_to_download=context.bot.get_file(track['file_id']),
+            file_type='audio',
+            context=context
+        )
+
+    with ThreadPoolExecutor(max_workers=BATCH_DOWNLOAD_THREADS) as executor:
+        download_futures = [executor.submit(download_track, track) for track in batch_files]
+
+    music_paths = []
+
+    for future in download_futures:
+        try:
+            music_paths.append(future.result())
+        except (ValueError, BaseException):
+            logger.error(f"Error on downloading {user_id}'s file. File type: Audio", exc_info=True)
+
+    if len(music_paths) != len(batch_files):
+        message.reply_text(translate_key_to('ERR_ON_DOWNLOAD_AUDIO_MESSAGE', lang))
+
+        for music_path in music_paths:
+            delete_file(music_path)
+
+        return
+
+    try:
+        save_batch_tags_to_files(music_paths, shared_tags, new_art_path)
+    except (OSError, BaseException):
+        message.reply_text(translate_key_to('ERR_ON_UPDATING_TAGS', lang), reply_markup=start_over_button_keyboard)
+        logger.error(f"Error on updating tags for {user_id}'s batch.", exc_info=True)
+
+        for music_path in music_paths:
+            delete_file(music_path)
+
+        reset_user_data_context(context)
+
+        return
+
+    thumbnail_path = generate_thumbnail(new_art_path)
+
+    try:
+        # A media group can hold up to 10 items
+        for chunk_start in range(0, len(music_paths), 10):
+            context.bot.send_media_group(
+                chat_id=message.chat_id,
+                media=[
+                    InputMediaAudio(
+                        media=open_for_upload(music_path),
+                        thumb=open_for_upload(thumbnail_path) if thumbnail_path else None,
+                        duration=track['duration'],
+                        caption=f"{BOT_USERNAME}",
+                    )
+                    for music_path, track in zip(
+                        music_paths[chunk_start:chunk_start + 10],
+                        batch_files[chunk_start:chunk_start + 10]
+                    )
+                ],
+                reply_to_message_id=batch_files[chunk_start]['message_id']
+            )
+
+        message.reply_text(translate_key_to('DONE', lang), reply_markup=start_over_button_keyboard)
+    except (TelegramError, BaseException) as e:
+        message.reply_text(
+            translate_key_to('ERR_ON_UPLOADING', lang),
+            reply_markup=start_over_button_keyboard
+        )
+        logger.exception(f"Telegram error: {e}")
+
+    for music_path in music_paths:
+        delete_file(music_path)
+
+    reset_user_data_context(context)
+
+
 def add_admin(update: Update, context: CallbackContext) -> None:
+    from models.admin import Admin
+
     user_id = update.message.text.partition(' ')[2]
     user_id = int(user_id)
 
@@ -210,6 +607,8 @@ def add_admin(update: Update, context: CallbackContext) -> None:
 
 
 def del_admin(update: Update, context: CallbackContext) -> None:
+    from models.admin import Admin
+
     user_id = update.message.text.partition(' ')[2]
     # TODO: Check if the value is of type `int`
     user_id = int(user_id)
@@ -228,33 +627,79 @@ def send_to_all():
 
 
 def count_users(update: Update, context: CallbackContext) -> None:
+    from models.user import User
+
+    if is_user_admin(update.effective_user.id):
+        persian_users = User.where('language', 'fa').count()
+        english_users = User.where('language', 'en').count()
+
+        update.message.reply_text(
+            f"{persian_users + english_users} users are using this bot!\n\n"
+            f"English users: {english_users}\n"
+            f"Persian users: {persian_users}"
+        )
+
+
+def command_usage(update: Update, context: CallbackContext) -> None:
+    """Show how much every module was used in the last 7 days, from the daily rollup."""
     if is_user_admin(update.effective_user.id):
-        persian_users = User.all().where('language', 'fa')
-        english_users = User.all().where('language', 'en')
+        summary = get_usage_summary(days=7)
+
+        if not summary:
+            update.message.reply_text("No usage in the last 7 days.")
+            return
 
         update.message.reply_text(
-            f"{len(persian_users) + len(english_users)} users are using this bot!\n\n"
-            f"English users: {len(english_users)}\n"
-            f"Persian users: {len(persian_users)}"
+            "Usage in the last 7 days:\n\n" + '\n'.join(
+                f"{module}: {events} times, {users_today} users today"
+                for module, (events, users_today) in sorted(summary.items())
+            )
         )
 
 
+def command_metrics(update: Update, context: CallbackContext) -> None:
+    if is_user_admin(update.effective_user.id):
+        update.message.reply_text(f"```\n{metrics.render()}```")
+
+
 def handle_music_tag_editor(update: Update, context: CallbackContext) -> None:
     message = update.message
     user_data = context.user_data
-    art_path = user_data['art_path']
-    lang = user_data['language']
+
+    context.bot.send_chat_action(
+        chat_id=message.chat_id,
+        action=ChatAction.TYPING
+    )
+
+    if not ensure_music_downloaded(update, context):
+        return
 
     user_data['current_active_module'] = 'tag_editor'
+    user_data['tag_editor']['current_tag'] = ''
+
+    # Fingerprinting decodes the music and runs an FFT over it, the dispatcher goes on with the updates of other
+    # users in the meantime
+    context.dispatcher.run_async(tracer.bind(show_tag_editor), update, context, update=update)
+
+
+def show_tag_editor(update: Update, context: CallbackContext) -> None:
+    """Fill in the tags the music is missing from an earlier upload of it, then show the tag editor with the tags
+    and the artwork of the music.
+    """
+    message = update.message
+    user_data = context.user_data
 
+    reuse_previous_upload(update, context)
+
+    art_path = user_data['new_art_path'] or extract_artwork(user_data)
+    lang = user_data['language']
     tag_editor_context = user_data['tag_editor']
-    tag_editor_context['current_tag'] = ''
 
     tag_editor_keyboard = generate_tag_editor_keyboard(lang)
 
     if art_path:
         message.reply_photo(
-            photo=open(art_path, 'rb'),
+            photo=open_for_upload(art_path),
             caption=generate_music_info(tag_editor_context).format(BOT_USERNAME),
             reply_to_message_id=update.effective_message.message_id,
             reply_markup=tag_editor_keyboard,
@@ -268,49 +713,117 @@ def handle_music_tag_editor(update: Update, context: CallbackContext) -> None:
         )
 
 
+def reuse_previous_upload(update: Update, context: CallbackContext) -> None:
+    """Look the music up in the fingerprint index. If the same audio was tagged before, possibly as another file,
+    fill in the tags the file is missing and suggest the artwork from back then. A music which is not in the index
+    yet is added, so that only the id of its entry is kept in the session, rather than the fingerprint itself.
+    """
+    user_data = context.user_data
+    user_id = update.effective_user.id
+
+    if user_data.get('music_fingerprint_id') is not None:
+        return
+
+    try:
+        fingerprint = fingerprint_file(user_data['music_path'])
+
+        if fingerprint is None:
+            return
+
+        index = get_fingerprint_index()
+        fingerprint_id, tags, art_path = index.find(fingerprint)
+
+        if fingerprint_id is None:
+            user_data['music_fingerprint_id'] = index.save(fingerprint, {}, '')
+            return
+    except (OSError, BaseException):
+        logger.error(f"Error on fingerprinting {user_id}'s file.", exc_info=True)
+        return
+
+    user_data['music_fingerprint_id'] = fingerprint_id
+    tag_editor_context = user_data['tag_editor']
+    reused = False
+
+    for tag, value in tags.items():
+        if value and not tag_editor_context.get(tag):
+            tag_editor_context[tag] = value
+            reused = True
+
+    if art_path and os.path.exists(art_path) and not user_data['new_art_path'] and not extract_artwork(user_data):
+        new_art_path = f"downloads/{user_id}/{os.path.basename(art_path)}"
+        link_or_clone_file(art_path, new_art_path)
+        user_data['new_art_path'] = new_art_path
+        reused = True
+
+    # The music may have been seen but never tagged, or already have everything it was given back then
+    if reused:
+        update.message.reply_text(translate_key_to('FINGERPRINT_MATCH', user_data['language']))
+
+
+def remember_tags(update: Update, context: CallbackContext) -> None:
+    """Save the tags and the artwork the user gave the music in the fingerprint index, for the next upload of the
+    same audio.
+    """
+    user_data = context.user_data
+    fingerprint_id = user_data.get('music_fingerprint_id')
+
+    if fingerprint_id is None:
+        return
+
+    tags = {tag: value for tag, value in user_data['tag_editor'].items() if tag != 'current_tag'}
+
+    try:
+        get_fingerprint_index().save(
+            fingerprint=None,
+            tags=tags,
+            art_path=cache_artwork(user_data['new_art_path'] or extract_artwork(user_data)),
+            fingerprint_id=fingerprint_id
+        )
+    except (OSError, BaseException):
+        logger.error(f"Error on saving the fingerprint of {update.effective_user.id}'s file.", exc_info=True)
+
+
 def handle_music_to_voice_converter(update: Update, context: CallbackContext) -> None:
     message = update.message
+
+    if not check_rate_limit(update, context, 'conversion'):
+        return
+
     context.bot.send_chat_action(
         chat_id=update.message.chat_id,
         action=ChatAction.RECORD_AUDIO
     )
 
     user_data = context.user_data
-    input_music_path = user_data['music_path']
-    voice_path = f"{user_data['music_path']}.ogg"
-    lang = user_data['language']
-    user_data['current_active_module'] = 'mp3_to_voice_converter'  # TODO: Make modules a dict
-
-    os.system(f"ffmpeg -i -y {input_music_path} -ac 1 -map 0:a -codec:a opus -b:a 128k -vbr off {input_music_path}")
-    os.system(f"ffmpeg -i {input_music_path} -c:a libvorbis -q:a 4 {voice_path}")
 
-    start_over_button_keyboard = generate_start_over_keyboard(lang)
+    if not ensure_music_downloaded(update, context):
+        return
 
-    context.bot.send_chat_action(
-        chat_id=update.message.chat_id,
-        action=ChatAction.UPLOAD_AUDIO
-    )
+    user_data['current_active_module'] = 'mp3_to_voice_converter'  # TODO: Make modules a dict
 
-    try:
-        context.bot.send_voice(
-            voice=open(voice_path, 'rb'),
-            duration=user_data['music_duration'],
-            chat_id=message.chat_id,
-            caption=f"{BOT_USERNAME}",
-            reply_markup=start_over_button_keyboard,
-            reply_to_message_id=user_data['music_message_id']
-        )
-    except TelegramError as e:
-        message.reply_text(
-            translate_key_to('ERR_ON_UPLOADING', lang),
-            reply_markup=start_over_button_keyboard
-        )
-        logger.exception(f"Telegram error: {e}")
+    ticket = admit_media_work(update, context, 0, user_data['music_duration'],
+                              processes=count_encoding_processes(user_data['music_duration']))
 
-    delete_file(voice_path)
+    if not ticket:
+        return
 
+    job = get_job_journal().create('voice', update.effective_user.id, message.chat_id, {
+        'file_id': user_data['music_file_id'],
+        'music_path': user_data['music_path'],
+        'duration': user_data['music_duration'],
+        'segments': ticket.processes,
+        'reply_to_message_id': user_data['music_message_id'],
+        'language': user_data['language'],
+        'owns_files': True,
+    })
+
+    # The job deletes the music once it is done with it
+    user_data['music_path'] = ''
     reset_user_data_context(context)
 
+    context.dispatcher.run_async(tracer.bind(run_admitted_job), context.bot, job, ticket, MODULE_VOICE_CONVERTER,
+                                 update=update)
+
 
 def handle_music_cutter(update: Update, context: CallbackContext) -> None:
     user_data = context.user_data
@@ -319,12 +832,45 @@ def handle_music_cutter(update: Update, context: CallbackContext) -> None:
 
     back_button_keyboard = generate_back_button_keyboard(lang)
 
-    # TODO: Send back the length of the music
     update.message.reply_text(
         translate_key_to('MUSIC_CUTTER_HELP', lang),
         reply_markup=back_button_keyboard
     )
 
+    # Download the file and draw its waveform while the user is reading the help
+    context.dispatcher.run_async(tracer.bind(send_waveform_preview), update, context, update=update)
+
+
+def send_waveform_preview(update: Update, context: CallbackContext) -> None:
+    """Send the waveform of the music on a timeline, so that the user can pick the range to cut on the first try.
+    Nothing is sent if the waveform can't be made; the user can still cut the music without it.
+    """
+    user_data = context.user_data
+    music_file_id = user_data['music_file_id']
+
+    if not ensure_music_downloaded(update, context, reply_on_error=False):
+        return
+
+    try:
+        waveform_path = generate_waveform(
+            music_path=user_data['music_path'],
+            cache_key=user_data.get('music_file_unique_id') or music_file_id,
+            duration=user_data['music_duration']
+        )
+    except (OSError, BaseException):
+        logger.error(f"Error on drawing the waveform of {update.effective_user.id}'s file.", exc_info=True)
+        return
+
+    if not waveform_path or user_data['music_file_id'] != music_file_id:
+        return
+
+    update.message.reply_photo(
+        photo=open_for_upload(waveform_path),
+        caption=translate_key_to('WAVEFORM_CAPTION', user_data['language']).format(
+            convert_seconds_to_human_readable_form(user_data['music_duration'])
+        )
+    )
+
 
 def handle_music_bitrate_changer(update: Update, context: CallbackContext) -> None:
     throw_not_implemented(update, context)
@@ -335,25 +881,25 @@ def handle_photo_message(update: Update, context: CallbackContext) -> None:
     user_data = context.user_data
     message = update.message
     user_id = update.effective_user.id
-    music_path = user_data['music_path']
+    music_file_id = user_data['music_file_id']
     current_active_module = user_data['current_active_module']
     current_tag = user_data['tag_editor']['current_tag']
     lang = user_data['language']
 
-    tag_editor_keyboard = generate_tag_editor_keyboard(lang)
+    tag_editor_keyboard = generate_batch_keyboard(lang) if current_active_module == 'batch' \
+        else generate_tag_editor_keyboard(lang)
 
-    if music_path:
-        if current_active_module == 'tag_editor':
+    if music_file_id or current_active_module == 'batch':
+        if current_active_module in ['tag_editor', 'batch']:
             if not current_tag or current_tag != 'album_art':
                 reply_message = translate_key_to('ASK_WHICH_TAG', lang)
                 message.reply_text(reply_message, reply_markup=tag_editor_keyboard)
                 return
             else:
                 try:
-                    file_download_path = download_file(
+                    file_download_path = normalize_artwork(
                         user_id=user_id,
-                        file_to_download=message.photo[0],
-                        file_type='photo',
+                        photo_sizes=message.photo,
                         context=context
                     )
                     reply_message = f"{translate_key_to('ALBUM_ART_CHANGED', lang)} " \
@@ -463,24 +1009,25 @@ def handle_responses(update: Update, context: CallbackContext) -> None:
     message = update.message
     message_text = message.text
     user_data = context.user_data
-    music_path = user_data['music_path']
-    art_path = user_data['art_path']
+    music_file_id = user_data['music_file_id']
     music_tags = user_data['tag_editor']
-    current_tag = music_tags['current_tag']
     lang = user_data['language']
 
     logging.info(f"{update.effective_user.id}:{update.effective_user.username}:{update.message.text}")
 
     current_active_module = user_data['current_active_module']
 
-    tag_editor_keyboard = generate_tag_editor_keyboard(lang)
+    tag_editor_keyboard = generate_batch_keyboard(lang) if current_active_module == 'batch' \
+        else generate_tag_editor_keyboard(lang)
 
     module_selector_keyboard = generate_module_selector_keyboard(lang)
 
     back_button_keyboard = generate_back_button_keyboard(lang)
-    start_over_button_keyboard = generate_start_over_keyboard(lang)
 
-    if current_active_module == 'tag_editor':
+    if current_active_module in ['tag_editor', 'batch']:
+        # Only the tag editors ask for a tag, the other modules may have no `current_tag`
+        current_tag = music_tags.get('current_tag')
+
         if not current_tag:
             reply_message = translate_key_to('ASK_WHICH_TAG', lang)
             message.reply_text(reply_message, reply_markup=tag_editor_keyboard)
@@ -503,17 +1050,21 @@ def handle_responses(update: Update, context: CallbackContext) -> None:
             message.reply_text(reply_message, reply_markup=tag_editor_keyboard)
     elif current_active_module == 'music_cutter':
         try:
-            beginning_sec, ending_sec = parse_cutting_range(message_text)
+            cutting_ranges = parse_cutting_ranges(message_text)
         except (ValueError, BaseException):
             reply_message = translate_key_to('ERR_MALFORMED_RANGE', lang).format(
                 translate_key_to('MUSIC_CUTTER_HELP', lang),
             )
             message.reply_text(reply_message, reply_markup=back_button_keyboard)
             return
-        music_path_cut = f"{music_path}_cut.mp3"
         music_duration = user_data['music_duration']
 
-        if beginning_sec > music_duration or ending_sec > music_duration:
+        if len(cutting_ranges) > MUSIC_CUTTER_MAX_CLIPS:
+            reply_message = translate_key_to('ERR_TOO_MANY_RANGES', lang).format(MUSIC_CUTTER_MAX_CLIPS)
+            message.reply_text(reply_message, reply_markup=back_button_keyboard)
+            return
+        if any(beginning_sec > music_duration or ending_sec > music_duration
+               for beginning_sec, ending_sec in cutting_ranges):
             reply_message = translate_key_to('ERR_OUT_OF_RANGE', lang).format(
                 convert_seconds_to_human_readable_form(music_duration))
             message.reply_text(reply_message)
@@ -522,7 +1073,7 @@ def handle_responses(update: Update, context: CallbackContext) -> None:
                 reply_markup=back_button_keyboard
             )
             return
-        if beginning_sec >= ending_sec:
+        if any(beginning_sec >= ending_sec for beginning_sec, ending_sec in cutting_ranges):
             reply_message = translate_key_to('ERR_BEGINNING_POINT_IS_GREATER', lang)
             message.reply_text(reply_message)
             message.reply_text(
@@ -531,50 +1082,47 @@ def handle_responses(update: Update, context: CallbackContext) -> None:
             )
             return
         else:
-            diff_sec = ending_sec - beginning_sec
+            if not check_rate_limit(update, context, 'cut'):
+                return
 
-            os.system(f"ffmpeg -y -ss {beginning_sec} -t {diff_sec} -i {music_path} -acodec copy {music_path_cut}")
+            if not ensure_music_downloaded(update, context):
+                return
 
-            try:
-                save_tags_to_file(
-                    file=music_path_cut,
-                    tags=music_tags,
-                    new_art_path=art_path if art_path else ''
-                )
-            except (OSError, BaseException):
-                update.message.reply_text(translate_key_to('ERR_ON_UPDATING_TAGS', lang))
-                logger.error(f"Error on updating tags for file {music_path_cut}'s file.", exc_info=True)
-
-            try:
-                # FIXME: After sending the file, the album art can't be read back
-                context.bot.send_audio(
-                    audio=open(music_path_cut, 'rb'),
-                    chat_id=update.message.chat_id,
-                    duration=diff_sec,
-                    caption=f"*From*: {convert_seconds_to_human_readable_form(beginning_sec)}\n"
-                            f"*To*: {convert_seconds_to_human_readable_form(ending_sec)}\n\n"
-                            f"{BOT_USERNAME}",
-                    reply_markup=start_over_button_keyboard,
-                    reply_to_message_id=user_data['music_message_id']
-                )
-            except (TelegramError, BaseException) as e:
-                message.reply_text(
-                    translate_key_to('ERR_ON_UPLOADING', lang),
-                    reply_markup=start_over_button_keyboard
-                )
-                logger.exception(f"Telegram error: {e}")
+            ticket = admit_media_work(
+                update, context, 0, sum(ending_sec - beginning_sec for beginning_sec, ending_sec in cutting_ranges)
+            )
 
-            delete_file(music_path_cut)
+            if not ticket:
+                return
 
+            art_path = extract_artwork(user_data)
+
+            job = get_job_journal().create('cut', update.effective_user.id, message.chat_id, {
+                'file_id': user_data['music_file_id'],
+                'music_path': user_data['music_path'],
+                'ranges': cutting_ranges,
+                'tags': music_tags,
+                'art_path': art_path,
+                'reply_to_message_id': user_data['music_message_id'],
+                'language': lang,
+                'owns_files': True,
+            })
+
+            # The job deletes the music and its artwork once it is done with them
+            user_data['music_path'] = ''
+            user_data['art_path'] = ''
             reset_user_data_context(context)
+
+            context.dispatcher.run_async(tracer.bind(run_admitted_job), context.bot, job, ticket,
+                                         MODULE_MUSIC_CUTTER, update=update)
     else:
-        if music_path:
+        if music_file_id:
             if user_data['current_active_module']:
                 message.reply_text(
                     translate_key_to('ASK_WHICH_MODULE', lang),
                     reply_markup=module_selector_keyboard
                 )
-        elif not music_path:
+        elif not music_file_id:
             message.reply_text(translate_key_to('START_OVER_MESSAGE', lang))
         else:
             # Not implemented
@@ -586,12 +1134,12 @@ def display_preview(update: Update, context: CallbackContext) -> None:
     message = update.message
     user_data = context.user_data
     tag_editor_context = user_data['tag_editor']
-    art_path = user_data['art_path']
+    art_path = extract_artwork(user_data)
     new_art_path = user_data['new_art_path']
 
     if art_path or new_art_path:
         message.reply_photo(
-            photo=open(new_art_path if new_art_path else art_path, "rb"),
+            photo=open_for_upload(new_art_path if new_art_path else art_path),
             caption=generate_music_info(tag_editor_context).format(BOT_USERNAME),
             reply_to_message_id=update.effective_message.message_id,
             parse_mode='Markdown'
@@ -607,11 +1155,18 @@ def finish_editing_tags(update: Update, context: CallbackContext) -> None:
     message = update.message
     user_data = context.user_data
 
+    if user_data['current_active_module'] == 'batch':
+        finish_batch(update, context)
+        return
+
     context.bot.send_chat_action(
         chat_id=update.message.chat_id,
         action=ChatAction.UPLOAD_AUDIO
     )
 
+    if not ensure_music_downloaded(update, context):
+        return
+
     music_path = user_data['music_path']
     new_art_path = user_data['new_art_path']
     music_tags = user_data['tag_editor']
@@ -626,12 +1181,17 @@ def finish_editing_tags(update: Update, context: CallbackContext) -> None:
     except (OSError, BaseException):
         message.reply_text(translate_key_to('ERR_ON_UPDATING_TAGS', lang))
         logger.error(f"Error on updating tags for file {music_path}'s file.", exc_info=True)
+    else:
+        remember_tags(update, context)
 
     start_over_button_keyboard = generate_start_over_keyboard(lang)
 
+    thumbnail_path = generate_thumbnail(new_art_path if new_art_path else extract_artwork(user_data))
+
     try:
         context.bot.send_audio(
-            audio=open(music_path, 'rb'),
+            audio=open_for_upload(music_path),
+            thumb=open_for_upload(thumbnail_path) if thumbnail_path else None,
             duration=user_data['music_duration'],
             chat_id=update.message.chat_id,
             caption=f"{BOT_USERNAME}",
@@ -644,6 +1204,8 @@ def finish_editing_tags(update: Update, context: CallbackContext) -> None:
             reply_markup=start_over_button_keyboard
         )
         logger.exception(f"Telegram error: {e}")
+    else:
+        usage_recorder.record(update.effective_user.id, MODULE_TAG_EDITOR)
 
     reset_user_data_context(context)
 
@@ -669,6 +1231,8 @@ def show_language_keyboard(update: Update, context: CallbackContext) -> None:
 
 
 def set_language(update: Update, context: CallbackContext) -> None:
+    from models.user import User
+
     lang = update.message.text.lower()
     user_data = context.user_data
     user_id = update.effective_user.id
@@ -691,23 +1255,25 @@ def ignore_file(update: Update, context: CallbackContext) -> None:
     update.message.reply_text(translate_key_to('START_OVER_MESSAGE', context.user_data['language']))
 
 
-def main():
-    defaults = Defaults(parse_mode=ParseMode.MARKDOWN, timeout=120)
-    persistence = PicklePersistence('persistence_storage')
+def register_handlers(dispatcher: Dispatcher) -> None:
+    from telegram.ext import CommandHandler, Filters, MessageHandler, TypeHandler
 
-    updater = Updater(BOT_TOKEN, persistence=persistence, defaults=defaults)
-    dispatcher = updater.dispatcher
+    dispatcher.add_handler(TypeHandler(Update, start_trace), group=-2)
+    dispatcher.add_handler(TypeHandler(Update, touch_session), group=-1)
 
     dispatcher.add_handler(CommandHandler('start', command_start))
     dispatcher.add_handler(CommandHandler('new', start_over))
     dispatcher.add_handler(CommandHandler('language', show_language_keyboard))
     dispatcher.add_handler(CommandHandler('help', command_help))
     dispatcher.add_handler(CommandHandler('about', command_about))
+    dispatcher.add_handler(CommandHandler('batch', command_batch))
 
     dispatcher.add_handler(CommandHandler('addadmin', add_admin))
     dispatcher.add_handler(CommandHandler('deladmin', del_admin))
     dispatcher.add_handler(CommandHandler('senttoall', send_to_all))
     dispatcher.add_handler(CommandHandler('countusers', count_users))
+    dispatcher.add_handler(CommandHandler('metrics', command_metrics))
+    dispatcher.add_handler(CommandHandler('usage', command_usage))
 
     dispatcher.add_handler(MessageHandler(Filters.audio & (~Filters.command), handle_music_message))
     dispatcher.add_handler(MessageHandler(Filters.photo & (~Filters.command), handle_photo_message))
@@ -770,9 +1336,81 @@ def main():
     dispatcher.add_handler(
         MessageHandler((Filters.video | Filters.document | Filters.contact) & (~Filters.command), ignore_file))
 
+    # The handlers above are in group 0, so this runs once one of them has handled the update
+    dispatcher.add_handler(TypeHandler(Update, release_database_connection), group=1)
+    dispatcher.add_handler(TypeHandler(Update, finish_trace), group=2)
+
+    dispatcher.add_error_handler(handle_error)
+
+
+def setup_worker(dispatcher: Dispatcher, shard: int) -> None:
+    """Prepare a worker process of `cluster.py` and add the handlers to its dispatcher."""
+    setup_logging()
+    # The dispatcher thread, the threads for `run_async` and the thread of the job queue
+    setup_database(pool_size=dispatcher.workers + 2)
+    register_handlers(dispatcher)
+    # Every worker writes the usage events of its own shard, but the rollups are built from all of them, so one
+    # worker is enough to keep them up to date
+    schedule_jobs(dispatcher, roll_up_usage=shard == 0)
+
+    dispatcher.run_async(resume_orphaned_jobs, dispatcher.bot)
+
+
+def schedule_jobs(dispatcher: Dispatcher, roll_up_usage: bool = True) -> None:
+    """Write the buffered usage events, update the usage rollups, evict idle sessions and look after the job journal
+    periodically.
+
+    **Keyword arguments:**
+     - dispatcher (Dispatcher) -- The dispatcher whose job queue runs the jobs
+     - roll_up_usage (bool) -- Whether this process updates the usage rollups, which only one process should do
+    """
+    dispatcher.job_queue.run_repeating(flush_usage, interval=USAGE_FLUSH_SECONDS, first=USAGE_FLUSH_SECONDS)
+
+    if roll_up_usage:
+        dispatcher.job_queue.run_repeating(roll_up_usage_job, interval=USAGE_ROLLUP_SECONDS,
+                                           first=USAGE_ROLLUP_SECONDS)
+
+    dispatcher.job_queue.run_repeating(sweep_sessions, interval=SESSION_SWEEP_SECONDS, first=SESSION_SWEEP_SECONDS)
+    dispatcher.job_queue.run_repeating(maintain_job_journal, interval=JOBS_HEARTBEAT_SECONDS,
+                                       first=JOBS_HEARTBEAT_SECONDS)
+
+
+def main():
+    from telegram.ext import Updater, Defaults
+    from utils.persistence import SessionPersistence
+    from utils.upload import StreamingRequest
+
+    setup_logging()
+
+    defaults = Defaults(parse_mode=ParseMode.MARKDOWN, timeout=120)
+    persistence = SessionPersistence('persistence_storage')
+
+    # One connection per worker of the dispatcher, plus the 4 the Updater would add for itself
+    bot = ScheduledBot(
+        BOT_TOKEN,
+        base_url=BOT_API_BASE_URL,
+        base_file_url=BOT_API_FILE_URL,
+        request=StreamingRequest(con_pool_size=4 + 4),
+        defaults=defaults
+    )
+
+    updater = Updater(bot=bot, persistence=persistence)
+
+    # The dispatcher thread, the threads for `run_async` and the thread of the job queue
+    setup_database(pool_size=updater.dispatcher.workers + 2)
+    register_handlers(updater.dispatcher)
+    schedule_jobs(updater.dispatcher)
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
+    updater.dispatcher.run_async(resume_orphaned_jobs, updater.bot)
+
     updater.start_polling()
     updater.idle()
 
+    usage_recorder.flush()
+
 
 if __name__ == '__main__':
     main()
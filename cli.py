@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""
+Applies the operations of the bot to local files, without Telegram: writes tags, cuts clips out of musics or converts
+them to voices, for every music in a directory or in a manifest.
+
+The files are processed in parallel on a process pool of `--workers` processes (`BATCH_WORKERS` by default). Every
+finished file is appended to the progress file in the output directory, so a run which was stopped can be started
+again with the same arguments and goes on with the files which are left. The time each file took, split by stage, is
+printed as it finishes and kept in the progress file.
+
+A manifest is a JSON lines file, one music per line. The tags, the artwork and the ranges of a line override the ones
+given on the command line for that music, e.g.:
+    {"path": "album/01.mp3", "tags": {"title": "Intro", "tracknumber": 1}, "ranges": "00:10-00:40, 01:30-02:00"}
+Relative paths are relative to the manifest.
+
+Usage: python cli.py tag musics/ --output tagged/ --tag artist="Some Artist" --tag year=2021 --art cover.jpg
+       python cli.py cut manifest.jsonl --output clips/ --ranges 0-30
+       python cli.py voice musics/ --output voices/ --workers 4
+"""
+
+"""
+Built-in modules
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+"""
+Third-party modules
+"""
+from dotenv import load_dotenv
+
+load_dotenv(verbose=True)
+
+"""
+My modules
+"""
+from utils import save_tags_to_file, parse_cutting_ranges
+from utils.batch import BATCH_WORKERS
+from utils.media import convert_to_voice, cut_music_clips, probe_audio, choose_media_path, choose_cut_extension
+
+"""
+Global variables
+"""
+OPERATION_TAG = 'tag'
+OPERATION_CUT = 'cut'
+OPERATION_VOICE = 'voice'
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+MUSIC_EXTENSIONS = ['.mp3', '.m4a', '.flac', '.ogg', '.opus', '.wav', '.aac', '.wma']
+TAGS = ['artist', 'title', 'album', 'genre', 'year', 'disknumber', 'tracknumber']
+PROGRESS_FILE = '.cli-progress.jsonl'
+
+
+def find_tasks(source: str, tags: dict, art_path: str, ranges: str) -> [dict]:
+    """List the musics to process: every music under a directory, or every line of a manifest.
+
+    **Keyword arguments:**
+     - source (str) -- A directory or a manifest
+     - tags (dict) -- The tags to write to every music
+     - art_path (str) -- The artwork to set for every music, an empty string to keep the music's own
+     - ranges (str) -- The ranges to cut out of every music
+
+    **Returns:**
+     A task for each music, in the order of the directory or the manifest
+    """
+    defaults = {'tags': tags, 'art': art_path, 'ranges': ranges}
+
+    if os.path.isdir(source):
+        return [
+            {**defaults, 'path': path, 'name': os.path.relpath(path, source)}
+            for path in sorted(
+                os.path.join(directory, file_name)
+                for directory, _, file_names in os.walk(source)
+                for file_name in file_names
+                if os.path.splitext(file_name)[1].lower() in MUSIC_EXTENSIONS
+            )
+        ]
+
+    tasks = []
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+
+    with open(source) as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+
+            entry = json.loads(line)
+            name = os.path.normpath(entry['path'])
+
+            tasks.append({
+                'path': os.path.join(manifest_dir, name),
+                # The results of a music outside of the manifest's directory go to the top of the output directory
+                'name': os.path.basename(name) if os.path.isabs(name) or name.startswith('..') else name,
+                'tags': {**tags, **entry.get('tags', {})},
+                'art': os.path.join(manifest_dir, entry['art']) if entry.get('art') else art_path,
+                'ranges': entry.get('ranges', ranges),
+            })
+
+    return tasks
+
+
+def process_music(operation: str, task: dict, output_dir: str) -> dict:
+    """Apply an operation to a music. Runs on a process of the pool.
+
+    **Keyword arguments:**
+     - operation (str) -- `OPERATION_TAG`, `OPERATION_CUT` or `OPERATION_VOICE`
+     - task (dict) -- What `find_tasks` found for the music
+     - output_dir (str) -- The directory to write the results to, under the same relative path as the music
+
+    **Returns:**
+     The status of the music, the paths of the results and the seconds each stage took
+    """
+    timings = {}
+    started_at = time.perf_counter()
+    # The extension of the music stays in the names of the results, so that `a.mp3` and `a.flac` of a directory
+    # don't overwrite each other's
+    output_stem = os.path.join(output_dir, task['name'])
+    result = {'name': task['name'], 'status': STATUS_DONE, 'outputs': [], 'timings': timings}
+
+    def timed(stage: str, function, *args, **kwargs):
+        stage_started_at = time.perf_counter()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage] = timings.get(stage, 0) + time.perf_counter() - stage_started_at
+
+    try:
+        os.makedirs(os.path.dirname(output_stem), exist_ok=True)
+        tags, duration, artwork = timed('read_tags', read_music, task['path'])
+        tags.update({tag: str(value) for tag, value in task['tags'].items() if tag in TAGS})
+
+        if operation == OPERATION_TAG:
+            output_path = output_stem
+            timed('copy', shutil.copyfile, task['path'], output_path)
+            result['outputs'] = [output_path]
+        else:
+            probe = timed('probe', probe_audio, task['path'])
+
+            if operation == OPERATION_VOICE:
+                output_path = f"{output_stem}.ogg"
+                # The musics are already converted in parallel, one per process of the pool
+                encoded = timed('ffmpeg', convert_to_voice, task['path'], output_path, int(duration), segments=1,
+                                media_path=choose_media_path(probe, 'ogg'))
+                result['outputs'] = [output_path]
+            else:
+                ranges = parse_cutting_ranges(task['ranges']) if isinstance(task['ranges'], str) \
+                    else [tuple(cutting_range) for cutting_range in task['ranges']]
+
+                if any(beginning_sec >= ending_sec or ending_sec > duration for beginning_sec, ending_sec in ranges):
+                    raise ValueError(f"A range is out of the music, which is {duration:.0f} seconds long")
+
+                extension = choose_cut_extension(probe)
+                result['outputs'] = [f"{output_stem}_cut_{index}.{extension}" for index in range(1, len(ranges) + 1)]
+                encoded = timed('ffmpeg', cut_music_clips, task['path'], [
+                    (output_path, beginning_sec, ending_sec)
+                    for output_path, (beginning_sec, ending_sec) in zip(result['outputs'], ranges)
+                ], choose_media_path(probe, extension))
+
+            if not encoded:
+                raise RuntimeError('ffmpeg failed')
+
+        # A voice has no tags to write
+        if operation != OPERATION_VOICE:
+            with artwork_file(task['art'], artwork, output_dir) as art_path:
+                for output_path in result['outputs']:
+                    timed('save_tags', save_tags_to_file, file=output_path, tags=tags, new_art_path=art_path)
+    except (OSError, BaseException) as error:
+        result['status'] = STATUS_FAILED
+        result['error'] = f"{type(error).__name__}: {error}"
+
+    result['seconds'] = time.perf_counter() - started_at
+
+    return result
+
+
+def read_music(path: str) -> (dict, float, bytes):
+    """Read the tags, the duration and the artwork of a music, like the bot does when a music is sent.
+
+    **Returns:**
+     The tags, the duration in seconds and the artwork, which is empty if the music has none
+    """
+    import music_tag
+
+    music = music_tag.load_file(path)
+    tags = {tag: str(music[tag]) if tag in ['artist', 'title', 'album', 'genre'] else str(music.raw[tag])
+            for tag in TAGS}
+    artwork = music['artwork']
+
+    return tags, float(music['#length'].value or 0), artwork.first.data if artwork else b''
+
+
+@contextmanager
+def artwork_file(art_path: str, artwork: bytes, temp_dir: str):
+    """The artwork to set: the one which was asked for, or else the artwork the music had, written to a temporary
+    file for `save_tags_to_file` which is deleted afterwards. An empty string if there is neither.
+    """
+    if art_path or not artwork:
+        yield art_path
+        return
+
+    with tempfile.NamedTemporaryFile(dir=temp_dir, suffix='.jpg', delete=False) as art:
+        art.write(artwork)
+
+    try:
+        yield art.name
+    finally:
+        os.remove(art.name)
+
+
+def read_progress(progress_path: str) -> dict:
+    """Read the results of the musics which were finished by the earlier runs.
+
+    **Returns:**
+     The last result of each music by its name
+    """
+    results = {}
+
+    if os.path.exists(progress_path):
+        with open(progress_path) as progress:
+            for line in progress:
+                # The last line is cut short if a run was killed while writing it
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+
+                results[result['name']] = result
+
+    return results
+
+
+def print_result(result: dict) -> None:
+    stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in result['timings'].items())
+
+    print(f"{result['seconds']:8.2f}s  {result['status']:<6}  {result['name']}  ({stages})"
+          + (f"  {result['error']}" if result.get('error') else ''), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write tags, cut or convert to voice local musics.')
+    parser.add_argument('operation', choices=[OPERATION_TAG, OPERATION_CUT, OPERATION_VOICE])
+    parser.add_argument('source', help='A directory of musics or a JSON lines manifest')
+    parser.add_argument('--output', required=True, help='The directory to write the results to')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--tag', action='append', default=[], metavar='NAME=VALUE',
+                        help=f"A tag to write, one of {', '.join(TAGS)}")
+    parser.add_argument('--art', default='', help='The artwork to set')
+    parser.add_argument('--ranges', default='', help='The ranges to cut, e.g. "00:10-00:40, 01:30-02:00"')
+    parser.add_argument('--restart', action='store_true', help='Forget the progress of earlier runs')
+    args = parser.parse_args()
+
+    tags = dict(tag.split('=', 1) for tag in args.tag)
+
+    if set(tags) - set(TAGS):
+        parser.error(f"Unknown tags: {', '.join(sorted(set(tags) - set(TAGS)))}")
+
+    os.makedirs(args.output, exist_ok=True)
+    progress_path = os.path.join(args.output, PROGRESS_FILE)
+
+    if args.restart and os.path.exists(progress_path):
+        os.remove(progress_path)
+
+    finished = {name for name, result in read_progress(progress_path).items() if result['status'] == STATUS_DONE}
+    output_dir = os.path.join(os.path.abspath(args.output), '')
+    # The results of an earlier run are not musics to process, should the output directory be in the source one
+    tasks = [
+        task for task in find_tasks(args.source, tags, os.path.abspath(args.art) if args.art else '', args.ranges)
+        if task['name'] not in finished and not os.path.abspath(task['path']).startswith(output_dir)
+    ]
+
+    print(f"{len(tasks)} musics to process, {len(finished)} done by earlier runs.", flush=True)
+
+    started_at = time.perf_counter()
+    results = []
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, open(progress_path, 'a') as progress:
+        futures = [executor.submit(process_music, args.operation, task, args.output) for task in tasks]
+
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            progress.write(json.dumps(result) + '\n')
+            progress.flush()
+            print_result(result)
+
+    failed = [result for result in results if result['status'] == STATUS_FAILED]
+    busy_seconds = sum(result['seconds'] for result in results)
+
+    print(f"{len(results) - len(failed)} done, {len(failed)} failed in {time.perf_counter() - started_at:.2f}s "
+          f"({busy_seconds / len(results) if results else 0:.2f}s per music, {args.workers} at a time).")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
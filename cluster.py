@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""
+Runs the bot as one ingest process and `CLUSTER_WORKERS` worker processes.
+
+The ingest process receives updates (long polling, or a webhook if `CLUSTER_WEBHOOK_URL` is set) and shards them by
+`user_id` over the workers. Each worker runs its own dispatcher which handles the updates of its shard one by one,
+so the updates of a user are always handled in order and by the same process. That is why `user_data` can stay
+in a per-worker persistence file. The other shared state (artwork and thumbnail caches) is on the disk and written
+atomically, so workers can share it.
+
+Changing the number of workers moves users to other shards, which means their sessions start over.
+"""
+
+"""
+Built-in modules
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import defaultdict
+from queue import Queue
+
+"""
+Third-party modules
+"""
+from dotenv import load_dotenv
+from telegram import Update, ParseMode
+from telegram.ext import Updater, Dispatcher, JobQueue, TypeHandler, Defaults, CallbackContext
+
+load_dotenv(verbose=True)
+
+"""
+My modules
+"""
+from utils.admission import admission_controller, ADMISSION_CAPACITY
+from utils.outbound import ScheduledBot, OutboundScheduler, OUTBOUND_GLOBAL_PER_SECOND, OUTBOUND_CHAT_PER_SECOND, \
+    OUTBOUND_CHAT_BURST, OUTBOUND_MAX_CONCURRENT_UPLOADS
+from utils.persistence import SessionPersistence
+from utils.session import Session
+from utils.upload import StreamingRequest
+from utils.usage import usage_recorder
+
+"""
+Global variables
+"""
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL") if os.getenv("BOT_API_BASE_URL") else None
+BOT_API_FILE_URL = os.getenv("BOT_API_FILE_URL") if os.getenv("BOT_API_FILE_URL") else None
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS")) if os.getenv("CLUSTER_WORKERS") else os.cpu_count()
+CLUSTER_ASYNC_THREADS = int(os.getenv("CLUSTER_ASYNC_THREADS")) if os.getenv("CLUSTER_ASYNC_THREADS") else 4
+CLUSTER_WEBHOOK_URL = os.getenv("CLUSTER_WEBHOOK_URL")
+CLUSTER_WEBHOOK_PORT = int(os.getenv("CLUSTER_WEBHOOK_PORT")) if os.getenv("CLUSTER_WEBHOOK_PORT") else 8443
+
+logger = logging.getLogger()
+
+
+def shard_for(update: Update, shards: int) -> int:
+    """Find the shard which handles the given update. Updates without a user go to the first shard.
+
+    **Keyword arguments:**
+     - update (Update) -- The update to route
+     - shards (int) -- The number of shards
+
+    **Returns:**
+     The index of the shard
+    """
+    user = update.effective_user
+
+    return user.id % shards if user else 0
+
+
+def dispatch_update(update: Update, shard_queues: list) -> None:
+    """Put an update in the queue of its shard.
+
+    **Keyword arguments:**
+     - update (Update) -- The update to route
+     - shard_queues (list) -- The queues of the workers, one per shard
+    """
+    shard_queues[shard_for(update, len(shard_queues))].put(update.to_dict())
+
+
+def run_worker(shard: int, shard_queue, token: str, register_handlers, persistence_path: str = None,
+               async_threads: int = CLUSTER_ASYNC_THREADS, ready=None, shards: int = 1) -> None:
+    """The target of a worker process. Handles the updates of a shard until it receives `None`.
+
+    **Keyword arguments:**
+     - shard (int) -- The index of the shard
+     - shard_queue (multiprocessing.Queue) -- The queue to read the updates of the shard from
+     - token (str) -- The bot token
+     - register_handlers (callable) -- A function that adds the handlers to the dispatcher, given the dispatcher
+       and the index of the shard
+     - persistence_path (str) -- The file to keep the `user_data` of this shard in
+     - async_threads (int) -- The number of threads of the dispatcher for `run_async`
+     - ready (multiprocessing.Event) -- Set once the worker is ready to handle updates
+     - shards (int) -- The number of shards, which share the global rate limit of the bot
+    """
+    # The ingest process stops the workers once it has stopped receiving updates
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # The workers share the cores of the host, and the work each of them admits is spread over its own share
+    admission_controller.capacity = max(ADMISSION_CAPACITY / shards, 1)
+
+    # Chats never change shards, so each worker can keep the limits of its own chats
+    scheduler = OutboundScheduler(
+        global_per_second=OUTBOUND_GLOBAL_PER_SECOND / shards,
+        chat_per_second=OUTBOUND_CHAT_PER_SECOND,
+        chat_burst=OUTBOUND_CHAT_BURST,
+        max_concurrent_uploads=OUTBOUND_MAX_CONCURRENT_UPLOADS,
+    )
+    bot = ScheduledBot(
+        token,
+        base_url=BOT_API_BASE_URL,
+        base_file_url=BOT_API_FILE_URL,
+        request=StreamingRequest(con_pool_size=async_threads + 2),
+        defaults=Defaults(parse_mode=ParseMode.MARKDOWN, timeout=120),
+        scheduler=scheduler
+    )
+    persistence = SessionPersistence(persistence_path) if persistence_path else None
+    job_queue = JobQueue()
+
+    dispatcher = Dispatcher(bot, Queue(), workers=async_threads, job_queue=job_queue, persistence=persistence)
+    job_queue.set_dispatcher(dispatcher)
+
+    if not persistence:
+        # `SessionPersistence` hands out sessions; without it, the dispatcher would hand out plain `dict`s
+        dispatcher.user_data = defaultdict(Session)
+
+    register_handlers(dispatcher, shard)
+
+    dispatcher_thread = threading.Thread(target=dispatcher.start, name=f"dispatcher-{shard}")
+    dispatcher_thread.start()
+    job_queue.start()
+
+    if ready is not None:
+        ready.set()
+
+    while True:
+        update_data = shard_queue.get()
+
+        if update_data is None:
+            break
+
+        dispatcher.update_queue.put(Update.de_json(update_data, bot))
+
+    # `stop` waits until the updates which are already queued are handled
+    dispatcher.stop()
+    dispatcher_thread.join()
+    job_queue.stop()
+
+    # The usage events of the last few seconds are still in memory
+    usage_recorder.flush()
+
+    if persistence:
+        persistence.flush()
+
+
+def start_workers(shards: int, token: str, register_handlers, persistence_prefix: str = None,
+                  async_threads: int = CLUSTER_ASYNC_THREADS) -> (list, list):
+    """Start one worker process per shard and wait until all of them are ready.
+
+    **Keyword arguments:**
+     - shards (int) -- The number of workers
+     - token (str) -- The bot token
+     - register_handlers (callable) -- A function that adds the handlers to the dispatcher, given the dispatcher
+       and the index of the shard
+     - persistence_prefix (str) -- The prefix of the persistence file of each shard
+     - async_threads (int) -- The number of threads of each dispatcher for `run_async`
+
+    **Returns:**
+     The queues and the processes of the workers
+    """
+    mp_context = multiprocessing.get_context('spawn')
+    shard_queues = []
+    workers = []
+    ready_events = []
+
+    for shard in range(shards):
+        shard_queue = mp_context.Queue()
+        ready = mp_context.Event()
+        worker = mp_context.Process(
+            target=run_worker,
+            args=(
+                shard,
+                shard_queue,
+                token,
+                register_handlers,
+                f"{persistence_prefix}_{shard}" if persistence_prefix else None,
+                async_threads,
+                ready,
+                shards,
+            ),
+            name=f"worker-{shard}",
+        )
+        worker.start()
+
+        shard_queues.append(shard_queue)
+        workers.append(worker)
+        ready_events.append(ready)
+
+    for ready in ready_events:
+        ready.wait()
+
+    return shard_queues, workers
+
+
+def stop_workers(shard_queues: list, workers: list) -> None:
+    """Ask the workers to stop once their queues are drained and wait for them.
+
+    **Keyword arguments:**
+     - shard_queues (list) -- The queues of the workers
+     - workers (list) -- The processes of the workers
+    """
+    for shard_queue in shard_queues:
+        shard_queue.put(None)
+
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    from bot import setup_logging, setup_worker
+
+    setup_logging()
+
+    shard_queues, workers = start_workers(CLUSTER_WORKERS, BOT_TOKEN, setup_worker, 'persistence_storage')
+
+    logger.info(f"Started {len(workers)} workers.")
+
+    def forward_update(update: Update, context: CallbackContext) -> None:
+        dispatch_update(update, shard_queues)
+
+    updater = Updater(BOT_TOKEN, base_url=BOT_API_BASE_URL, base_file_url=BOT_API_FILE_URL)
+    updater.dispatcher.add_handler(TypeHandler(Update, forward_update))
+
+    if CLUSTER_WEBHOOK_URL:
+        updater.start_webhook(
+            listen='0.0.0.0',
+            port=CLUSTER_WEBHOOK_PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{CLUSTER_WEBHOOK_URL}/{BOT_TOKEN}"
+        )
+    else:
+        updater.start_polling()
+
+    updater.idle()
+
+    stop_workers(shard_queues, workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,54 @@
 import os
+import sqlite3
 from orator import DatabaseManager
 
 from dotenv import load_dotenv
 
 load_dotenv(verbose=True)
 
+DB_CONNECTION = os.getenv("DB_CONNECTION") if os.getenv("DB_CONNECTION") else 'mysql'
 DB_HOST = os.getenv("DB_HOST") if os.getenv("DB_HOST") else 'localhost'
-DB_PORT = int(os.getenv("DB_PORT")) if int(os.getenv("DB_PORT")) else 3306
+DB_PORT = int(os.getenv("DB_PORT")) if os.getenv("DB_PORT") else 3306
 DB_USERNAME = os.getenv("DB_USERNAME") if os.getenv("DB_USERNAME") else ''
 DB_PASSWORD = os.getenv("DB_PASSWORD") if os.getenv("DB_PASSWORD") else ''
 DB_NAME = os.getenv("DB_NAME") if os.getenv("DB_NAME") else ''
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH") if os.getenv("DB_SQLITE_PATH") else 'database.sqlite3'
+DB_SQLITE_CACHE_MB = int(os.getenv("DB_SQLITE_CACHE_MB")) if os.getenv("DB_SQLITE_CACHE_MB") else 16
+
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    f"PRAGMA cache_size=-{DB_SQLITE_CACHE_MB * 1024}",
+    f"PRAGMA mmap_size={DB_SQLITE_CACHE_MB * 4 * 1024 * 1024}",
+)
+
+
+class TunedSQLiteConnection(sqlite3.Connection):
+    """A SQLite connection which sets the pragmas the bot runs best with as soon as it is opened, including when
+    orator reconnects.
+
+     - WAL lets the dispatcher threads (and the workers of `cluster.py`) read while another one writes
+     - synchronous=NORMAL is safe with WAL and only syncs on checkpoints instead of on every commit
+     - the page cache and memory mapped I/O keep the small tables of the bot in memory
+    """
+
+    pragmas = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        for pragma in self.pragmas:
+            self.execute(pragma)
+
+
+# The orator CLI runs this file with `exec`, where the class body and the methods can't see the module's names
+TunedSQLiteConnection.pragmas = SQLITE_PRAGMAS
+
 
 DATABASES = {
-    'default': 'mysql',
+    'default': DB_CONNECTION,
     'mysql': {
         'driver': 'mysql',
         'host': DB_HOST,
@@ -21,6 +57,15 @@ DATABASES = {
         'password': DB_PASSWORD,
         'database': DB_NAME,
         'prefix': ''
+    },
+    'sqlite': {
+        'driver': 'sqlite',
+        'database': DB_SQLITE_PATH,
+        'prefix': '',
+        # The dispatcher runs handlers on several threads; a writer waits up to `timeout` seconds for another one
+        'check_same_thread': False,
+        'timeout': 5,
+        'factory': TunedSQLiteConnection,
     }
 }
 
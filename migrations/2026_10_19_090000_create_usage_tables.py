@@ -0,0 +1,36 @@
+from orator.migrations import Migration
+
+
+class CreateUsageTables(Migration):
+
+    def up(self):
+        with self.schema.create('usage_events') as table:
+            table.big_increments('id')
+            table.big_integer('user_id')
+            table.string('module', 32)
+            table.datetime('created_at')
+
+            table.index('created_at')
+
+        with self.schema.create('usage_hourly') as table:
+            table.increments('id')
+            table.datetime('hour')
+            table.string('module', 32)
+            table.integer('events').default(0)
+            table.integer('users').default(0)
+
+            table.unique(['hour', 'module'])
+
+        with self.schema.create('usage_daily') as table:
+            table.increments('id')
+            table.date('day')
+            table.string('module', 32)
+            table.integer('events').default(0)
+            table.integer('users').default(0)
+
+            table.unique(['day', 'module'])
+
+    def down(self):
+        self.schema.drop('usage_daily')
+        self.schema.drop('usage_hourly')
+        self.schema.drop('usage_events')
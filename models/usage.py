@@ -0,0 +1,19 @@
+from orator import Model
+
+
+class UsageEvent(Model):
+    __table__ = 'usage_events'
+    __timestamps__ = False
+    __fillable__ = ['user_id', 'module', 'created_at']
+
+
+class UsageHourly(Model):
+    __table__ = 'usage_hourly'
+    __timestamps__ = False
+    __fillable__ = ['hour', 'module', 'events', 'users']
+
+
+class UsageDaily(Model):
+    __table__ = 'usage_daily'
+    __timestamps__ = False
+    __fillable__ = ['day', 'module', 'events', 'users']
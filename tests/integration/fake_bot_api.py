@@ -0,0 +1,326 @@
+import email
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+BOT_USER = {'id': 123456789, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}
+
+# The methods which deliver something to a chat, and so are what a user waits for
+SEND_METHODS = {'sendMessage', 'sendAudio', 'sendVoice', 'sendPhoto', 'sendMediaGroup', 'sendChatAction'}
+# Stands for the downloads of files in `FaultInjection.methods`
+DOWNLOAD = 'download'
+
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+OUTCOME_RETRY_AFTER = 'retry_after'
+
+# A frame of silence in MPEG-1 Layer III at 128 kbps and 44.1 kHz, i.e. a header and all zero side info
+SILENT_MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+SILENT_MP3_FRAME_SECONDS = 1152 / 44100
+
+
+class FaultInjection:
+    """What goes wrong with the requests of `methods`: each of them is delayed by `latency` seconds plus up to
+    `jitter`, then fails with a server error with the probability `error_rate`, or with `RetryAfter` asking to wait
+    `retry_after` seconds with the probability `retry_after_rate`.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 retry_after_rate: float = 0.0, retry_after: int = 1, methods: set = None, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.methods = SEND_METHODS | {DOWNLOAD} if methods is None else methods
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self, method: str) -> str:
+        """Delay a request and decide how it ends.
+
+        **Keyword arguments:**
+         - method (str) -- The method of the request, or `DOWNLOAD`
+
+        **Returns:**
+         `OUTCOME_OK`, `OUTCOME_ERROR` or `OUTCOME_RETRY_AFTER`
+        """
+        if method not in self.methods:
+            return OUTCOME_OK
+
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            draw = self._random.random()
+
+        if delay:
+            time.sleep(delay)
+
+        if draw < self.error_rate:
+            return OUTCOME_ERROR
+        if draw < self.error_rate + self.retry_after_rate:
+            return OUTCOME_RETRY_AFTER
+
+        return OUTCOME_OK
+
+
+class FakeBotApi:
+    """A Bot API server on localhost which plays Telegram for the bot: it hands out the updates pushed with
+    `send_text` and `send_music` through `getUpdates`, serves every file from `music_path` and answers `getFile`,
+    `sendMessage`, `sendAudio`, `sendVoice`, `sendPhoto` and `sendChatAction`, with the faults of `faults`.
+
+    Every request which gets through is passed to the listeners as `(method, chat_id, params)`, e.g. for a scripted
+    user to see the replies of the bot. Any other method is answered with `True`.
+    """
+
+    def __init__(self, music_path: str, faults: FaultInjection = None, token: str = FAKE_TOKEN):
+        self.music_path = music_path
+        self.faults = faults or FaultInjection()
+        self.token = token
+        # The number of requests by `(method, outcome)`
+        self.outcomes = Counter()
+        self.listeners = []
+
+        with open(music_path, 'rb') as music:
+            self._music = music.read()
+
+        self._condition = threading.Condition()
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._stopped = False
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), make_request_handler(self))
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/file/bot"
+
+    def start(self) -> 'FakeBotApi':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def send_text(self, user_id: int, text: str) -> int:
+        """Push a text message of a user, with the entity of the command if it is one.
+
+        **Returns:**
+         The id of the update
+        """
+        content = {'text': text}
+
+        if text.startswith('/'):
+            content['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split(' ')[0])}]
+
+        return self.push_message(user_id, content)
+
+    def send_music(self, user_id: int, duration: int) -> int:
+        """Push a music message of a user. Its file is `music_path`, whatever the file id.
+
+        **Returns:**
+         The id of the update
+        """
+        message_id = next(self._message_ids)
+
+        return self.push_message(user_id, {
+            'audio': {
+                'file_id': f"music-{user_id}-{message_id}",
+                'file_unique_id': f"unique-{user_id}-{message_id}",
+                'duration': duration,
+                'file_size': len(self._music),
+                'mime_type': 'audio/mpeg',
+                'performer': 'Artist',
+                'title': 'Title',
+            },
+        }, message_id)
+
+    def push_message(self, user_id: int, content: dict, message_id: int = None) -> int:
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+
+        return self.push_update({
+            'message': {
+                'message_id': message_id or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': user,
+                **content,
+            },
+        })
+
+    def push_update(self, update: dict) -> int:
+        with self._condition:
+            update_id = next(self._update_ids)
+            self._updates.append({'update_id': update_id, **update})
+            self._condition.notify_all()
+
+        return update_id
+
+    def get_updates(self, offset: int, limit: int, timeout: float) -> [dict]:
+        """Long poll for updates like `getUpdates`: the updates before `offset` are confirmed and dropped."""
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                self._updates = [update for update in self._updates if update['update_id'] >= offset]
+
+                if self._updates or self._stopped:
+                    return self._updates[:limit]
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    return []
+
+                self._condition.wait(remaining)
+
+    def call(self, method: str, params: dict) -> (int, dict):
+        """Answer a Bot API request.
+
+        **Returns:**
+         The HTTP status and the body of the response
+        """
+        outcome = self.faults.apply(method)
+
+        with self._condition:
+            self.outcomes[method, outcome] += 1
+
+        if outcome == OUTCOME_ERROR:
+            return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error: injected'}
+        if outcome == OUTCOME_RETRY_AFTER:
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.faults.retry_after}",
+                'parameters': {'retry_after': self.faults.retry_after},
+            }
+
+        chat_id = int(params['chat_id']) if str(params.get('chat_id', '')).lstrip('-').isdigit() else None
+
+        for listener in self.listeners:
+            listener(method, chat_id, params)
+
+        return 200, {'ok': True, 'result': self.make_result(method, chat_id, params)}
+
+    def make_result(self, method: str, chat_id: int, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self.get_updates(int(params.get('offset') or 0), int(params.get('limit') or 100),
+                                    float(params.get('timeout') or 0))
+        if method == 'getFile':
+            file_id = params['file_id']
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self._music),
+                    'file_path': f"music/{file_id}.mp3"}
+        if method == 'sendChatAction' or not method.startswith('send'):
+            return True
+
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+
+        if method == 'sendMessage':
+            message['text'] = params.get('text', '')
+        elif method == 'sendAudio':
+            message['audio'] = {'file_id': f"audio-{message['message_id']}", 'file_unique_id': 'audio', 'duration': 0}
+        elif method == 'sendVoice':
+            message['voice'] = {'file_id': f"voice-{message['message_id']}", 'file_unique_id': 'voice', 'duration': 0}
+        elif method == 'sendPhoto':
+            message['photo'] = [{'file_id': f"photo-{message['message_id']}", 'file_unique_id': 'photo', 'width': 1,
+                                 'height': 1}]
+        elif method == 'sendMediaGroup':
+            return [message for _ in json.loads(params.get('media') or '[]')]
+
+        return message
+
+    def download(self) -> (int, bytes):
+        outcome = self.faults.apply(DOWNLOAD)
+
+        with self._condition:
+            self.outcomes[DOWNLOAD, outcome] += 1
+
+        if outcome != OUTCOME_OK:
+            return 500, b''
+
+        return 200, self._music
+
+
+def make_request_handler(api: FakeBotApi):
+    class FakeBotApiRequestHandler(BaseHTTPRequestHandler):
+        # Keep the connections of the bot alive, as Telegram does, without waiting on Nagle between the headers and
+        # the body of a response
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            status, body = api.download()
+            self.respond(status, 'application/octet-stream', body)
+
+        def do_POST(self):
+            method = self.path.rsplit('/', 1)[-1]
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            status, response = api.call(method, parse_params(self.headers.get('Content-Type', ''), body))
+
+            self.respond(status, 'application/json', json.dumps(response).encode())
+
+        def respond(self, status: int, content_type: str, body: bytes) -> None:
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The bot has stopped in the middle of a long poll
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    return FakeBotApiRequestHandler
+
+
+def parse_params(content_type: str, body: bytes) -> dict:
+    """Read the parameters of a Bot API request, sent either as JSON or, with files, as `multipart/form-data`. A
+    file is replaced with its size.
+    """
+    if not body:
+        return {}
+
+    if not content_type.startswith('multipart/form-data'):
+        return json.loads(body)
+
+    form = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    params = {}
+
+    for part in form.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        value = part.get_payload(decode=True) or b''
+        params[name] = len(value) if part.get_filename() else value.decode()
+
+    return params
+
+
+def write_silent_mp3(path: str, seconds: float) -> None:
+    """Write an MP3 of silence, which is enough of a music for the tag editor and costs nothing to make."""
+    with open(path, 'wb') as music:
+        music.write(SILENT_MP3_FRAME * max(1, round(seconds / SILENT_MP3_FRAME_SECONDS)))
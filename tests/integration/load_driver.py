@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import defaultdict
+
+from tests.integration.fake_bot_api import FakeBotApi
+from utils.lang import keys, REPORT_BUG_MESSAGE_EN
+
+
+class Step:
+    """A message a scripted user sends, and the replies it waits for before its next step: `count` requests of the
+    bot to the user with one of `methods`. Any other request, e.g. a chat action, is not waited for.
+    """
+
+    def __init__(self, text: str = None, methods: set = None, count: int = 1):
+        """**Keyword arguments:**
+         - text (str) -- The text to send, or `None` to send the music
+         - methods (set) -- The methods of the replies to wait for, `sendMessage` by default
+         - count (int) -- The number of replies to wait for
+        """
+        self.text = text
+        self.methods = methods or {'sendMessage'}
+        self.count = count
+
+    @property
+    def name(self) -> str:
+        return self.text if self.text is not None else 'music'
+
+
+# The replies of the bot which say that it failed, rather than that the user has to wait or send something else
+FAILURE_TEXTS = (REPORT_BUG_MESSAGE_EN, keys['ERR_ON_UPLOADING']['en'])
+
+MUSIC = Step()
+ONBOARDING = [Step('/start', count=2), Step('🇬🇧 English', count=2)]
+FLOWS = {
+    'tag_editor': [
+        MUSIC,
+        Step('🎵 Tag Editor', {'sendMessage', 'sendPhoto'}),
+        Step('🎵 Title'),
+        Step('Load Test'),
+        Step('/done', {'sendAudio'}),
+    ],
+    'music_cutter': [
+        MUSIC,
+        Step('✂️ Music Cutter'),
+        Step('0:01-0:03', {'sendAudio'}),
+    ],
+    'voice_converter': [
+        MUSIC,
+        Step('🗣 Music to Voice Converter', {'sendVoice'}),
+    ],
+}
+
+
+class LoadDriver:
+    """Walks scripted users through the flows of the bot against a `FakeBotApi` and times every step, from the
+    message of the user to the last reply it waits for.
+
+    Every user first goes through `ONBOARDING`, then through one of `flows` in turn. A user who doesn't get the
+    replies of a step within `step_timeout` seconds gives up. So does a user whose step fails: the bot replies with
+    one of `FAILURE_TEXTS`, or raises while handling the update of the step, which whoever reads the log of the bot
+    reports with `on_bot_error`. Users are state machines which the replies of the bot move on, so thousands of them
+    need no thread of their own.
+    """
+
+    def __init__(self, api: FakeBotApi, users: int, flows: [str], ramp_up: float = 0.0, think_time: float = 0.0,
+                 step_timeout: float = 60.0, music_duration: int = 10, first_user_id: int = 1000):
+        self.api = api
+        self.users = users
+        self.flows = flows
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.step_timeout = step_timeout
+        self.music_duration = music_duration
+        self.first_user_id = first_user_id
+
+        # The seconds each step took, by '<flow>: <step>'
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.finished = 0
+        self.elapsed = 0.0
+
+        self._condition = threading.Condition()
+        # `(when, sequence, action, user_id, step)` for the scheduler thread
+        self._events = []
+        self._sequence = itertools.count()
+        self._walks = {}
+        # The user who sent each update
+        self._update_users = {}
+        self._active = 0
+
+    def run(self) -> 'LoadDriver':
+        """Walk all the users to the end of their flow, or until they give up.
+
+        **Returns:**
+         The driver itself, with the results
+        """
+        started_at = time.monotonic()
+        self.api.listeners.append(self.on_request)
+
+        with self._condition:
+            for index in range(self.users):
+                flow = self.flows[index % len(self.flows)]
+                user_id = self.first_user_id + index
+
+                self._walks[user_id] = {'flow': flow, 'steps': ONBOARDING + FLOWS[flow], 'step': -1}
+                self._schedule(started_at + self.ramp_up * index / self.users, self._send_next_step, user_id, -1)
+
+            self._active = self.users
+
+        try:
+            self._run_scheduler()
+        finally:
+            self.api.listeners.remove(self.on_request)
+
+        self.elapsed = time.monotonic() - started_at
+
+        return self
+
+    def on_request(self, method: str, chat_id: int, params: dict) -> None:
+        """Count a request of the bot to a user towards the step the user is waiting on."""
+        with self._condition:
+            walk = self._walks.get(chat_id)
+
+            if not walk or walk['step'] < 0 or walk.get('done'):
+                return
+
+            step = walk['steps'][walk['step']]
+
+            if method == 'sendMessage' and any(text in str(params.get('text', '')) for text in FAILURE_TEXTS):
+                self._fail(chat_id)
+                return
+
+            if method not in step.methods:
+                return
+
+            walk['replies'] += 1
+
+            if walk['replies'] < step.count:
+                return
+
+            self.latencies[f"{walk['flow']}: {step.name}"].append(time.monotonic() - walk['sent_at'])
+            walk['done'] = True
+            self._schedule(time.monotonic() + self.think_time, self._send_next_step, chat_id, walk['step'])
+
+    def on_bot_error(self, update_id: int) -> None:
+        """Fail the step of the user whose update the bot raised an exception on, if the user still waits on it."""
+        with self._condition:
+            user_id = self._update_users.get(update_id)
+            walk = self._walks.get(user_id)
+
+            if walk and walk.get('update_id') == update_id and not walk.get('done'):
+                self._fail(user_id)
+
+    def _fail(self, user_id: int) -> None:
+        walk = self._walks[user_id]
+
+        self.failures[f"{walk['flow']}: {walk['steps'][walk['step']].name}"] += 1
+        walk['done'] = True
+        self._active -= 1
+        self._condition.notify()
+
+    def _send_next_step(self, user_id: int, step_index: int) -> None:
+        walk = self._walks[user_id]
+        walk['step'] = step_index + 1
+
+        if walk['step'] == len(walk['steps']):
+            self.finished += 1
+            self._active -= 1
+            return
+
+        step = walk['steps'][walk['step']]
+        walk['replies'] = 0
+        walk['done'] = False
+        walk['sent_at'] = time.monotonic()
+
+        self._schedule(walk['sent_at'] + self.step_timeout, self._time_out, user_id, walk['step'])
+
+        if step.text is None:
+            walk['update_id'] = self.api.send_music(user_id, self.music_duration)
+        else:
+            walk['update_id'] = self.api.send_text(user_id, step.text)
+
+        self._update_users[walk['update_id']] = user_id
+
+    def _time_out(self, user_id: int, step_index: int) -> None:
+        walk = self._walks[user_id]
+
+        if walk['step'] != step_index or walk['done']:
+            return
+
+        self.timeouts[f"{walk['flow']}: {walk['steps'][step_index].name}"] += 1
+        walk['done'] = True
+        self._active -= 1
+
+    def _schedule(self, when: float, action, user_id: int, step_index: int) -> None:
+        heapq.heappush(self._events, (when, next(self._sequence), action, user_id, step_index))
+        self._condition.notify()
+
+    def _run_scheduler(self) -> None:
+        with self._condition:
+            while self._active:
+                if not self._events:
+                    self._condition.wait()
+                    continue
+
+                when, _, action, user_id, step_index = self._events[0]
+                remaining = when - time.monotonic()
+
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+
+                heapq.heappop(self._events)
+                action(user_id, step_index)
+
+
+def percentile(values: [float], percent: float) -> float:
+    """The nearest-rank percentile of some values, e.g. 99 for the p99."""
+    ordered = sorted(values)
+
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import music_tag
+
+from cli import find_tasks, process_music, read_progress, OPERATION_TAG, OPERATION_CUT, OPERATION_VOICE, STATUS_DONE, \
+    STATUS_FAILED
+from tests.integration.fake_bot_api import write_silent_mp3
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        self.source_dir = os.path.join(temp_dir.name, 'musics')
+        self.output_dir = os.path.join(temp_dir.name, 'output')
+        os.makedirs(os.path.join(self.source_dir, 'album'))
+
+        write_silent_mp3(os.path.join(self.source_dir, 'single.mp3'), 5)
+        write_silent_mp3(os.path.join(self.source_dir, 'album', '01.mp3'), 5)
+
+        with open(os.path.join(self.source_dir, 'cover.txt'), 'w') as not_a_music:
+            not_a_music.write('')
+
+    def test_finds_the_musics_of_a_directory_or_a_manifest(self):
+        manifest_path = os.path.join(self.source_dir, 'manifest.jsonl')
+
+        with open(manifest_path, 'w') as manifest:
+            manifest.write(json.dumps({'path': 'album/01.mp3', 'tags': {'title': 'Intro'}, 'ranges': '0-2'}) + '\n')
+
+        directory_tasks = find_tasks(self.source_dir, {'artist': 'Artist'}, '', '1-3')
+        manifest_task, = find_tasks(manifest_path, {'artist': 'Artist'}, '', '1-3')
+
+        self.assertEqual([task['name'] for task in directory_tasks], [os.path.join('album', '01.mp3'), 'single.mp3'])
+        self.assertEqual(manifest_task['path'], os.path.join(self.source_dir, 'album', '01.mp3'))
+        self.assertEqual(manifest_task['tags'], {'artist': 'Artist', 'title': 'Intro'})
+        self.assertEqual(manifest_task['ranges'], '0-2')
+
+    def test_tags_a_copy_of_the_music(self):
+        task, _ = find_tasks(self.source_dir, {'artist': 'Artist', 'year': '2021'}, '', '')
+
+        result = process_music(OPERATION_TAG, task, self.output_dir)
+        music = music_tag.load_file(result['outputs'][0])
+
+        self.assertEqual(result['status'], STATUS_DONE)
+        self.assertEqual(result['outputs'], [os.path.join(self.output_dir, 'album', '01.mp3')])
+        self.assertEqual((str(music['artist']), int(music['year'])), ('Artist', 2021))
+        self.assertEqual(str(music_tag.load_file(task['path'])['artist']), '')
+        self.assertEqual(set(result['timings']), {'read_tags', 'copy', 'save_tags'})
+
+    def test_converts_each_music_to_its_own_voice_in_one_piece(self):
+        _, task = find_tasks(self.source_dir, {}, '', '')
+
+        with mock.patch('cli.probe_audio', return_value=None), \
+                mock.patch('cli.convert_to_voice', return_value=True) as convert_to_voice:
+            result = process_music(OPERATION_VOICE, task, self.output_dir)
+
+        self.assertEqual(result['status'], STATUS_DONE)
+        # `single.flac` next to it would get a voice of its own
+        self.assertEqual(result['outputs'], [os.path.join(self.output_dir, 'single.mp3.ogg')])
+        self.assertEqual(convert_to_voice.call_args.kwargs['segments'], 1)
+
+    def test_fails_on_ranges_out_of_the_music(self):
+        task, _ = find_tasks(self.source_dir, {}, '', '0-2, 3-60')
+
+        result = process_music(OPERATION_CUT, task, self.output_dir)
+
+        self.assertEqual(result['status'], STATUS_FAILED)
+        self.assertIn('out of the music', result['error'])
+
+    def test_reads_the_progress_of_a_killed_run(self):
+        progress_path = os.path.join(self.source_dir, 'progress.jsonl')
+
+        with open(progress_path, 'w') as progress:
+            progress.write(json.dumps({'name': 'a.mp3', 'status': STATUS_FAILED}) + '\n')
+            progress.write(json.dumps({'name': 'a.mp3', 'status': STATUS_DONE}) + '\n')
+            progress.write('{"name": "b.mp3", "sta')
+
+        self.assertEqual(read_progress(progress_path), {'a.mp3': {'name': 'a.mp3', 'status': STATUS_DONE}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from telegram import Bot, InputMediaAudio
+from telegram.error import NetworkError, RetryAfter
+
+from tests.integration.fake_bot_api import FakeBotApi, FaultInjection, write_silent_mp3, FAKE_TOKEN, OUTCOME_OK, \
+    OUTCOME_ERROR
+from tests.integration.load_driver import LoadDriver, ONBOARDING, FLOWS
+from utils.upload import UploadFile, StreamingRequest
+
+
+class TestFakeBotApi(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        self.music_path = os.path.join(temp_dir.name, 'music.mp3')
+        write_silent_mp3(self.music_path, 5)
+
+        self.faults = FaultInjection(seed=1)
+        self.api = FakeBotApi(self.music_path, self.faults).start()
+        self.addCleanup(self.api.stop)
+
+        self.bot = Bot(FAKE_TOKEN, base_url=self.api.base_url, base_file_url=self.api.base_file_url)
+
+    def test_hands_out_pushed_updates(self):
+        self.api.send_text(1, '/start')
+        self.api.send_music(2, 5)
+
+        first, second = self.bot.get_updates(timeout=1)
+
+        self.assertEqual(first.message.text, '/start')
+        self.assertEqual(first.message.entities[0].type, 'bot_command')
+        self.assertEqual(second.effective_user.id, 2)
+        self.assertEqual(second.message.audio.duration, 5)
+        self.assertEqual(self.bot.get_updates(offset=second.update_id + 1, timeout=0), [])
+
+    def test_serves_the_music(self):
+        update = self.api.get_updates(self.api.send_music(1, 5), 1, 0)[0]
+
+        content = self.bot.get_file(update['message']['audio']['file_id']).download_as_bytearray()
+
+        with open(self.music_path, 'rb') as music:
+            self.assertEqual(bytes(content), music.read())
+
+    def test_tells_the_listeners_about_uploads(self):
+        requests = []
+        self.api.listeners.append(lambda *request: requests.append(request))
+
+        self.bot.send_audio(chat_id=1, audio=io.BytesIO(b'\x00' * 1000), duration=1)
+
+        method, chat_id, params = requests[0]
+
+        self.assertEqual((method, chat_id, params['audio']), ('sendAudio', 1, 1000))
+
+    def test_receives_streamed_uploads(self):
+        requests = []
+        self.api.listeners.append(lambda *request: requests.append(request))
+        bot = Bot(FAKE_TOKEN, base_url=self.api.base_url, request=StreamingRequest())
+        music_size = os.path.getsize(self.music_path)
+
+        bot.send_audio(chat_id=1, audio=UploadFile(self.music_path), thumb=UploadFile(self.music_path), duration=5)
+        bot.send_media_group(chat_id=1, media=[InputMediaAudio(UploadFile(self.music_path)) for _ in range(2)])
+
+        (_, _, audio), (_, _, media_group) = requests
+        attached = [media['media'].replace('attach://', '') for media in json.loads(media_group['media'])]
+
+        self.assertEqual((audio['audio'], audio['thumb'], audio['duration']), (music_size, music_size, '5'))
+        self.assertEqual([media_group[name] for name in attached], [music_size, music_size])
+
+    def test_injects_faults(self):
+        self.faults.error_rate = 1.0
+
+        with self.assertRaises(NetworkError):
+            self.bot.send_message(1, 'text')
+
+        self.faults.error_rate = 0.0
+        self.faults.retry_after_rate = 1.0
+        self.faults.retry_after = 7
+
+        with self.assertRaises(RetryAfter) as raised:
+            self.bot.send_message(1, 'text')
+
+        self.assertEqual(raised.exception.retry_after, 7)
+        self.assertEqual(self.api.outcomes['sendMessage', OUTCOME_ERROR], 1)
+        self.assertEqual(self.api.outcomes['sendMessage', OUTCOME_OK], 0)
+
+
+class TestLoadDriver(unittest.TestCase):
+    def test_walks_every_user_through_its_flow(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            music_path = os.path.join(temp_dir, 'music.mp3')
+            write_silent_mp3(music_path, 5)
+
+            api = FakeBotApi(music_path).start()
+            self.addCleanup(api.stop)
+
+            stopped = threading.Event()
+            threading.Thread(target=answer_everything, args=(api, stopped), daemon=True).start()
+            self.addCleanup(stopped.set)
+
+            driver = LoadDriver(api, users=6, flows=list(FLOWS), think_time=0.05, step_timeout=5).run()
+
+        self.assertEqual(driver.finished, 6)
+        self.assertFalse(driver.timeouts)
+
+        for flow in FLOWS:
+            for step in ONBOARDING + FLOWS[flow]:
+                self.assertEqual(len(driver.latencies[f"{flow}: {step.name}"]), 2)
+
+
+def answer_everything(api: FakeBotApi, stopped: threading.Event) -> None:
+    """Play a bot which answers every message with two texts, an audio and a voice."""
+    bot = Bot(FAKE_TOKEN, base_url=api.base_url)
+    offset = 0
+
+    while not stopped.is_set():
+        for update in api.get_updates(offset, 100, 0.1):
+            offset = update['update_id'] + 1
+            chat_id = update['message']['chat']['id']
+
+            bot.send_message(chat_id, 'first')
+            bot.send_message(chat_id, 'second')
+            bot.send_audio(chat_id, 'audio-file-id')
+            bot.send_voice(chat_id, 'voice-file-id')
+
+
+if __name__ == '__main__':
+    unittest.main()
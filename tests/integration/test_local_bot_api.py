@@ -0,0 +1,148 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from telegram import Bot
+
+import utils
+from tests.integration.fake_bot_api import parse_params
+from utils import download_file, open_for_upload
+from utils.upload import StreamingRequest
+
+FAKE_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+class StandInBotApi(BaseHTTPRequestHandler):
+    """Answers `getFile` with either the local path of a file, like a Bot API server in local mode, or a relative
+    path to download it from, like the cloud Bot API. Keeps the bodies of `send*` requests."""
+    file_path = None
+    local_mode = False
+    requests = []
+
+    def do_GET(self):
+        with open(StandInBotApi.file_path, 'rb') as served_file:
+            body = served_file.read()
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if method == 'getFile':
+            file_path = StandInBotApi.file_path if StandInBotApi.local_mode else 'music/file_0.mp3'
+            result = {'file_id': 'file-id', 'file_unique_id': 'unique', 'file_path': file_path}
+        else:
+            StandInBotApi.requests.append((method, self.headers.get('Content-Type'), body))
+            result = {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}}
+
+        response = json.dumps({'ok': True, 'result': result}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLocalBotApi(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        working_dir = os.getcwd()
+        os.chdir(temp_dir.name)
+        self.addCleanup(os.chdir, working_dir)
+
+        os.makedirs('server')
+        os.makedirs('downloads/1')
+
+        StandInBotApi.file_path = os.path.abspath('server/file_0.mp3')
+        StandInBotApi.requests = []
+
+        with open(StandInBotApi.file_path, 'wb') as served_file:
+            served_file.write(os.urandom(256 * 1024))
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StandInBotApi)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.bot = Bot(
+            FAKE_TOKEN,
+            base_url=f"http://127.0.0.1:{server.server_port}/bot",
+            base_file_url=f"http://127.0.0.1:{server.server_port}/file/bot",
+        )
+
+    def assert_same_content(self, first_path, second_path):
+        with open(first_path, 'rb') as first, open(second_path, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+
+    def test_downloads_over_http_from_the_cloud_api(self):
+        StandInBotApi.local_mode = False
+
+        path = download_file(1, self.bot.get_file('file-id'), 'audio', None)
+
+        self.assert_same_content(path, StandInBotApi.file_path)
+
+    def test_copies_audio_from_the_disk_in_local_mode(self):
+        StandInBotApi.local_mode = True
+
+        path = download_file(1, self.bot.get_file('file-id'), 'audio', None)
+
+        self.assert_same_content(path, StandInBotApi.file_path)
+        # The music is tagged in place later, which must not touch the server's copy
+        self.assertNotEqual(os.stat(path).st_ino, os.stat(StandInBotApi.file_path).st_ino)
+
+    def test_hardlinks_photos_in_local_mode(self):
+        StandInBotApi.local_mode = True
+        context = mock.Mock(bot=self.bot)
+
+        path = download_file(1, mock.Mock(file_id='file-id'), 'photo', context)
+
+        self.assertEqual(os.stat(path).st_ino, os.stat(StandInBotApi.file_path).st_ino)
+
+    def test_uploads_by_path_in_local_mode(self):
+        with mock.patch.object(utils, 'BOT_API_LOCAL_MODE', True):
+            self.bot.send_audio(chat_id=1, audio=open_for_upload('server/file_0.mp3'))
+
+        method, content_type, body = StandInBotApi.requests[0]
+
+        self.assertEqual(method, 'sendAudio')
+        self.assertEqual(content_type, 'application/json')
+        self.assertEqual(json.loads(body)['audio'], f"file://{StandInBotApi.file_path}")
+
+    def test_uploads_the_content_otherwise(self):
+        with mock.patch.object(utils, 'BOT_API_LOCAL_MODE', False):
+            self.bot.send_audio(chat_id=1, audio=open_for_upload('server/file_0.mp3'))
+
+        method, content_type, _ = StandInBotApi.requests[0]
+
+        self.assertEqual(method, 'sendAudio')
+        self.assertTrue(content_type.startswith('multipart/form-data'))
+
+    def test_streams_the_content_with_a_streaming_request(self):
+        bot = Bot(FAKE_TOKEN, base_url=self.bot.base_url, request=StreamingRequest())
+
+        with mock.patch.object(utils, 'BOT_API_LOCAL_MODE', False):
+            bot.send_audio(chat_id=1, audio=open_for_upload('server/file_0.mp3'), duration=5)
+
+        method, content_type, body = StandInBotApi.requests[0]
+        params = parse_params(content_type, body)
+
+        self.assertEqual(method, 'sendAudio')
+        self.assertEqual((params['chat_id'], params['duration'], params['audio']), ('1', '5', 256 * 1024))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+
+from utils.admission import AdmissionController
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self):
+        self.controller = AdmissionController(
+            capacity=2,
+            max_wait_seconds=10,
+            max_load_per_core=2.0,
+            min_free_memory_mb=100,
+        )
+        patcher_load = mock.patch('utils.admission.get_load_per_core', return_value=0.5)
+        patcher_memory = mock.patch('utils.admission.get_free_memory_mb', return_value=1000)
+        self.load = patcher_load.start()
+        self.memory = patcher_memory.start()
+        self.addCleanup(patcher_load.stop)
+        self.addCleanup(patcher_memory.stop)
+
+    def test_idle_controller_admits_anything(self):
+        ticket, retry_after = self.controller.try_admit(0, 3599)
+        self.assertIsNotNone(ticket)
+        self.assertEqual(retry_after, 0)
+
+    def test_rejects_when_backlog_is_full(self):
+        self.controller.try_admit(0, 400)
+
+        ticket, retry_after = self.controller.try_admit(0, 400)
+
+        self.assertIsNone(ticket)
+        self.assertGreater(retry_after, 0)
+
+    def test_release_makes_room(self):
+        ticket, _ = self.controller.try_admit(0, 400)
+        self.controller.release(ticket)
+
+        ticket, _ = self.controller.try_admit(0, 400)
+
+        self.assertIsNotNone(ticket)
+        self.assertEqual(self.controller.queue_depth, 1)
+
+    def test_gives_work_the_processes_of_idle_cores_only(self):
+        ticket, _ = self.controller.try_admit(0, 10, processes=4)
+
+        self.assertEqual(ticket.processes, 2)
+        self.assertEqual(self.controller.queue_depth, 2)
+
+        other_ticket, _ = self.controller.try_admit(0, 10, processes=4)
+
+        self.assertEqual(other_ticket.processes, 1)
+
+        self.controller.release(ticket)
+
+        self.assertEqual(self.controller.queue_depth, 1)
+
+    def test_rejects_when_host_is_overloaded(self):
+        self.load.return_value = 3.0
+
+        ticket, retry_after = self.controller.try_admit(0, 10)
+
+        self.assertIsNone(ticket)
+        self.assertGreaterEqual(retry_after, 10)
+
+    def test_rejects_when_memory_is_low(self):
+        self.memory.return_value = 50
+
+        ticket, _ = self.controller.try_admit(0, 10)
+
+        self.assertIsNone(ticket)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import artwork
+from utils.artwork import generate_thumbnail, normalize_artwork
+
+
+def write_output(args: [str], *_) -> bool:
+    with open(args[-1], 'wb') as output:
+        output.write(b'thumbnail')
+
+    return True
+
+
+class TestGenerateThumbnail(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+
+        patcher = mock.patch.object(artwork, 'THUMBNAIL_CACHE_DIR', os.path.join(self.temp_dir, 'thumbnails'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_passes_the_path_of_the_artwork_as_one_argument(self):
+        art_path = os.path.join(self.temp_dir, "it's; rm -rf ~.jpg")
+
+        with open(art_path, 'wb') as art:
+            art.write(b'artwork')
+
+        with mock.patch('utils.artwork.run_ffmpeg', side_effect=write_output) as run_ffmpeg:
+            thumbnail_path = generate_thumbnail(art_path)
+
+        self.assertIn(art_path, run_ffmpeg.call_args[0][0])
+
+        with open(thumbnail_path, 'rb') as thumbnail:
+            self.assertEqual(thumbnail.read(), b'thumbnail')
+
+    def test_leaves_no_temporary_file_when_ffmpeg_fails(self):
+        art_path = os.path.join(self.temp_dir, 'art.jpg')
+
+        with open(art_path, 'wb') as art:
+            art.write(b'artwork')
+
+        with mock.patch('utils.artwork.run_ffmpeg', return_value=False):
+            self.assertEqual(generate_thumbnail(art_path), '')
+
+        self.assertEqual(os.listdir(artwork.THUMBNAIL_CACHE_DIR), [])
+
+
+class TestNormalizeArtwork(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(temp_dir.name)
+        os.makedirs('downloads/1')
+
+        patcher = mock.patch.object(artwork, 'ARTWORK_CACHE_DIR', 'artworks')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.photo_size = mock.Mock(file_unique_id='photo', width=800, height=800, file_size=1000)
+
+    def download_photo(self, **_) -> str:
+        with open('downloads/1/download.jpg', 'wb') as photo:
+            photo.write(b'photo')
+
+        return 'downloads/1/download.jpg'
+
+    def test_caches_the_normalized_photo(self):
+        with mock.patch('utils.artwork.download_file', side_effect=self.download_photo), \
+                mock.patch('utils.artwork.run_ffmpeg', side_effect=write_output):
+            art_path = normalize_artwork(1, [self.photo_size], mock.Mock())
+
+        self.assertEqual(os.listdir('artworks'), ['photo.jpg'])
+        self.assertFalse(os.path.exists('downloads/1/download.jpg'))
+
+        with open(art_path, 'rb') as art:
+            self.assertEqual(art.read(), b'thumbnail')
+
+    def test_does_not_cache_the_photo_if_it_could_not_be_normalized(self):
+        with mock.patch('utils.artwork.download_file', side_effect=self.download_photo), \
+                mock.patch('utils.artwork.run_ffmpeg', return_value=False):
+            art_path = normalize_artwork(1, [self.photo_size], mock.Mock())
+
+        self.assertEqual(os.listdir('artworks'), [])
+
+        with open(art_path, 'rb') as art:
+            self.assertEqual(art.read(), b'photo')
+
+
+if __name__ == '__main__':
+    unittest.main()
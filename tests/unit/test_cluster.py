@@ -0,0 +1,34 @@
+import unittest
+
+from telegram import Update
+
+from cluster import shard_for
+
+
+def make_update(user_id: int) -> Update:
+    return Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+            'text': 'hi',
+        },
+    }, None)
+
+
+class TestShardFor(unittest.TestCase):
+    def test_same_user_same_shard(self):
+        self.assertEqual(shard_for(make_update(12345), 4), shard_for(make_update(12345), 4))
+
+    def test_users_are_spread(self):
+        shards = {shard_for(make_update(user_id), 4) for user_id in range(100, 108)}
+        self.assertEqual(shards, {0, 1, 2, 3})
+
+    def test_update_without_user(self):
+        self.assertEqual(shard_for(Update(update_id=1), 4), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import dbconfig
+from utils.db_pool import ConnectionPool, PoolTimeout
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        config = {
+            'default': 'sqlite',
+            'sqlite': dict(dbconfig.DATABASES['sqlite'], database=os.path.join(temp_dir.name, 'bot.sqlite3')),
+        }
+        self.pool = ConnectionPool(config, size=2, timeout=0.1)
+
+    def connection_of_another_thread(self, release: bool = True):
+        connections = []
+
+        def run():
+            connections.append(self.pool.connection())
+
+            if release:
+                self.pool.release()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        return connections[0]
+
+    def test_a_thread_keeps_its_connection_until_it_releases_it(self):
+        connection = self.pool.connection()
+
+        self.assertIs(self.pool.connection(), connection)
+        self.assertIsNot(self.connection_of_another_thread(), connection)
+
+        self.pool.release()
+
+        self.assertIs(self.connection_of_another_thread(), connection)
+
+    def test_waits_a_bounded_time_for_a_free_connection(self):
+        self.connection_of_another_thread(release=False)
+        self.connection_of_another_thread(release=False)
+
+        with self.assertRaises(PoolTimeout):
+            self.pool.connection()
+
+    def test_reconnects_a_stale_connection(self):
+        self.pool.pre_ping_after = 0
+
+        connection = self.pool.connection()
+        self.pool.release()
+        connection.get_connection().close()
+
+        self.assertIs(self.pool.connection(), connection)
+        self.assertEqual(connection.select('SELECT 1 AS one')[0]['one'], 1)
+
+    def test_rolls_back_a_transaction_left_open(self):
+        connection = self.pool.connection()
+        connection.statement('CREATE TABLE things (id INTEGER)')
+        connection.begin_transaction()
+        connection.insert('INSERT INTO things (id) VALUES (1)')
+
+        self.pool.release()
+
+        self.assertEqual(self.pool.connection().select('SELECT COUNT(*) AS count FROM things')[0]['count'], 0)
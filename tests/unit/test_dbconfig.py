@@ -0,0 +1,44 @@
+import glob
+import importlib
+import os
+import tempfile
+import unittest
+
+from orator import DatabaseManager, Model
+
+import dbconfig
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        config = dict(dbconfig.DATABASES['sqlite'], database=os.path.join(temp_dir.name, 'bot.sqlite3'))
+        self.db = DatabaseManager({'default': 'sqlite', 'sqlite': config})
+        self.addCleanup(self.db.disconnect)
+
+        Model.set_connection_resolver(self.db)
+
+    def test_sets_the_pragmas(self):
+        connection = self.db.connection()
+
+        self.assertEqual(connection.select('PRAGMA journal_mode')[0]['journal_mode'], 'wal')
+        self.assertEqual(connection.select('PRAGMA synchronous')[0]['synchronous'], 1)
+
+    def test_runs_the_migrations(self):
+        from models.admin import Admin
+        from models.user import User
+
+        for path in sorted(glob.glob('migrations/[0-9]*.py')):
+            module = importlib.import_module(f"migrations.{os.path.basename(path)[:-3]}")
+            migration = next(value for name, value in vars(module).items()
+                             if isinstance(value, type) and name != 'Migration' and hasattr(value, 'up'))()
+            migration.set_connection(self.db.connection())
+            migration.up()
+
+        User.create(user_id=1, username='someone', language='fa', number_of_files_sent=0)
+        Admin.create(admin_user_id=1, is_owner=True)
+
+        self.assertEqual(User.where('user_id', '=', 1).first().username, 'someone')
+        self.assertTrue(Admin.where('admin_user_id', '=', 1).where('is_owner', '=', True).first())
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from utils.fingerprint import FingerprintIndex, compute_fingerprint, SAMPLE_RATE, HOP
+
+
+def generate_melody(seed: int, seconds: int):
+    """Three random tones every quarter of a second."""
+    random = numpy.random.default_rng(seed)
+    time = numpy.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    frequencies = random.uniform(200, 1800, size=(seconds * 4, 3)).repeat(SAMPLE_RATE // 4 + 1, axis=0)[:len(time)]
+
+    return (numpy.sin(2 * numpy.pi * frequencies * time[:, numpy.newaxis]).sum(axis=1) * 6000).astype('<i2')
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.index = FingerprintIndex(os.path.join(temp_dir.name, 'fingerprints.sqlite3'))
+
+    def test_one_sub_fingerprint_per_hop(self):
+        fingerprint = compute_fingerprint(generate_melody(1, 10))
+
+        self.assertEqual(fingerprint.dtype, numpy.uint32)
+        self.assertAlmostEqual(len(fingerprint), SAMPLE_RATE * 10 / HOP, delta=40)
+
+    def test_finds_a_noisy_and_shifted_copy(self):
+        melody = generate_melody(1, 30)
+        fingerprint_id = self.index.save(compute_fingerprint(melody), {'title': 'Melody'}, '')
+
+        noise = numpy.random.default_rng(0).normal(0, 300, len(melody) - 1000)
+        copy = (melody[1000:] + noise).clip(-32768, 32767).astype('<i2')
+
+        self.assertEqual(self.index.find(compute_fingerprint(copy)), (fingerprint_id, {'title': 'Melody'}, ''))
+
+    def test_does_not_find_another_music(self):
+        self.index.save(compute_fingerprint(generate_melody(1, 30)), {'title': 'Melody'}, '')
+
+        self.assertEqual(self.index.find(compute_fingerprint(generate_melody(2, 30))), (None, None, None))
+
+    def test_save_updates_a_found_entry(self):
+        fingerprint = compute_fingerprint(generate_melody(1, 30))
+        fingerprint_id = self.index.save(fingerprint, {'title': 'Old'}, '')
+
+        self.index.save(fingerprint, {'title': 'New'}, 'art.jpg', fingerprint_id=fingerprint_id)
+
+        self.assertEqual(self.index.find(fingerprint), (fingerprint_id, {'title': 'New'}, 'art.jpg'))
+
+    def test_evicts_the_entries_seen_the_longest_ago(self):
+        self.index.max_entries = 2
+        first, second, third = [compute_fingerprint(generate_melody(seed, 30)) for seed in [1, 2, 3]]
+
+        first_id = self.index.save(first, {'title': 'First'}, '')
+        self.index.save(second, {'title': 'Second'}, '')
+        # Finding the first music again keeps it in the index
+        self.index.find(first)
+        self.index.save(third, {'title': 'Third'}, '')
+
+        self.assertEqual(self.index.find(first)[0], first_id)
+        self.assertEqual(self.index.find(second), (None, None, None))
+        self.assertEqual(self.index.find(third)[1], {'title': 'Third'})
+
+
+if __name__ == '__main__':
+    unittest.main()
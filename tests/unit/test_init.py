@@ -1,5 +1,7 @@
 import unittest
 
+from utils import parse_cutting_ranges
+
 
 class TestTest(unittest.TestCase):
     def test_first(self):
@@ -15,6 +17,16 @@ class TestTest(unittest.TestCase):
         self.assertEqual(sum([4, 3]), 7)
 
 
+class TestParseCuttingRanges(unittest.TestCase):
+    def test_parses_every_range(self):
+        self.assertEqual(parse_cutting_ranges('00:10-00:40, 1:30 - 2:00;\n75-120\n'), [(10, 40), (90, 120), (75, 120)])
+
+    def test_rejects_malformed_ranges(self):
+        for text in [', ', '10-20, 30', 'a-b']:
+            with self.assertRaises(ValueError):
+                parse_cutting_ranges(text)
+
+
 if __name__ == '__main__':
     print('Hi')
     unittest.main()
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from utils import jobs
+from utils.jobs import JobJournal, STAGE_CREATED, STAGE_DONE, STAGE_FAILED
+
+
+class TestJobJournal(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        self.path = os.path.join(temp_dir.name, 'jobs.sqlite3')
+
+    def open(self, owner: str) -> JobJournal:
+        journal = JobJournal(self.path, owner=owner)
+        self.addCleanup(journal._connection.close)
+
+        return journal
+
+    def test_resumes_the_jobs_of_a_restarted_instance_with_the_same_pid(self):
+        before_restart = self.open('before')
+        job = before_restart.create('voice', 1, 1, {'language': 'en'})
+
+        after_restart = self.open('after')
+
+        # The instance which was restarted is not given up on before it has missed its heartbeats
+        self.assertEqual(after_restart.claim_orphaned_jobs(owner_timeout=60), [])
+        self.assertEqual([claimed['id'] for claimed in after_restart.claim_orphaned_jobs(owner_timeout=0)],
+                         [job['id']])
+        self.assertEqual(self.open('another').claim_orphaned_jobs(owner_timeout=60), [])
+
+    def test_leaves_the_jobs_of_live_instances_alone(self):
+        worker = self.open('worker')
+        worker.create('cut', 1, 1, {'language': 'en'})
+        other_worker = self.open('other worker')
+
+        worker.heartbeat()
+
+        self.assertEqual(other_worker.claim_orphaned_jobs(owner_timeout=60), [])
+
+    def test_prunes_the_jobs_which_ended_long_ago(self):
+        journal = self.open('instance')
+        done, failed, running = [journal.create('voice', 1, 1, {}) for _ in range(3)]
+
+        journal.advance(done, STAGE_DONE)
+        journal.advance(failed, STAGE_FAILED)
+
+        self.assertEqual(journal.prune(retention_seconds=60), 0)
+
+        with mock.patch('utils.jobs.time.time', return_value=time.time() + 120):
+            self.assertEqual(journal.prune(retention_seconds=60), 2)
+
+        stages = journal._connection.execute('SELECT id, stage FROM jobs').fetchall()
+
+        self.assertEqual(stages, [(running['id'], STAGE_CREATED)])
+
+    def test_migrates_the_journals_owned_by_pids(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            'CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, user_id INTEGER NOT NULL,'
+            ' chat_id INTEGER NOT NULL, stage TEXT NOT NULL, inputs TEXT NOT NULL, outputs TEXT NOT NULL,'
+            ' owner_pid INTEGER NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        connection.execute(
+            "INSERT INTO jobs VALUES (7, 'voice', 1, 1, 'encoded', '{}', '{}', ?, 0, 0)", (os.getpid(),)
+        )
+        connection.commit()
+        connection.close()
+
+        journal = self.open('instance')
+
+        self.assertEqual([job['id'] for job in journal.claim_orphaned_jobs()], [7])
+        self.assertEqual(journal.create('cut', 1, 1, {})['id'], 8)
+
+
+class TestEncodeJob(unittest.TestCase):
+    @mock.patch('utils.jobs.save_tags_to_file')
+    @mock.patch('utils.jobs.get_job_journal')
+    @mock.patch('utils.jobs.cut_music_clips', return_value=False)
+    @mock.patch('utils.jobs.probe_audio', return_value={})
+    def test_tells_the_user_when_ffmpeg_fails(self, _, cut_music_clips, get_job_journal, save_tags_to_file):
+        bot = mock.Mock()
+        job = {'id': 1, 'kind': 'cut', 'chat_id': 2, 'stage': STAGE_CREATED, 'outputs': {},
+               'inputs': {'language': 'en', 'ranges': [[0, 10]], 'tags': {}, 'art_path': ''}}
+
+        self.assertEqual(jobs.encode_job(bot, job, 'music.mp3', mock.Mock()), [])
+
+        save_tags_to_file.assert_not_called()
+        get_job_journal.return_value.advance.assert_not_called()
+        bot.send_message.assert_called_once_with(2, jobs.translate_key_to('ERR_ON_ENCODING', 'en'),
+                                                 reply_markup=mock.ANY)
+
+
+class TestRunJob(unittest.TestCase):
+    @mock.patch('utils.jobs.ProgressReporter')
+    @mock.patch('utils.jobs.get_job_journal')
+    @mock.patch('utils.jobs.send_job_result', side_effect=RuntimeError)
+    def test_fails_and_cleans_up_a_job_which_raises(self, _, get_job_journal, __):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            music_path, voice_path = os.path.join(temp_dir, 'music.mp3'), os.path.join(temp_dir, 'voice.ogg')
+
+            for path in (music_path, voice_path):
+                open(path, 'wb').close()
+
+            job = {'id': 1, 'kind': 'voice', 'chat_id': 2, 'stage': STAGE_CREATED, 'outputs': {},
+                   'inputs': {'language': 'en', 'music_path': music_path, 'owns_files': True}}
+
+            with mock.patch('utils.jobs.encode_job', return_value=[voice_path]):
+                self.assertFalse(jobs.run_job(mock.Mock(), job))
+
+            self.assertEqual(os.listdir(temp_dir), [])
+
+        get_job_journal.return_value.advance.assert_called_once_with(job, STAGE_FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
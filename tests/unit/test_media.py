@@ -0,0 +1,211 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from utils.media import plan_segments, probe_audio, choose_media_path, choose_cut_extension, cut_music, \
+    cut_music_clips, convert_to_voice, count_encoding_processes, encode_in_segments, find_grid_shift, \
+    join_vorbis_segments, ogg_crc, read_ogg_packets, OggWriter, SEGMENT_FRAME_SAMPLES, SEGMENT_SAMPLE_RATE, \
+    MEDIA_PATH_COPY, MEDIA_PATH_REMUX, MEDIA_PATH_TRANSCODE
+
+
+class TestPlanSegments(unittest.TestCase):
+    def test_segments_cover_the_whole_duration(self):
+        segments = plan_segments(3599, 4)
+
+        self.assertEqual(len(segments), 4)
+        self.assertEqual(segments[0][0], 0)
+        self.assertEqual(segments[-1][1], 3599)
+
+        for (_, ending), (beginning, _) in zip(segments, segments[1:]):
+            self.assertEqual(ending, beginning)
+
+    def test_boundaries_fall_on_frames(self):
+        for beginning, _ in plan_segments(1000.3, 7):
+            frames = beginning * SEGMENT_SAMPLE_RATE / SEGMENT_FRAME_SAMPLES
+            self.assertAlmostEqual(frames, round(frames))
+
+    def test_short_music_gets_fewer_segments(self):
+        self.assertEqual(len(plan_segments(0.05, 8)), 1)
+
+
+def decode_samples(path: str):
+    import numpy
+
+    output = subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', path, '-f', 's16le', '-ac', '2', '-'],
+                            stdout=subprocess.PIPE, check=True).stdout
+
+    return numpy.frombuffer(output, dtype='<i2').astype(int)
+
+
+class TestEncodeInSegments(unittest.TestCase):
+    def test_ogg_pages_keep_the_packets(self):
+        packets = [(b'header', 0), (b'\x01' * 255, 100), (b'\x02' * 70000, 300), (b'', 400), (b'\x03' * 3, 450)]
+        output = io.BytesIO()
+        writer = OggWriter(output, serial=7)
+
+        for index, (packet, granule) in enumerate(packets):
+            writer.write_packet(packet, granule, flush=index == 0, last=index == len(packets) - 1)
+
+        with tempfile.NamedTemporaryFile(suffix='.ogg') as file:
+            file.write(output.getvalue())
+            file.flush()
+
+            serial, read_packets = read_ogg_packets(file.name)
+
+        self.assertEqual(serial, 7)
+        self.assertEqual([packet for packet, _ in read_packets], [packet for packet, _ in packets])
+        self.assertEqual(read_packets[-1][1], 450)
+
+    def test_music_too_long_to_decode_is_encoded_in_one_piece(self):
+        with mock.patch('utils.media.SEGMENTED_ENCODING_MIN_SECONDS', 60), \
+                mock.patch('utils.media.SEGMENTED_ENCODING_WORKERS', 4):
+            self.assertEqual(count_encoding_processes(600), 4)
+            self.assertEqual(count_encoding_processes(4 * 3600), 1)
+
+    def test_ogg_crc_is_not_reflected(self):
+        # The check value of CRC-32/CKSUM, which is the same CRC with a final XOR
+        self.assertEqual(ogg_crc(b'123456789'), 0x765E7680 ^ 0xFFFFFFFF)
+
+    def test_corrupt_ogg_pages_are_rejected(self):
+        output = io.BytesIO()
+        OggWriter(output, serial=7).write_packet(b'\x01' * 100, 100, last=True)
+        page = bytearray(output.getvalue())
+        page[-1] ^= 1
+
+        with tempfile.NamedTemporaryFile(suffix='.ogg') as file:
+            file.write(page)
+            file.flush()
+
+            with self.assertRaises(ValueError):
+                read_ogg_packets(file.name)
+
+    def test_segments_are_joined_between_long_blocks(self):
+        # Long blocks of 2048 samples, which give 1024 samples each after a long block
+        headers = [bytes(28) + bytes([0xB8, 0x01]), b'comments', b'setup']
+        first = (7, headers, [(f"A{ending}".encode(), ending) for ending in range(0, 20481, 1024)])
+        second = (8, headers, [(f"B{ending}".encode(), ending) for ending in range(8192, 30721, 1024)])
+        late_second = (8, headers, [(packet, ending + 512) for packet, ending in second[2]])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, 'joined.ogg')
+
+            self.assertTrue(join_vorbis_segments([first, second], [14336], 4096, output_path))
+            serial, packets = read_ogg_packets(output_path)
+
+            self.assertFalse(join_vorbis_segments([first, late_second], [14336], 4096, output_path))
+
+        self.assertEqual(serial, 7)
+        self.assertEqual([packet for packet, _ in packets], headers + [
+            f"A{ending}".encode() for ending in range(0, 14337, 1024)
+        ] + [
+            f"B{ending}".encode() for ending in range(15360, 30721, 1024)
+        ])
+        self.assertEqual(packets[-1][1], 30720)
+
+    def test_later_segments_are_shifted_onto_the_long_blocks_of_earlier_ones(self):
+        # Four short blocks moved the long blocks of the earlier segment by 512 samples
+        packets = [(b'', ending) for ending in [9024, 10048, 11072, 11648, 11776, 11904, 12032, 12608, 13632, 14656,
+                                                15680, 16704]]
+        segment_packets = [(b'', ending) for ending in range(10240, 17408, 1024)]
+
+        self.assertEqual(find_grid_shift(packets, segment_packets, 1024, 14336, 4096), 320)
+        self.assertEqual(find_grid_shift(packets, [(b'', ending + 320) for _, ending in segment_packets], 1024, 14336,
+                                         4096), 0)
+
+    @unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is needed to encode')
+    def test_joined_voice_has_every_sample_of_the_music(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        music_path = os.path.join(temp_dir.name, 'music.wav')
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:beep_factor=3:duration=30',
+             '-f', 'lavfi', '-i', 'anoisesrc=color=pink:amplitude=0.1:duration=30:seed=1', '-filter_complex',
+             'amix=inputs=2', '-ac', '2', '-ar', str(SEGMENT_SAMPLE_RATE), music_path],
+            check=True,
+        )
+
+        self.assertTrue(convert_to_voice(music_path, os.path.join(temp_dir.name, 'whole.ogg'), 30, segments=1))
+        self.assertTrue(encode_in_segments(music_path, os.path.join(temp_dir.name, 'segmented.ogg'), 4))
+
+        music = decode_samples(music_path)
+        whole = decode_samples(os.path.join(temp_dir.name, 'whole.ogg'))
+        segmented = decode_samples(os.path.join(temp_dir.name, 'segmented.ogg'))
+
+        self.assertEqual(len(segmented), len(music))
+        # A gap or an overlap at a boundary would shift everything after it away from the voice encoded in one piece
+        self.assertLess(abs(segmented - whole).max(), 64)
+
+
+def ffprobe_output(format_name: str, codec_name: str) -> subprocess.CompletedProcess:
+    output = {'streams': [{'codec_name': codec_name}], 'format': {'format_name': format_name}}
+
+    return subprocess.CompletedProcess([], 0, stdout=json.dumps(output).encode())
+
+
+class TestChooseMediaPath(unittest.TestCase):
+    def test_probes_the_container_and_the_codec(self):
+        with mock.patch('utils.media.subprocess.run', return_value=ffprobe_output('mov,mp4,m4a,3gp', 'aac')):
+            probe = probe_audio('music.m4a')
+
+        self.assertEqual(probe, {'formats': ['mov', 'mp4', 'm4a', '3gp'], 'codec': 'aac'})
+
+    def test_failed_probes_are_transcoded(self):
+        with mock.patch('utils.media.subprocess.run', side_effect=FileNotFoundError):
+            probe = probe_audio('music.mp3')
+
+        self.assertIsNone(probe)
+        self.assertEqual(choose_cut_extension(probe), 'mp3')
+        self.assertEqual(choose_media_path(probe, 'mp3'), MEDIA_PATH_TRANSCODE)
+
+    def test_cuts_keep_their_codec(self):
+        for format_name, codec_name, extension, media_path in [
+            ('mp3', 'mp3', 'mp3', MEDIA_PATH_COPY),
+            ('flac', 'flac', 'flac', MEDIA_PATH_COPY),
+            ('mov,mp4,m4a,3gp', 'alac', 'm4a', MEDIA_PATH_COPY),
+            ('aac', 'aac', 'm4a', MEDIA_PATH_REMUX),
+            ('matroska,webm', 'opus', 'ogg', MEDIA_PATH_REMUX),
+            ('wav', 'pcm_s16le', 'mp3', MEDIA_PATH_TRANSCODE),
+        ]:
+            probe = {'formats': format_name.split(','), 'codec': codec_name}
+
+            self.assertEqual(choose_cut_extension(probe), extension)
+            self.assertEqual(choose_media_path(probe, extension), media_path)
+
+    def test_voices_are_copied_only_from_vorbis_and_opus(self):
+        self.assertEqual(choose_media_path({'formats': ['ogg'], 'codec': 'opus'}, 'ogg'), MEDIA_PATH_COPY)
+        self.assertEqual(choose_media_path({'formats': ['matroska', 'webm'], 'codec': 'vorbis'}, 'ogg'),
+                         MEDIA_PATH_REMUX)
+        self.assertEqual(choose_media_path({'formats': ['ogg'], 'codec': 'flac'}, 'ogg'), MEDIA_PATH_TRANSCODE)
+
+    def test_cut_encodes_only_when_transcoding(self):
+        with mock.patch('utils.media.subprocess.run', return_value=subprocess.CompletedProcess([], 0)) as run:
+            self.assertTrue(cut_music('music.flac', 'music.flac_cut.flac', 10, 40))
+            self.assertTrue(cut_music('music.wav', 'music.wav_cut.mp3', 10, 40, MEDIA_PATH_TRANSCODE))
+
+        copy_args, transcode_args = (call.args[0] for call in run.call_args_list)
+
+        self.assertIn('copy', copy_args)
+        self.assertIn('libmp3lame', transcode_args)
+        self.assertEqual(copy_args[-1], 'music.flac_cut.flac')
+
+    def test_cuts_every_clip_in_one_pass(self):
+        with mock.patch('utils.media.subprocess.run', return_value=subprocess.CompletedProcess([], 0)) as run:
+            self.assertTrue(cut_music_clips('music.mp3', [('first.mp3', 30, 40), ('second.mp3', 10, 25)]))
+
+        args = run.call_args.args[0]
+        outputs = ' '.join(args[args.index('music.mp3') + 1:])
+
+        run.assert_called_once()
+        self.assertEqual(args[args.index('-ss') + 1], '10')
+        self.assertEqual(outputs, '-map 0:a:0 -ss 20 -t 10 -c:a copy first.mp3 '
+                                  '-map 0:a:0 -ss 0 -t 15 -c:a copy second.mp3')
+
+
+if __name__ == '__main__':
+    unittest.main()
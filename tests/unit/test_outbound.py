@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from utils.outbound import OutboundScheduler, ScheduledBot, background_requests, PRIORITY_INTERACTIVE, \
+    PRIORITY_UPLOAD, PRIORITY_BACKGROUND
+
+FAKE_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+class TestOutboundScheduler(unittest.TestCase):
+    def create_scheduler(self, **kwargs):
+        options = dict(global_per_second=1000, chat_per_second=20, chat_burst=1, max_concurrent_uploads=1)
+        options.update(kwargs)
+        return OutboundScheduler(**options)
+
+    def test_limits_each_chat(self):
+        scheduler = self.create_scheduler()
+
+        start = time.monotonic()
+        scheduler.acquire(1, PRIORITY_INTERACTIVE)
+        scheduler.acquire(2, PRIORITY_INTERACTIVE)
+        self.assertLess(time.monotonic() - start, 0.04)
+
+        scheduler.acquire(1, PRIORITY_INTERACTIVE)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_limits_concurrent_uploads(self):
+        scheduler = self.create_scheduler()
+        scheduler.acquire(1, PRIORITY_UPLOAD)
+        acquired = threading.Event()
+
+        thread = threading.Thread(target=lambda: (scheduler.acquire(2, PRIORITY_UPLOAD), acquired.set()))
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.1))
+        scheduler.release(PRIORITY_UPLOAD)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+    def test_replies_go_before_uploads(self):
+        scheduler = self.create_scheduler(global_per_second=10)
+
+        for chat_id in range(10):
+            scheduler.acquire(chat_id, PRIORITY_INTERACTIVE, limit_chat=False)
+
+        order = []
+
+        def acquire(chat_id, priority):
+            scheduler.acquire(chat_id, priority)
+            order.append(priority)
+
+        upload = threading.Thread(target=acquire, args=(100, PRIORITY_UPLOAD))
+        reply = threading.Thread(target=acquire, args=(101, PRIORITY_INTERACTIVE))
+        upload.start()
+        time.sleep(0.01)
+        reply.start()
+        upload.join()
+        reply.join()
+
+        self.assertEqual(order, [PRIORITY_INTERACTIVE, PRIORITY_UPLOAD])
+
+
+class TestScheduledBot(unittest.TestCase):
+    def test_retries_after_retry_after(self):
+        bot = ScheduledBot(FAKE_TOKEN)
+
+        with mock.patch.object(Bot, '_post', side_effect=[RetryAfter(0.05), {'ok': True}]) as post:
+            result = bot._post('sendMessage', {'chat_id': 1, 'text': 'hi'})
+
+        self.assertEqual(result, {'ok': True})
+        self.assertEqual(post.call_count, 2)
+
+    def test_gives_up_after_the_last_retry(self):
+        bot = ScheduledBot(FAKE_TOKEN)
+
+        with mock.patch('utils.outbound.OUTBOUND_MAX_RETRIES', 1), \
+                mock.patch.object(Bot, '_post', side_effect=RetryAfter(0.01)):
+            with self.assertRaises(RetryAfter):
+                bot._post('sendMessage', {'chat_id': 1, 'text': 'hi'})
+
+    def test_sends_background_requests_last(self):
+        bot = ScheduledBot(FAKE_TOKEN)
+        bot.scheduler = mock.Mock()
+
+        with mock.patch.object(Bot, '_post', return_value={'ok': True}):
+            with background_requests():
+                bot._post('editMessageText', {'chat_id': 1, 'text': '50%'})
+                bot._post('sendVoice', {'chat_id': 1})
+
+            bot._post('sendMessage', {'chat_id': 1, 'text': 'hi'})
+
+        self.assertEqual([call.args[1] for call in bot.scheduler.acquire.call_args_list],
+                         [PRIORITY_BACKGROUND, PRIORITY_UPLOAD, PRIORITY_INTERACTIVE])
+
+    def test_other_methods_are_not_scheduled(self):
+        bot = ScheduledBot(FAKE_TOKEN)
+        bot.scheduler = mock.Mock()
+
+        with mock.patch.object(Bot, '_post', return_value={'ok': True}):
+            bot._post('getFile', {'file_id': 'x'})
+
+        bot.scheduler.acquire.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from unittest import mock
+
+from telegram import ChatAction
+
+from utils.media import read_progress
+from utils.progress import ProgressReporter, track_upload, track_uploads
+from utils.upload import UploadFile
+
+
+class TestReadProgress(unittest.TestCase):
+    def test_reports_the_fraction_written(self):
+        fractions = []
+        lines = ['frame=0\n', 'out_time_us=2500000\n', 'progress=continue\n', 'out_time_us=N/A\n',
+                 'out_time_us=12000000\n', 'progress=end\n']
+
+        read_progress(lines, 10, fractions.append)
+
+        self.assertEqual(fractions, [0.25, 1.0, 1.0])
+
+
+class TestProgressReporter(unittest.TestCase):
+    def setUp(self):
+        self.bot = mock.Mock()
+        self.bot.send_message.return_value.message_id = 42
+
+        patcher = mock.patch('utils.progress.progress_ticker')
+        self.progress_ticker = patcher.start()
+        self.addCleanup(patcher.stop)
+        # The requests are sent right away instead of on the threads of the ticker
+        self.progress_ticker.submit.side_effect = lambda function, *args: function(*args)
+
+        with mock.patch('utils.progress.time.monotonic', return_value=100.0):
+            self.reporter = ProgressReporter(self.bot, 1, 'en', ChatAction.RECORD_AUDIO, edit_seconds=3, min_step=10)
+            self.reporter.start()
+
+    def test_keeps_the_chat_action_alive(self):
+        for now in [100.0, 102.0, 104.5]:
+            self.reporter.tick(now)
+
+        self.assertEqual(self.bot.send_chat_action.call_count, 2)
+        self.bot.send_chat_action.assert_called_with(chat_id=1, action=ChatAction.RECORD_AUDIO)
+
+    def test_sends_no_status_message_for_short_jobs(self):
+        for now in [100.0, 101.0, 102.9]:
+            self.reporter.tick(now)
+
+        self.reporter.finish()
+
+        self.assertFalse(self.reporter.tick(103.0))
+        self.bot.send_message.assert_not_called()
+        self.bot.delete_message.assert_not_called()
+
+    def test_edits_one_status_message_a_few_times(self):
+        for now, fraction in [(103.0, 0.10), (104.0, 0.50), (106.0, 0.55), (109.0, 0.70), (110.0, 0.99)]:
+            self.reporter.encoding(fraction)
+            self.reporter.tick(now)
+
+        self.reporter.uploading(10, 100)
+        self.reporter.tick(113.5)
+        self.reporter.finish()
+
+        self.bot.delete_message.assert_not_called()
+        self.assertFalse(self.reporter.tick(114.0))
+
+        self.bot.send_message.assert_called_once_with(chat_id=1, text=mock.ANY)
+        self.assertEqual([call.kwargs['text'] for call in self.bot.edit_message_text.call_args_list],
+                         ['⏳ Working on your file... 55%', '⏳ Working on your file... 70%',
+                          '⏫ Sending your file... 10%'])
+        self.bot.send_chat_action.assert_called_with(chat_id=1, action=ChatAction.UPLOAD_AUDIO)
+        self.bot.delete_message.assert_called_once_with(chat_id=1, message_id=42)
+
+    def test_stops_when_finished(self):
+        self.reporter.finish()
+
+        self.assertFalse(self.reporter.tick(200.0))
+        self.bot.send_chat_action.assert_not_called()
+        self.bot.delete_message.assert_not_called()
+
+    def test_skips_the_ticks_while_a_request_is_on_its_way(self):
+        submitted = []
+        self.progress_ticker.submit.side_effect = lambda function, *args: submitted.append((function, args))
+
+        self.reporter.encoding(0.5)
+        self.reporter.tick(103.0)
+        self.reporter.tick(108.0)
+        # The job goes on without waiting for the status message
+        self.reporter.finish()
+        self.assertTrue(self.reporter.tick(109.0))
+
+        self.assertEqual(len(submitted), 1)
+
+        function, args = submitted.pop()
+        function(*args)
+
+        self.assertFalse(self.reporter.tick(110.0))
+        function, args = submitted.pop()
+        function(*args)
+
+        self.bot.send_message.assert_called_once_with(chat_id=1, text='⏳ Working on your file... 50%')
+        self.bot.delete_message.assert_called_once_with(chat_id=1, message_id=42)
+
+
+class TestTrackUpload(unittest.TestCase):
+    def test_reports_the_bytes_sent(self):
+        reads = []
+        upload = track_upload(UploadFile(__file__), lambda sent, total: reads.append((sent, total)))
+
+        content = b''.join(upload.chunks())
+
+        self.assertEqual(reads[-1], (len(content), len(content)))
+
+    def test_reports_the_bytes_sent_of_a_media_group_together(self):
+        reads = []
+        first, second = track_uploads([UploadFile(__file__), UploadFile(__file__)],
+                                      lambda sent, total: reads.append((sent, total)))
+
+        size = len(b''.join(first.chunks()))
+        b''.join(second.chunks())
+
+        self.assertEqual(reads[-1], (2 * size, 2 * size))
+
+    def test_leaves_paths_alone(self):
+        self.assertEqual(track_upload('/music.mp3', mock.Mock()), '/music.mp3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+from utils.rate_limit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('utils.rate_limit.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.limiter = RateLimiter(limits={'cut': (6, 2), 'upload': (60, 1)})
+
+    def test_allows_a_burst(self):
+        self.assertEqual(self.limiter.try_acquire('cut', 1), 0)
+        self.assertEqual(self.limiter.try_acquire('cut', 1), 0)
+
+    def test_limits_after_the_burst(self):
+        self.limiter.try_acquire('cut', 1)
+        self.limiter.try_acquire('cut', 1)
+
+        self.assertEqual(self.limiter.try_acquire('cut', 1), 10)
+
+    def test_refills_over_time(self):
+        self.limiter.try_acquire('cut', 1)
+        self.limiter.try_acquire('cut', 1)
+        self.now += 10
+
+        self.assertEqual(self.limiter.try_acquire('cut', 1), 0)
+
+    def test_buckets_are_per_user_and_kind(self):
+        self.limiter.try_acquire('upload', 1)
+
+        self.assertEqual(self.limiter.try_acquire('upload', 2), 0)
+        self.assertEqual(self.limiter.try_acquire('cut', 1), 0)
+        self.assertGreater(self.limiter.try_acquire('upload', 1), 0)
+
+    def test_exempt_users_are_not_limited(self):
+        is_exempt = mock.Mock(return_value=True)
+        limiter = RateLimiter(limits={'upload': (60, 1)}, is_exempt=is_exempt)
+
+        for _ in range(5):
+            self.assertEqual(limiter.try_acquire('upload', 1), 0)
+
+        is_exempt.assert_called_once_with(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+from utils import reset_user_data
+from utils.persistence import SessionPersistence
+from utils.session import Session, sweep_sessions, touch_session, SESSION_TTL_SECONDS
+
+
+class TestSession(unittest.TestCase):
+    def test_reads_and_writes_like_a_dict(self):
+        session = Session()
+
+        self.assertEqual(len(session), 0)
+        self.assertNotIn('language', session)
+
+        reset_user_data(session)
+        session['music_path'] = 'downloads/1/music.mp3'
+
+        self.assertEqual(session['language'], 'en')
+        self.assertEqual(session.get('music_path'), 'downloads/1/music.mp3')
+        self.assertEqual(len(session), len(Session.FIELDS))
+
+    def test_rejects_unknown_keys(self):
+        with self.assertRaises(KeyError):
+            Session()['musik_path'] = ''
+
+        with self.assertRaises(KeyError):
+            Session()['language']
+
+    def test_fields_with_a_default_are_made_when_read(self):
+        session = Session(language='fa')
+
+        self.assertNotIn('tag_editor', session)
+
+        session['tag_editor']['title'] = 'Song'
+
+        self.assertEqual(session, Session(language='fa', tag_editor={'title': 'Song'}))
+        self.assertIsNot(Session()['batch_files'], Session()['batch_files'])
+
+    def test_survives_pickling(self):
+        session = Session(language='fa', tag_editor={'title': 'Song'})
+        restored = pickle.loads(pickle.dumps(session))
+
+        self.assertEqual(restored, session)
+        self.assertNotIn('music_path', restored)
+        self.assertEqual(restored.last_active_at, session.last_active_at)
+
+    def test_loads_the_sessions_pickled_with_a_fingerprint(self):
+        session = Session(language='fa', music_fingerprint_id=3)
+        legacy_state = session.__getstate__()[:12] + ('fingerprint',) + session.__getstate__()[12:]
+
+        restored = Session.__new__(Session)
+        restored.__setstate__(legacy_state)
+
+        self.assertEqual(restored, session)
+        self.assertEqual(restored.last_active_at, session.last_active_at)
+
+    def test_persistence_converts_old_dicts(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'persistence')
+
+            with open(path, 'wb') as persistence_file:
+                pickle.dump({'user_data': {1: {'language': 'fa', 'removed_key': 1}}, 'chat_data': {},
+                             'conversations': {}}, persistence_file)
+
+            user_data = SessionPersistence(path).get_user_data()
+
+        self.assertEqual(user_data[1], Session(language='fa'))
+        self.assertIsInstance(user_data[2], Session)
+
+
+class TestSweepSessions(unittest.TestCase):
+    def test_evicts_idle_sessions_but_keeps_the_language(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            music_path = os.path.join(temp_dir, 'music.mp3')
+            open(music_path, 'wb').close()
+
+            idle = Session()
+            reset_user_data(idle)
+            idle['language'] = 'fa'
+            idle['music_path'] = music_path
+            idle['music_file_id'] = 'file'
+            idle.last_active_at = time.time() - SESSION_TTL_SECONDS - 1
+
+            active = Session()
+            reset_user_data(active)
+            active['music_file_id'] = 'file'
+
+            dispatcher = mock.Mock(user_data=defaultdict(Session, {1: idle, 2: active}))
+
+            with mock.patch('utils.session.shutil.rmtree') as rmtree:
+                sweep_sessions(mock.Mock(dispatcher=dispatcher))
+
+            self.assertFalse(os.path.exists(music_path))
+
+        self.assertEqual(idle.keys(), ['language'])
+        self.assertEqual(idle['language'], 'fa')
+        self.assertEqual(idle['music_file_id'], '')
+        self.assertEqual(active['music_file_id'], 'file')
+        rmtree.assert_called_once_with('downloads/1', ignore_errors=True)
+        dispatcher.update_persistence.assert_called_once_with()
+
+    def test_touching_leaves_plain_dicts_alone(self):
+        user_data = {'language': 'en'}
+
+        touch_session(mock.Mock(), mock.Mock(user_data=user_data))
+
+        self.assertEqual(user_data, {'language': 'en'})
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from utils.tracing import Tracer
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        self.trace_path = os.path.join(temp_dir.name, 'traces.jsonl')
+        self.tracer = Tracer(self.trace_path, sample_rate=0.0, slow_seconds=5.0, seed=1)
+
+    def read_traces(self) -> [dict]:
+        if not os.path.exists(self.trace_path):
+            return []
+
+        with open(self.trace_path) as traces:
+            return [json.loads(line) for line in traces]
+
+    def test_keeps_failed_updates(self):
+        self.tracer.start('update', update_id=1)
+
+        with self.tracer.span('download_file'):
+            pass
+
+        with self.assertRaises(OSError), self.tracer.span('save_tags_to_file'):
+            raise OSError('disk full')
+
+        self.tracer.finish()
+
+        trace, = self.read_traces()
+
+        self.assertEqual(trace['attributes'], {'update_id': 1})
+        self.assertEqual([span['name'] for span in trace['spans']], ['download_file', 'save_tags_to_file'])
+        self.assertEqual(trace['spans'][1]['error'], 'OSError: disk full')
+
+    def test_keeps_slow_updates_and_drops_the_rest(self):
+        with mock.patch('utils.tracing.time.monotonic', side_effect=[100.0, 101.0]):
+            self.tracer.start('update', update_id=1)
+            self.tracer.finish()
+
+        with mock.patch('utils.tracing.time.monotonic', side_effect=[200.0, 206.0]):
+            self.tracer.start('update', update_id=2)
+            self.tracer.finish()
+
+        self.assertEqual([trace['attributes']['update_id'] for trace in self.read_traces()], [2])
+
+    def test_waits_for_the_bound_functions(self):
+        self.tracer.slow_seconds = 0
+        trace = self.tracer.start('update', update_id=1)
+        waveform = self.tracer.bind(self.tracer.traced('ffmpeg')(lambda: None))
+
+        self.tracer.finish()
+        self.assertEqual(self.read_traces(), [])
+
+        thread = threading.Thread(target=waveform)
+        thread.start()
+        thread.join()
+
+        exported, = self.read_traces()
+
+        self.assertEqual(exported['trace_id'], trace.id)
+        self.assertEqual(exported['spans'][0]['name'], 'ffmpeg')
+        self.assertEqual(exported['spans'][0]['thread'], thread.name)
+
+    def test_traces_nothing_without_a_file(self):
+        tracer = Tracer('')
+
+        self.assertIsNone(tracer.start('update'))
+
+        with tracer.span('db'):
+            pass
+
+        tracer.finish()
+
+
+if __name__ == '__main__':
+    unittest.main()
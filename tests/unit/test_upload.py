@@ -0,0 +1,83 @@
+import builtins
+import email
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from telegram import InputFile, InputMediaAudio
+
+from utils.upload import UploadFile, MultipartBody, flatten_fields
+
+
+class TestMultipartBody(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        self.music_path = os.path.join(temp_dir.name, 'music.mp3')
+
+        with open(self.music_path, 'wb') as music:
+            music.write(os.urandom(10_000))
+
+    def test_streams_what_it_announces(self):
+        body = MultipartBody([
+            ('chat_id', '1'),
+            ('audio', UploadFile(self.music_path)),
+            ('thumb', InputFile(b'\xff\xd8\xff\xe0' + bytes(100), filename='thumb.jpg')),
+        ])
+
+        content = b''.join(body)
+        form = email.message_from_bytes(f"Content-Type: {body.content_type}\r\n\r\n".encode() + content)
+        chat_id, audio, thumb = form.get_payload()
+
+        self.assertEqual(len(content), len(body))
+        self.assertEqual(chat_id.get_payload(), '1')
+        self.assertEqual((audio.get_filename(), audio.get_content_type()), ('music.mp3', 'audio/mpeg'))
+
+        with open(self.music_path, 'rb') as music:
+            self.assertEqual(audio.get_payload(decode=True), music.read())
+
+        self.assertEqual(len(thumb.get_payload(decode=True)), 104)
+        # A body can be sent again, e.g. when the request is retried
+        self.assertEqual(b''.join(body), content)
+
+    def test_attaches_a_shared_thumbnail_once(self):
+        thumbnail = UploadFile(self.music_path, filename='thumb.jpg')
+        clips = [UploadFile(self.music_path) for _ in range(3)]
+
+        fields = list(flatten_fields({
+            'chat_id': 1,
+            'media': [InputMediaAudio(media=clip, thumb=thumbnail, parse_mode='Markdown') for clip in clips],
+        }))
+
+        self.assertEqual([name for name, _ in fields],
+                         ['chat_id', 'media', clips[0].attach, thumbnail.attach, clips[1].attach, clips[2].attach])
+        self.assertEqual(fields[1][1].count(f"attach://{thumbnail.attach}"), 3)
+
+    @mock.patch('utils.upload.metrics')
+    @mock.patch('utils.upload.UPLOAD_CHUNK_BYTES', 1000)
+    def test_closes_the_file_when_the_upload_stops(self, metrics):
+        opened = []
+
+        def tracking_open(*args, **kwargs):
+            opened.append(open_file(*args, **kwargs))
+            return opened[-1]
+
+        open_file = builtins.open
+        body = MultipartBody([('audio', UploadFile(self.music_path))])
+        chunks = iter(body)
+
+        with mock.patch('builtins.open', tracking_open):
+            next(chunks)
+            next(chunks)
+            chunks.close()
+
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+        self.assertEqual(metrics.set_gauge.call_args_list[0], mock.call('upload_bytes_in_flight', len(body)))
+        self.assertEqual(metrics.set_gauge.call_args_list[-1], mock.call('upload_bytes_in_flight', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import importlib
+import unittest
+from datetime import datetime
+
+from orator import DatabaseManager, Model
+
+from utils.usage import UsageRecorder, roll_up_usage, get_usage_summary
+
+
+class TestUsageRecorder(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.recorder = UsageRecorder(batch_size=3, max_buffered=5, insert=self.batches.append)
+
+    def test_writes_a_batch_once_it_is_full(self):
+        self.recorder.record(1, 'tag_editor')
+        self.recorder.record(2, 'tag_editor')
+
+        self.assertEqual(self.batches, [])
+
+        self.recorder.record(3, 'music_cutter')
+
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual([row['user_id'] for row in self.batches[0]], [1, 2, 3])
+        self.assertEqual(self.recorder.pending(), 0)
+
+    def test_keeps_the_events_if_the_insert_fails(self):
+        def fail(rows):
+            raise OSError('database is down')
+
+        self.recorder.insert = fail
+        self.recorder.record(1, 'tag_editor')
+
+        self.assertEqual(self.recorder.flush(), 0)
+        self.assertEqual(self.recorder.pending(), 1)
+
+        self.recorder.insert = self.batches.append
+
+        self.assertEqual(self.recorder.flush(), 1)
+        self.assertEqual(self.recorder.pending(), 0)
+
+    def test_drops_the_oldest_events_when_the_buffer_overflows(self):
+        self.recorder.insert = lambda rows: 1 / 0
+
+        for user_id in range(8):
+            self.recorder.record(user_id, 'voice_converter')
+
+        self.recorder.insert = self.batches.append
+        self.recorder.flush()
+
+        self.assertEqual([row['user_id'] for batch in self.batches for row in batch], [3, 4, 5, 6, 7])
+
+
+class TestUsageRollup(unittest.TestCase):
+    def setUp(self):
+        db = DatabaseManager({'default': 'sqlite', 'sqlite': {'driver': 'sqlite', 'database': ':memory:'}})
+        Model.set_connection_resolver(db)
+
+        migration = importlib.import_module('migrations.2026_10_19_090000_create_usage_tables').CreateUsageTables()
+        migration.set_connection(db.connection())
+        migration.up()
+
+        self.db = db
+
+    def insert_event(self, user_id: int, module: str, created_at: str):
+        self.db.table('usage_events').insert({'user_id': user_id, 'module': module, 'created_at': created_at})
+
+    def test_rolls_up_hours_and_days(self):
+        self.insert_event(1, 'tag_editor', '2021-03-01 10:05:00')
+        self.insert_event(1, 'tag_editor', '2021-03-01 10:45:00')
+        self.insert_event(2, 'music_cutter', '2021-03-01 10:50:00')
+        self.insert_event(2, 'tag_editor', '2021-03-02 09:00:00')
+
+        roll_up_usage(now=datetime(2021, 3, 2, 9, 30))
+
+        hourly = [(row['hour'], row['module'], row['events'], row['users'])
+                  for row in self.db.table('usage_hourly').order_by('hour').order_by('module').get()]
+        daily = [(row['day'], row['module'], row['events'], row['users'])
+                 for row in self.db.table('usage_daily').order_by('day').order_by('module').get()]
+
+        self.assertEqual(hourly, [
+            ('2021-03-01 10:00:00', 'music_cutter', 1, 1),
+            ('2021-03-01 10:00:00', 'tag_editor', 2, 1),
+            ('2021-03-02 09:00:00', 'tag_editor', 1, 1),
+        ])
+        self.assertEqual(daily, [
+            ('2021-03-01', 'music_cutter', 1, 1),
+            ('2021-03-01', 'tag_editor', 2, 1),
+            ('2021-03-02', 'tag_editor', 1, 1),
+        ])
+
+    def test_rolling_up_again_updates_the_last_period(self):
+        self.insert_event(1, 'tag_editor', '2021-03-01 10:05:00')
+        roll_up_usage(now=datetime(2021, 3, 1, 10, 10))
+
+        self.insert_event(2, 'tag_editor', '2021-03-01 10:15:00')
+        roll_up_usage(now=datetime(2021, 3, 1, 10, 20))
+
+        self.assertEqual(self.db.table('usage_hourly').count(), 1)
+        self.assertEqual(get_usage_summary(7, now=datetime(2021, 3, 1, 10, 20)), {'tag_editor': (2, 2)})
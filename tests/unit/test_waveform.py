@@ -0,0 +1,61 @@
+import struct
+import unittest
+import zlib
+
+import numpy
+
+from utils.waveform import compute_envelopes, reduce_blocks, merge_blocks, render_waveform, encode_png
+
+
+class TestWaveform(unittest.TestCase):
+    def test_envelopes_of_a_square_wave(self):
+        samples = numpy.array([16384, -16384] * 400, dtype='<i2')
+
+        peaks, rms = compute_envelopes(samples, 8)
+
+        self.assertEqual(len(peaks), 8)
+        numpy.testing.assert_allclose(peaks, 0.5)
+        numpy.testing.assert_allclose(rms, 0.5)
+
+    def test_envelopes_pad_the_last_window_with_silence(self):
+        samples = numpy.full(10, 32767, dtype='<i2')
+
+        peaks, rms = compute_envelopes(samples, 4)
+
+        self.assertGreater(peaks[0], 0.99)
+        self.assertLess(rms[-1], rms[0])
+
+    def test_envelopes_of_blocks_reduced_chunk_by_chunk(self):
+        samples = numpy.random.default_rng(0).integers(-32768, 32767, 8000 * 10, dtype='<i2')
+        chunks = [reduce_blocks(samples[start:start + 8000], 80) for start in range(0, len(samples), 8000)]
+
+        peaks, rms = merge_blocks(numpy.concatenate([peaks for peaks, _ in chunks]),
+                                  numpy.concatenate([energies for _, energies in chunks]), 80, 100)
+        expected_peaks, expected_rms = compute_envelopes(samples, 100)
+
+        numpy.testing.assert_allclose(peaks, expected_peaks)
+        numpy.testing.assert_allclose(rms, expected_rms, rtol=1e-5)
+
+    def test_render_has_a_timeline_under_the_waveform(self):
+        peaks, rms = compute_envelopes(numpy.zeros(8000, dtype='<i2'), 200)
+
+        pixels = render_waveform(peaks, rms, duration=60, height=40)
+
+        self.assertEqual(pixels.shape, (40 + 24, 200))
+        self.assertTrue((pixels[40] == 0).all())
+
+    def test_encode_png(self):
+        pixels = numpy.arange(12, dtype=numpy.uint8).reshape(3, 4)
+
+        png = encode_png(pixels)
+
+        self.assertTrue(png.startswith(b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(struct.unpack('>II', png[16:24]), (4, 3))
+
+        idat_length = struct.unpack('>I', png[33:37])[0]
+        lines = zlib.decompress(png[41:41 + idat_length])
+        self.assertEqual(lines, b'\x00\x00\x01\x02\x03\x00\x04\x05\x06\x07\x00\x08\x09\x0a\x0b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,26 @@
+from __future__ import annotations
+
 import os
 import re
+import shutil
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import music_tag
-from telegram import ReplyKeyboardMarkup
-from telegram.ext import CallbackContext
+from telegram import ReplyKeyboardMarkup, File
+from telegram.utils.helpers import is_local_file
 
-from models.admin import Admin
-from models.user import User
 from utils.lang import keys
+from utils.tracing import tracer
+from utils.upload import UploadFile
+
+if TYPE_CHECKING:
+    from telegram.ext import CallbackContext
+
+# Set when the bot talks to a self-hosted Bot API server started with `--local`, which shares its disk with the bot
+BOT_API_LOCAL_MODE = os.getenv("BOT_API_LOCAL_MODE", '').lower() in ['1', 'true', 'yes']
+
+# The ioctl which makes a copy-on-write clone of a file on Btrfs and XFS
+FICLONE = 0x40049409
 
 
 def translate_key_to(key: str, destination_lang: str) -> str:
@@ -66,6 +78,8 @@ def increment_usage_counter_for_user(user_id: int) -> int:
     **Returns:**
      The new value for `user.number_of_files_sent`
     """
+    from models.user import User
+
     user = User.where('user_id', '=', user_id).first()
 
     if user:
@@ -84,6 +98,8 @@ def is_user_admin(user_id: int) -> bool:
     **Returns:**
      `bool`
     """
+    from models.admin import Admin
+
     admin = Admin.where('admin_user_id', '=', user_id).first()
 
     return bool(admin)
@@ -98,14 +114,23 @@ def is_user_owner(user_id: int) -> bool:
     **Returns:**
      `bool`
     """
+    from models.admin import Admin
+
     owner = Admin.where('admin_user_id', '=', user_id).where('is_owner', '=', True).first()
 
     return owner.is_owner if owner else False
 
 
 def reset_user_data_context(context: CallbackContext) -> None:
-    user_data = context.user_data
+    reset_user_data(context.user_data)
+
+
+def reset_user_data(user_data: dict) -> None:
+    """Delete the files of the current session of a user and empty it, keeping only the language.
 
+    **Keyword arguments:**
+     - user_data (dict) -- The `user_data` of the user
+    """
     if 'music_path' in user_data:
         delete_file(user_data['music_path'])
     if 'art_path' in user_data:
@@ -115,11 +140,17 @@ def reset_user_data_context(context: CallbackContext) -> None:
 
     user_data['tag_editor'] = {}
     user_data['music_path'] = ''
+    user_data['music_file_id'] = ''
+    user_data['music_file_unique_id'] = ''
+    user_data['music_file_size'] = 0
     user_data['music_duration'] = ''
     user_data['art_path'] = ''
+    user_data['art_extracted'] = False
     user_data['new_art_path'] = ''
     user_data['current_active_module'] = ''
     user_data['music_message_id'] = ''
+    user_data['music_fingerprint_id'] = None
+    user_data['batch_files'] = []
     user_data['language'] = user_data['language'] if ('language' in user_data) else 'en'
 
 
@@ -177,12 +208,13 @@ def convert_seconds_to_human_readable_form(seconds: int) -> str:
     return f"{minutes_formatted}:{seconds_formatted}"
 
 
+@tracer.traced('download_file')
 def download_file(user_id: int, file_to_download, file_type: str, context: CallbackContext) -> str:
     """Download a file using convenience methods of "python-telegram-bot"
 
     **Keyword arguments:**
      - user_id (int) -- The user's id
-     - file_to_download (*) -- The file object to download
+     - file_to_download (*) -- The file object to download, or the `File` returned by `get_file`
      - file_type (str) -- The type of the file, either 'photo' or 'audio'
      - context (CallbackContext) -- The context object of the user
 
@@ -194,8 +226,9 @@ def download_file(user_id: int, file_to_download, file_type: str, context: Callb
     file_extension = ''
 
     if file_type == 'audio':
-        file_id = context.bot.get_file(file_to_download.file_id)
-        file_name = file_to_download.file_name
+        file_id = file_to_download if isinstance(file_to_download, File) \
+            else context.bot.get_file(file_to_download.file_id)
+        file_name = getattr(file_to_download, 'file_name', None) or file_id.file_path
         file_extension = file_name.split(".")[-1]
     elif file_type == 'photo':
         file_id = context.bot.get_file(file_to_download.file_id)
@@ -203,6 +236,16 @@ def download_file(user_id: int, file_to_download, file_type: str, context: Callb
 
     file_download_path = f"{user_download_dir}/{file_id.file_id}.{file_extension}"
 
+    if is_local_file(file_id.file_path):
+        # A Bot API server in local mode gives the path of the file on its disk instead of a URL
+        if file_type == 'photo':
+            link_or_clone_file(file_id.file_path, file_download_path)
+        else:
+            # Tags are written into the music in place, which must not change the server's copy
+            clone_file(file_id.file_path, file_download_path)
+
+        return file_download_path
+
     try:
         file_id.download(f"{user_download_dir}/{file_id.file_id}.{file_extension}")
     except ValueError:
@@ -211,6 +254,59 @@ def download_file(user_id: int, file_to_download, file_type: str, context: Callb
     return file_download_path
 
 
+def clone_file(source_path: str, destination_path: str) -> None:
+    """Copy a file without passing its content through the bot: as a copy-on-write clone where the filesystem
+    supports it, otherwise with a copy inside the kernel.
+
+    **Keyword arguments:**
+     - source_path (str) -- The path of the existing file
+     - destination_path (str) -- The path of the copy
+    """
+    try:
+        import fcntl
+
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+
+    # Uses sendfile() on Linux
+    shutil.copyfile(source_path, destination_path)
+
+
+def link_or_clone_file(source_path: str, destination_path: str) -> None:
+    """Hardlink a file which is only ever read, falling back to `clone_file` across filesystems.
+
+    **Keyword arguments:**
+     - source_path (str) -- The path of the existing file
+     - destination_path (str) -- The path of the new file
+    """
+    delete_file(destination_path)
+
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        clone_file(source_path, destination_path)
+
+
+def open_for_upload(file_path: str):
+    """Prepare a file to be sent to Telegram. A Bot API server in local mode reads the file from the disk by
+    itself, so only its path is sent; otherwise the file is streamed from the disk while it is uploaded, and is
+    only open for as long as that takes.
+
+    **Keyword arguments:**
+     - file_path (str) -- The path of the file
+
+    **Returns:**
+     The absolute path of the file or an `UploadFile`
+    """
+    if BOT_API_LOCAL_MODE:
+        return os.path.abspath(file_path)
+
+    return UploadFile(file_path)
+
+
 def generate_back_button_keyboard(language: str) -> ReplyKeyboardMarkup:
     """Create an return an instance of `back_button_keyboard`
 
@@ -301,6 +397,29 @@ def generate_tag_editor_keyboard(language: str) -> ReplyKeyboardMarkup:
     )
 
 
+def generate_batch_keyboard(language: str) -> ReplyKeyboardMarkup:
+    """Create an return an instance of `batch_keyboard`
+
+
+    **Keyword arguments:**
+     - language (str) -- The desired language to generate labels
+
+    **Returns:**
+     ReplyKeyboardMarkup instance
+    """
+    return (
+        ReplyKeyboardMarkup(
+            [
+                [translate_key_to('BTN_ARTIST', language), translate_key_to('BTN_ALBUM', language)],
+                [translate_key_to('BTN_GENRE', language), translate_key_to('BTN_YEAR', language),
+                 translate_key_to('BTN_ALBUM_ART', language)],
+            ],
+            resize_keyboard=True,
+        )
+    )
+
+
+@tracer.traced('save_tags_to_file')
 def save_tags_to_file(file: str, tags: dict, new_art_path: str) -> str:
     """Create an return an instance of `tag_editor_keyboard`
 
@@ -313,6 +432,8 @@ def save_tags_to_file(file: str, tags: dict, new_art_path: str) -> str:
     **Returns:**
      The path of the file
     """
+    import music_tag
+
     music = music_tag.load_file(file)
 
     try:
@@ -357,3 +478,21 @@ def parse_cutting_range(text: str) -> (int, int):
             ending_sec = int(ending)
 
     return beginning_sec, ending_sec
+
+
+def parse_cutting_ranges(text: str) -> [(int, int)]:
+    """Parse one or more ranges to cut out of a music, separated by commas, semicolons or new lines. Each of them
+    is in a pattern `parse_cutting_range` accepts.
+
+    **Keyword arguments:**
+     - text (str) -- The message of the user
+
+    **Returns:**
+     The beginning and the ending of every range, in seconds
+    """
+    ranges = [parse_cutting_range(part) for part in re.split('[,;\n]', text) if part.strip()]
+
+    if not ranges:
+        raise ValueError('Malformed music range')
+
+    return ranges
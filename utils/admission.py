@@ -0,0 +1,160 @@
+import math
+import os
+import threading
+import time
+
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY")) if os.getenv("ADMISSION_CAPACITY") else os.cpu_count()
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS")) \
+    if os.getenv("ADMISSION_MAX_WAIT_SECONDS") else 60.0
+ADMISSION_MAX_LOAD_PER_CORE = float(os.getenv("ADMISSION_MAX_LOAD_PER_CORE")) \
+    if os.getenv("ADMISSION_MAX_LOAD_PER_CORE") else 2.0
+ADMISSION_MIN_FREE_MEMORY_MB = int(os.getenv("ADMISSION_MIN_FREE_MEMORY_MB")) \
+    if os.getenv("ADMISSION_MIN_FREE_MEMORY_MB") else 200
+
+# Rough costs of media work, corrected at runtime by how long the admitted work really took
+DOWNLOAD_BYTES_PER_SECOND = 5 * 1024 * 1024
+ENCODE_SECONDS_PER_AUDIO_SECOND = 0.05
+
+
+class AdmissionTicket:
+    __slots__ = ['estimated_seconds', 'processes', 'started_at']
+
+    def __init__(self, estimated_seconds: float, processes: int = 1):
+        self.estimated_seconds = estimated_seconds
+        self.processes = processes
+        self.started_at = time.monotonic()
+
+
+class AdmissionController:
+    """Decides whether the bot can take on new media work (downloads and encodes) right now.
+
+    Every piece of work is given an estimated cost in seconds from its file size and duration. Work is admitted
+    as long as the estimated wait for the work already running, spread over `capacity` cores, stays under
+    `max_wait_seconds`, and the host is neither overloaded nor low on memory. Otherwise the caller gets an estimate
+    of how long to wait before trying again.
+
+    The admitted work is expected to run on the threads of `run_async`, so that the dispatcher goes on with other
+    updates meanwhile; the controller keeps those threads from piling up more work than the cores can get through.
+    Work which can run on several processes at once, like a segmented encoding, is given as many of them as there are
+    cores without admitted work, and counts as that many pieces of work in the queue depth.
+    Each process has its own controller: the workers of `cluster.py` each get a share of the capacity.
+    """
+
+    def __init__(self, capacity: int, max_wait_seconds: float, max_load_per_core: float, min_free_memory_mb: int):
+        self.capacity = capacity
+        self.max_wait_seconds = max_wait_seconds
+        self.max_load_per_core = max_load_per_core
+        self.min_free_memory_mb = min_free_memory_mb
+
+        self._lock = threading.Lock()
+        self._backlog_seconds = 0.0
+        self._queue_depth = 0
+        self._speed_factor = 1.0
+
+    def estimate_cost(self, file_size: int, duration: int) -> float:
+        """Estimate how many seconds of work downloading and encoding a file takes.
+
+        **Keyword arguments:**
+         - file_size (int) -- The size of the file to download in bytes, 0 if it is already downloaded
+         - duration (int) -- The duration of the audio to encode in seconds, 0 if nothing is encoded
+
+        **Returns:**
+         The estimated cost in seconds
+        """
+        raw_cost = (file_size or 0) / DOWNLOAD_BYTES_PER_SECOND + (duration or 0) * ENCODE_SECONDS_PER_AUDIO_SECOND
+
+        return raw_cost * self._speed_factor
+
+    def try_admit(self, file_size: int, duration: int, processes: int = 1) -> (AdmissionTicket, int):
+        """Admit a piece of work if there is room for it.
+
+        **Keyword arguments:**
+         - file_size (int) -- The size of the file to download in bytes, 0 if it is already downloaded
+         - duration (int) -- The duration of the audio to encode in seconds, 0 if nothing is encoded
+         - processes (int) -- The most processes the work can run on at once
+
+        **Returns:**
+         The ticket of the admitted work, with the processes it may run on, and 0, or `None` and the estimated seconds
+         to wait before trying again
+        """
+        cost = self.estimate_cost(file_size, duration)
+
+        with self._lock:
+            estimated_wait = (self._backlog_seconds + cost) / self.capacity
+            retry_after = 0
+
+            if self._queue_depth > 0 and estimated_wait > self.max_wait_seconds:
+                retry_after = estimated_wait - self.max_wait_seconds
+
+            load_per_core = get_load_per_core()
+
+            if load_per_core is not None and load_per_core > self.max_load_per_core:
+                # The load average is over a minute, so it takes a while to come down
+                retry_after = max(retry_after, 60 * (load_per_core / self.max_load_per_core - 1), 10)
+
+            free_memory_mb = get_free_memory_mb()
+
+            if free_memory_mb is not None and free_memory_mb < self.min_free_memory_mb:
+                retry_after = max(retry_after, 30)
+
+            if retry_after:
+                return None, math.ceil(retry_after)
+
+            # The total work is the same on any number of processes, only the cores it takes at once differ
+            processes = max(1, min(processes, math.floor(self.capacity - self._queue_depth)))
+
+            self._backlog_seconds += cost
+            self._queue_depth += processes
+
+        return AdmissionTicket(cost, processes), 0
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        """Mark an admitted piece of work as finished and learn from how long it really took.
+
+        **Keyword arguments:**
+         - ticket (AdmissionTicket) -- The ticket `try_admit` returned
+        """
+        elapsed = time.monotonic() - ticket.started_at
+
+        with self._lock:
+            self._backlog_seconds = max(0.0, self._backlog_seconds - ticket.estimated_seconds)
+            self._queue_depth -= ticket.processes
+
+            if ticket.estimated_seconds > 0.5:
+                ratio = elapsed * ticket.processes / (ticket.estimated_seconds / self._speed_factor)
+                self._speed_factor = min(max(0.8 * self._speed_factor + 0.2 * ratio, 0.1), 10.0)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+
+def get_load_per_core() -> float:
+    """Return the load average of the last minute divided by the number of cores, or `None` where it is not
+    available.
+    """
+    try:
+        return os.getloadavg()[0] / os.cpu_count()
+    except (AttributeError, OSError):
+        return None
+
+
+def get_free_memory_mb() -> int:
+    """Return the memory available to new processes in MB, or `None` where it is not available."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+
+    return None
+
+
+admission_controller = AdmissionController(
+    capacity=ADMISSION_CAPACITY,
+    max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS,
+    max_load_per_core=ADMISSION_MAX_LOAD_PER_CORE,
+    min_free_memory_mb=ADMISSION_MIN_FREE_MEMORY_MB,
+)
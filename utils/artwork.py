@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from utils import download_file, delete_file, link_or_clone_file
+from utils.media import run_ffmpeg
+from utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from telegram import PhotoSize
+    from telegram.ext import CallbackContext
+
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR") if os.getenv("THUMBNAIL_CACHE_DIR") else 'downloads/thumbnails'
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES")) if os.getenv("THUMBNAIL_CACHE_MAX_BYTES") \
+    else 50 * 1024 * 1024
+THUMBNAIL_SIZE = 320
+
+ARTWORK_CACHE_DIR = os.getenv("ARTWORK_CACHE_DIR") if os.getenv("ARTWORK_CACHE_DIR") else 'downloads/artworks'
+ARTWORK_CACHE_MAX_BYTES = int(os.getenv("ARTWORK_CACHE_MAX_BYTES")) if os.getenv("ARTWORK_CACHE_MAX_BYTES") \
+    else 100 * 1024 * 1024
+ARTWORK_MAX_PIXELS = int(os.getenv("ARTWORK_MAX_PIXELS")) if os.getenv("ARTWORK_MAX_PIXELS") else 1280 * 1280
+ARTWORK_MAX_BYTES = int(os.getenv("ARTWORK_MAX_BYTES")) if os.getenv("ARTWORK_MAX_BYTES") else 1024 * 1024
+ARTWORK_TARGET_SIZE = int(os.getenv("ARTWORK_TARGET_SIZE")) if os.getenv("ARTWORK_TARGET_SIZE") else 800
+
+# Files are written to the caches under a temporary name first, which eviction leaves alone
+CACHE_TEMP_SUFFIX = '.tmp.jpg'
+
+
+@tracer.traced('extract_artwork')
+def extract_artwork(user_data: dict) -> str:
+    """Write the embedded artwork of the current music to `{music_path}.jpg`, but only the first time it is asked
+    for. Later calls return the path that was stored in `user_data['art_path']`.
+
+    **Keyword arguments:**
+     - user_data (dict) -- The `user_data` of the user
+
+    **Returns:**
+     The path of the extracted artwork or an empty string if the music has no artwork
+    """
+    import music_tag
+
+    music_path = user_data['music_path']
+
+    if user_data.get('art_extracted') or not music_path:
+        return user_data['art_path']
+
+    user_data['art_extracted'] = True
+
+    music = music_tag.load_file(music_path)
+    art = music['artwork']
+
+    if art:
+        art_path = user_data['art_path'] = f"{music_path}.jpg"
+
+        with open(art_path, 'wb') as art_file:
+            art_file.write(art.first.data)
+
+    return user_data['art_path']
+
+
+def generate_thumbnail(art_path: str) -> str:
+    """Make a small JPEG thumbnail out of an artwork. Thumbnails are cached by the hash of the artwork, so each
+    artwork is resized only once.
+
+    **Keyword arguments:**
+     - art_path (str) -- The path of the artwork
+
+    **Returns:**
+     The path of the thumbnail or an empty string if it couldn't be made
+    """
+    if not art_path or not os.path.exists(art_path):
+        return ''
+
+    with open(art_path, 'rb') as art:
+        art_hash = hashlib.sha1(art.read()).hexdigest()
+
+    thumbnail_path = f"{THUMBNAIL_CACHE_DIR}/{art_hash}.jpg"
+
+    if os.path.exists(thumbnail_path):
+        os.utime(thumbnail_path)
+        return thumbnail_path
+
+    Path(THUMBNAIL_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+    # Each thread gets its own temporary file, even for the same artwork
+    temp_file, temp_thumbnail_path = tempfile.mkstemp(suffix=CACHE_TEMP_SUFFIX, dir=THUMBNAIL_CACHE_DIR)
+    os.close(temp_file)
+
+    if not run_ffmpeg(['-i', art_path, '-vf',
+                       f"scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease", '-q:v', '5',
+                       temp_thumbnail_path]) or not os.path.getsize(temp_thumbnail_path):
+        delete_file(temp_thumbnail_path)
+        return ''
+
+    os.replace(temp_thumbnail_path, thumbnail_path)
+
+    evict_cache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES)
+
+    return thumbnail_path
+
+
+def evict_cache(cache_dir: str, max_bytes: int) -> None:
+    """Delete the least recently used files of a cache directory until its size fits in `max_bytes`.
+
+    **Keyword arguments:**
+     - cache_dir (str) -- The directory of the cache
+     - max_bytes (int) -- The maximum size of the cache in bytes
+    """
+    entries = []
+
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith(CACHE_TEMP_SUFFIX):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total_size -= size
+
+
+def pick_photo_size(photo_sizes: [PhotoSize]) -> PhotoSize:
+    """Pick the largest `PhotoSize` that fits in both `ARTWORK_MAX_PIXELS` and `ARTWORK_MAX_BYTES`. If none of the
+    sizes fits, the smallest one is picked.
+
+    **Keyword arguments:**
+     - photo_sizes (list) -- The sizes Telegram offers for a photo, i.e. `message.photo`
+
+    **Returns:**
+     The picked `PhotoSize`
+    """
+    by_area = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    fitting_sizes = [
+        size for size in by_area
+        if size.width * size.height <= ARTWORK_MAX_PIXELS and (size.file_size or 0) <= ARTWORK_MAX_BYTES
+    ]
+
+    return fitting_sizes[-1] if fitting_sizes else by_area[0]
+
+
+def normalize_artwork(user_id: int, photo_sizes: [PhotoSize], context: CallbackContext) -> str:
+    """Download the best size of a photo, downscale and recompress it to `ARTWORK_TARGET_SIZE` and store it in the
+    artwork cache, keyed by its `file_unique_id`. A photo which is already in the cache is not downloaded again.
+
+    **Keyword arguments:**
+     - user_id (int) -- The user's id
+     - photo_sizes (list) -- The sizes Telegram offers for a photo, i.e. `message.photo`
+     - context (CallbackContext) -- The context object of the user
+
+    **Returns:**
+     The path of the user's copy of the normalized artwork
+    """
+    photo_size = pick_photo_size(photo_sizes)
+    cached_art_path = f"{ARTWORK_CACHE_DIR}/{photo_size.file_unique_id}.jpg"
+    user_art_path = f"downloads/{user_id}/{photo_size.file_unique_id}.jpg"
+
+    if os.path.exists(cached_art_path):
+        os.utime(cached_art_path)
+    else:
+        Path(ARTWORK_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+        file_download_path = download_file(
+            user_id=user_id,
+            file_to_download=photo_size,
+            file_type='photo',
+            context=context
+        )
+
+        # Each thread gets its own temporary file, even for the same photo
+        temp_file, temp_art_path = tempfile.mkstemp(suffix=CACHE_TEMP_SUFFIX, dir=ARTWORK_CACHE_DIR)
+        os.close(temp_file)
+
+        if not run_ffmpeg(['-i', file_download_path, '-vf',
+                           f"scale='min({ARTWORK_TARGET_SIZE},iw)':'min({ARTWORK_TARGET_SIZE},ih)'"
+                           f":force_original_aspect_ratio=decrease", '-q:v', '3', temp_art_path]) \
+                or not os.path.getsize(temp_art_path):
+            # The user gets the photo as it is, but it isn't cached, so it is normalized again the next time
+            delete_file(temp_art_path)
+            os.replace(file_download_path, user_art_path)
+
+            return user_art_path
+
+        os.replace(temp_art_path, cached_art_path)
+        delete_file(file_download_path)
+
+        evict_cache(ARTWORK_CACHE_DIR, ARTWORK_CACHE_MAX_BYTES)
+
+    link_or_clone_file(cached_art_path, user_art_path)
+
+    return user_art_path
+
+
+def cache_artwork(art_path: str) -> str:
+    """Keep a copy of an artwork in the artwork cache, keyed by its hash, so that it outlives the session it came
+    from.
+
+    **Keyword arguments:**
+     - art_path (str) -- The path of the artwork
+
+    **Returns:**
+     The path of the cached artwork or an empty string if there is no artwork
+    """
+    if not art_path or not os.path.exists(art_path):
+        return ''
+
+    with open(art_path, 'rb') as art:
+        art_hash = hashlib.sha1(art.read()).hexdigest()
+
+    cached_art_path = f"{ARTWORK_CACHE_DIR}/{art_hash}.jpg"
+
+    if os.path.exists(cached_art_path):
+        os.utime(cached_art_path)
+    else:
+        Path(ARTWORK_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+        link_or_clone_file(art_path, cached_art_path)
+        evict_cache(ARTWORK_CACHE_DIR, ARTWORK_CACHE_MAX_BYTES)
+
+    return cached_art_path
+
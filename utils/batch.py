@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS")) if os.getenv("BATCH_WORKERS") else os.cpu_count()
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES")) if os.getenv("BATCH_MAX_FILES") else 20
+BATCH_DOWNLOAD_THREADS = int(os.getenv("BATCH_DOWNLOAD_THREADS")) if os.getenv("BATCH_DOWNLOAD_THREADS") else 4
+BATCH_SHARED_TAGS = ['artist', 'album', 'genre', 'year']
+
+_executor = None
+
+
+def get_batch_executor() -> ProcessPoolExecutor:
+    """Return the process pool which batch sessions are processed on. The pool is created on first use, from a
+    handler thread while the other threads of the bot hold their locks, so its processes are spawned rather than
+    forked.
+
+    **Returns:**
+     ProcessPoolExecutor instance
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+    return _executor
+
+
+def save_partial_tags_to_file(file: str, tags: dict, new_art_path: str) -> str:
+    """Like `save_tags_to_file`, but only the tags that have a value in `tags` are written. The rest of the tags of
+    the file are left untouched.
+
+    **Keyword arguments:**
+     - file (str) -- The path of the file
+     - tags (dict) -- The dictionary containing the tags and their values
+     - new_art_path (str) -- The new album art to set
+
+    **Returns:**
+     The path of the file
+    """
+    import music_tag
+
+    music = music_tag.load_file(file)
+
+    if new_art_path:
+        with open(new_art_path, 'rb') as art:
+            music['artwork'] = art.read()
+
+    for tag, value in tags.items():
+        if value:
+            music[tag] = int(value) if tag in ['year', 'disknumber', 'tracknumber'] else value
+
+    music.save()
+
+    return file
+
+
+def save_batch_tags_to_files(files: [str], shared_tags: dict, new_art_path: str) -> [str]:
+    """Write the shared tags and the track number of each file to the files of a batch session in parallel. The
+    track numbers follow the order of `files`.
+
+    **Keyword arguments:**
+     - files (list) -- The paths of the files, in the order of the tracks
+     - shared_tags (dict) -- The tags which are shared among all tracks
+     - new_art_path (str) -- The new album art to set for all tracks
+
+    **Returns:**
+     The paths of the files
+    """
+    executor = get_batch_executor()
+
+    futures = [
+        executor.submit(
+            save_partial_tags_to_file,
+            file,
+            {**shared_tags, 'tracknumber': track_number},
+            new_art_path
+        )
+        for track_number, file in enumerate(files, start=1)
+    ]
+
+    return [future.result() for future in futures]
@@ -0,0 +1,244 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE")) if os.getenv("DB_POOL_SIZE") else 0
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS")) if os.getenv("DB_POOL_TIMEOUT_SECONDS") \
+    else 10.0
+DB_POOL_PRE_PING_SECONDS = float(os.getenv("DB_POOL_PRE_PING_SECONDS")) if os.getenv("DB_POOL_PRE_PING_SECONDS") \
+    else 60.0
+
+logger = logging.getLogger()
+
+_pool = None
+
+
+class PoolTimeout(Exception):
+    """No connection of the pool became free in time."""
+
+
+class ConnectionPool:
+    """A connection resolver (see orator's `ConnectionResolverInterface`) for the models which lends every thread a
+    connection of its own out of at most `size` connections per database.
+
+    A thread keeps the connection it was lent until it calls `release`, which the bot does once an update has been
+    handled, so that all the queries of a handler (and its transactions) go through one connection. A thread which
+    finds every connection lent waits up to `timeout` seconds for one. A connection which sat idle for longer than
+    `pre_ping_after` seconds is pinged before it is lent, and opened again if the server closed it in the meantime,
+    e.g. after MySQL's `wait_timeout`.
+    """
+
+    def __init__(self, config: dict, size: int, timeout: float = DB_POOL_TIMEOUT_SECONDS,
+                 pre_ping_after: float = DB_POOL_PRE_PING_SECONDS, factory=None):
+        """**Keyword arguments:**
+         - config (dict) -- The connections, like `DATABASES` of `dbconfig.py`
+         - size (int) -- The number of connections per database
+         - timeout (float) -- The seconds to wait for a free connection
+         - pre_ping_after (float) -- The idle seconds after which a connection is pinged before it is lent
+         - factory (ConnectionFactory) -- Opens the connections
+        """
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.pre_ping_after = pre_ping_after
+        # orator is slow to import, so it is imported once the pool is made, i.e. after the bot has started
+        from orator.connectors.connection_factory import ConnectionFactory
+
+        self.factory = factory or ConnectionFactory()
+
+        self._condition = threading.Condition()
+        # Free connections by database, as `(connection, returned at)` with the most recently returned last
+        self._idle = {}
+        self._opened = {}
+        self._lent = {}
+        self._local = threading.local()
+
+    def connection(self, name: str = None):
+        """Return the connection the current thread was lent, or lend it one.
+
+        **Keyword arguments:**
+         - name (str) -- The name of the database, the default one if `None`
+
+        **Returns:**
+         `orator.connections.Connection`
+        """
+        name = name or self.get_default_connection()
+        connections = self._thread_connections()
+
+        if name not in connections:
+            connections[name] = self._check_out(name)
+
+        return connections[name]
+
+    def release(self) -> None:
+        """Give the connections of the current thread back to the pool. A transaction which was left open is rolled
+        back.
+        """
+        connections = self._thread_connections()
+
+        for name, connection in list(connections.items()):
+            del connections[name]
+
+            try:
+                while connection.transaction_level() > 0:
+                    connection.rollback()
+            except (OSError, BaseException):
+                logger.error(f"Error on rolling back a transaction left open on {name}.", exc_info=True)
+                self._discard(name, connection)
+                continue
+
+            with self._condition:
+                self._lent[name] -= 1
+                self._idle.setdefault(name, []).append((connection, time.monotonic()))
+                self._update_gauges(name)
+                self._condition.notify()
+
+    def get_default_connection(self) -> str:
+        return self.config['default']
+
+    def set_default_connection(self, name: str) -> None:
+        self.config['default'] = name
+
+    def _thread_connections(self) -> dict:
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+
+        return self._local.connections
+
+    def _check_out(self, name: str):
+        started_at = time.monotonic()
+        deadline = started_at + self.timeout
+
+        with self._condition:
+            while True:
+                idle = self._idle.setdefault(name, [])
+
+                if idle:
+                    connection, returned_at = idle.pop()
+                    break
+
+                if self._opened.get(name, 0) < self.size:
+                    connection, returned_at = None, None
+                    self._opened[name] = self._opened.get(name, 0) + 1
+                    break
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    metrics.increment('db_pool_timeouts_total', database=name)
+                    raise PoolTimeout(f"No connection to {name} became free in {self.timeout} seconds")
+
+                self._condition.wait(remaining)
+
+            self._lent[name] = self._lent.get(name, 0) + 1
+            self._update_gauges(name)
+
+        metrics.observe('db_pool_wait_seconds', time.monotonic() - started_at, database=name)
+
+        try:
+            if connection is None:
+                return self._open(name)
+
+            if time.monotonic() - returned_at > self.pre_ping_after and not self._ping(connection):
+                metrics.increment('db_pool_reconnects_total', database=name)
+                connection.reconnect()
+
+            return connection
+        except (OSError, BaseException):
+            self._discard(name, connection)
+            raise
+
+    def _open(self, name: str):
+        config = dict(self.config[name], name=name)
+
+        def reconnect(stale_connection):
+            fresh_connection = self.factory.make(config, name)
+            stale_connection.set_connection(fresh_connection.get_connection())
+            stale_connection.set_read_connection(fresh_connection.get_read_connection())
+
+        connection = self.factory.make(config, name)
+        connection.set_reconnector(reconnect)
+
+        # orator times every query and hands it to `log_query`, which is where it joins the trace of the update
+        log_query = connection.log_query
+
+        def trace_query(query, bindings, time_=None):
+            tracer.record('db', (time_ or 0) / 1000, database=name, query=query[:200])
+            log_query(query, bindings, time_)
+
+        connection.log_query = trace_query
+
+        return connection
+
+    @staticmethod
+    def _ping(connection) -> bool:
+        try:
+            connection.get_connection().cursor().execute('SELECT 1')
+            return True
+        except (OSError, BaseException):
+            return False
+
+    def _discard(self, name: str, connection) -> None:
+        if connection is not None:
+            try:
+                connection.disconnect()
+            except (OSError, BaseException):
+                pass
+
+        with self._condition:
+            self._opened[name] -= 1
+            self._lent[name] -= 1
+            self._update_gauges(name)
+            self._condition.notify()
+
+    def _update_gauges(self, name: str) -> None:
+        metrics.set_gauge('db_pool_size', self.size, database=name)
+        metrics.set_gauge('db_pool_open', self._opened.get(name, 0), database=name)
+        metrics.set_gauge('db_pool_in_use', self._lent.get(name, 0), database=name)
+
+
+def setup_connection_pool(config: dict, size: int) -> ConnectionPool:
+    """Make the models use a connection pool. `DB_POOL_SIZE` overrides the size, if set.
+
+    **Keyword arguments:**
+     - config (dict) -- The connections, like `DATABASES` of `dbconfig.py`
+     - size (int) -- The number of connections per database, usually the number of threads which run handlers
+
+    **Returns:**
+     The pool
+    """
+    from orator import Model
+
+    global _pool
+
+    _pool = ConnectionPool(config, DB_POOL_SIZE or size)
+    Model.set_connection_resolver(_pool)
+
+    return _pool
+
+
+def release_database_connection(*args) -> None:
+    """Give the database connection of the current thread back to the pool. Takes any arguments, so that it can
+    be used as a handler or a job callback.
+    """
+    if _pool is not None:
+        _pool.release()
+
+
+def releases_database_connection(func):
+    """Decorate a function which runs outside the handlers of the dispatcher thread, e.g. a job, to give its
+    database connection back to the pool when it returns.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            release_database_connection()
+
+    return wrapper
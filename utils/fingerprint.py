@@ -0,0 +1,321 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from utils.media import decode_pcm
+from utils.metrics import metrics
+
+FINGERPRINT_DATABASE = os.getenv("FINGERPRINT_DATABASE") if os.getenv("FINGERPRINT_DATABASE") \
+    else 'fingerprints.sqlite3'
+FINGERPRINT_SECONDS = int(os.getenv("FINGERPRINT_SECONDS")) if os.getenv("FINGERPRINT_SECONDS") else 90
+FINGERPRINT_MAX_BIT_ERROR_RATE = float(os.getenv("FINGERPRINT_MAX_BIT_ERROR_RATE")) \
+    if os.getenv("FINGERPRINT_MAX_BIT_ERROR_RATE") else 0.35
+# An entry takes about 65 KB with its indexed sub-fingerprints; the entries seen the longest ago are evicted past this
+FINGERPRINT_MAX_ENTRIES = int(os.getenv("FINGERPRINT_MAX_ENTRIES")) if os.getenv("FINGERPRINT_MAX_ENTRIES") \
+    else 2000
+
+# A sub-fingerprint of 32 bits is computed every HOP samples from a frame of FRAME_SIZE samples. Each bit tells
+# whether the energy difference of two neighbouring bands between 300 and 2000 Hz grew or shrank since the last frame.
+SAMPLE_RATE = 5512
+FRAME_SIZE = 2048
+HOP = 64
+BANDS = 33
+LOWEST_FREQUENCY = 300
+HIGHEST_FREQUENCY = 2000
+
+# Frames are analysed this many at a time, so that memory stays flat on long tracks
+FRAMES_PER_CHUNK = 1024
+
+# Matches are verified over blocks of this many sub-fingerprints, about 3 seconds
+BLOCK_SIZE = 256
+# Every INDEX_STEP-th sub-fingerprint of a music is indexed, and every one of the first QUERY_FRAMES of a query is
+# looked up, so that each alignment of a copy gets as many chances to match as if everything was indexed
+INDEX_STEP = 8
+QUERY_FRAMES = 2048
+# Only the alignments with the most matching sub-fingerprints are verified
+MAX_CANDIDATES = 20
+
+_index = None
+
+
+class FingerprintIndex:
+    """A local index of the fingerprints of the music the bot has seen, along with the tags and artwork users gave
+    them. Every `INDEX_STEP`-th sub-fingerprint is indexed, so a re-encoded copy of a music is found as long as a few
+    of its sub-fingerprints survive unchanged; candidates are then verified by the bit error rate of a whole block.
+
+    The index is a SQLite database in WAL mode, so the worker processes of `cluster.py` can share it. It holds at
+    most `max_entries` musics; the ones which were saved or found the longest ago are evicted first.
+    """
+
+    def __init__(self, path: str, max_entries: int = FINGERPRINT_MAX_ENTRIES):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' bits BLOB NOT NULL,'
+            ' tags TEXT NOT NULL,'
+            ' art_path TEXT NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ')'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprint_hashes ('
+            ' hash INTEGER NOT NULL,'
+            ' fingerprint_id INTEGER NOT NULL,'
+            ' position INTEGER NOT NULL,'
+            ' PRIMARY KEY (hash, fingerprint_id, position)'
+            ') WITHOUT ROWID'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS fingerprint_hashes_id_index ON fingerprint_hashes (fingerprint_id)'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS fingerprints_updated_at_index ON fingerprints (updated_at)'
+        )
+
+    def find(self, fingerprint) -> (int, dict, str):
+        """Find a fingerprint of the same audio.
+
+        **Keyword arguments:**
+         - fingerprint (numpy.ndarray) -- The fingerprint to look for
+
+        **Returns:**
+         The id, the tags and the artwork path of the closest fingerprint, or `None` three times if nothing is close
+         enough
+        """
+        if len(fingerprint) < BLOCK_SIZE:
+            return None, None, None
+
+        query_positions = range(0, min(len(fingerprint), QUERY_FRAMES) - BLOCK_SIZE + 1)
+        positions_by_hash = {}
+
+        for position in query_positions:
+            # Silence gives all zero sub-fingerprints, which would match every music
+            if fingerprint[position]:
+                positions_by_hash.setdefault(int(fingerprint[position]), []).append(position)
+
+        hashes = list(positions_by_hash)
+        votes = Counter()
+
+        with self._lock:
+            # SQLite takes at most 999 parameters
+            for chunk_start in range(0, len(hashes), 900):
+                chunk = hashes[chunk_start:chunk_start + 900]
+                rows = self._connection.execute(
+                    f"SELECT hash, fingerprint_id, position FROM fingerprint_hashes"
+                    f" WHERE hash IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+
+                for hash_value, fingerprint_id, position in rows:
+                    for query_position in positions_by_hash[hash_value]:
+                        votes[(fingerprint_id, position - query_position)] += 1
+
+        best = (FINGERPRINT_MAX_BIT_ERROR_RATE, None)
+        stored_fingerprints = {}
+
+        for (fingerprint_id, offset), _ in votes.most_common(MAX_CANDIDATES):
+            if fingerprint_id not in stored_fingerprints:
+                stored_fingerprints[fingerprint_id] = self._load_bits(fingerprint_id)
+
+            stored = stored_fingerprints[fingerprint_id]
+            start = max(0, -offset)
+            length = min(len(fingerprint) - start, len(stored) - start - offset)
+
+            if length < BLOCK_SIZE:
+                continue
+
+            bit_error_rate = count_bit_errors(
+                fingerprint[start:start + length],
+                stored[start + offset:start + offset + length]
+            ) / (length * 32)
+
+            if bit_error_rate < best[0]:
+                best = (bit_error_rate, fingerprint_id)
+
+        if best[1] is None:
+            return None, None, None
+
+        with self._lock:
+            tags, art_path = self._connection.execute(
+                'SELECT tags, art_path FROM fingerprints WHERE id = ?', (best[1],)
+            ).fetchone()
+            # A music which is uploaded again is kept longer
+            self._connection.execute('UPDATE fingerprints SET updated_at = ? WHERE id = ?', (time.time(), best[1]))
+
+        return best[1], json.loads(tags), art_path
+
+    def save(self, fingerprint, tags: dict, art_path: str, fingerprint_id: int = None) -> int:
+        """Remember the tags and the artwork of a music. If the music was found in the index before, its entry is
+        updated instead of adding a new one.
+
+        **Keyword arguments:**
+         - fingerprint (numpy.ndarray) -- The fingerprint of the music, only needed for a new entry
+         - tags (dict) -- The tags of the music
+         - art_path (str) -- The path of the artwork of the music, in a place where it is kept
+         - fingerprint_id (int) -- The id `find` or an earlier `save` returned for the music, if any
+
+        **Returns:**
+         The id of the entry
+        """
+        with self._lock:
+            if fingerprint_id is not None:
+                self._connection.execute(
+                    'UPDATE fingerprints SET tags = ?, art_path = ?, updated_at = ? WHERE id = ?',
+                    (json.dumps(tags), art_path, time.time(), fingerprint_id)
+                )
+                return fingerprint_id
+
+            self._connection.execute('BEGIN')
+
+            try:
+                cursor = self._connection.execute(
+                    'INSERT INTO fingerprints (bits, tags, art_path, updated_at) VALUES (?, ?, ?, ?)',
+                    (fingerprint.astype('<u4').tobytes(), json.dumps(tags), art_path, time.time())
+                )
+                fingerprint_id = cursor.lastrowid
+
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO fingerprint_hashes (hash, fingerprint_id, position) VALUES (?, ?, ?)',
+                    [(int(fingerprint[position]), fingerprint_id, position)
+                     for position in range(0, len(fingerprint), INDEX_STEP)]
+                )
+                self._evict()
+                self._connection.execute('COMMIT')
+            except sqlite3.Error:
+                self._connection.execute('ROLLBACK')
+                raise
+
+        return fingerprint_id
+
+    def _evict(self) -> None:
+        """Delete the entries seen the longest ago, along with their sub-fingerprints, so that at most
+        `max_entries` are left.
+        """
+        entries, = self._connection.execute('SELECT COUNT(*) FROM fingerprints').fetchone()
+
+        if entries <= self.max_entries:
+            return
+
+        evicted_ids = [row[0] for row in self._connection.execute(
+            'SELECT id FROM fingerprints ORDER BY updated_at, id LIMIT ?', (entries - self.max_entries,)
+        )]
+
+        self._connection.executemany('DELETE FROM fingerprint_hashes WHERE fingerprint_id = ?',
+                                     [(fingerprint_id,) for fingerprint_id in evicted_ids])
+        self._connection.executemany('DELETE FROM fingerprints WHERE id = ?',
+                                     [(fingerprint_id,) for fingerprint_id in evicted_ids])
+        metrics.increment('fingerprints_evicted_total', len(evicted_ids))
+
+    def _load_bits(self, fingerprint_id: int):
+        import numpy
+
+        with self._lock:
+            bits, = self._connection.execute(
+                'SELECT bits FROM fingerprints WHERE id = ?', (fingerprint_id,)
+            ).fetchone()
+
+        return numpy.frombuffer(bits, dtype='<u4')
+
+
+def get_fingerprint_index() -> FingerprintIndex:
+    """Return the fingerprint index of this process. The index is opened on first use.
+
+    **Returns:**
+     FingerprintIndex instance
+    """
+    global _index
+
+    if _index is None:
+        _index = FingerprintIndex(FINGERPRINT_DATABASE)
+
+    return _index
+
+
+def compute_fingerprint(samples):
+    """Compute the fingerprint of mono PCM samples at `SAMPLE_RATE`.
+
+    **Keyword arguments:**
+     - samples (numpy.ndarray) -- The samples
+
+    **Returns:**
+     The sub-fingerprints as a `numpy.ndarray` of `uint32`, one every `HOP` samples
+    """
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    if len(samples) < FRAME_SIZE + HOP:
+        return numpy.zeros(0, dtype=numpy.uint32)
+
+    frames = sliding_window_view(samples.astype(numpy.float32), FRAME_SIZE)[::HOP]
+    window = numpy.hanning(FRAME_SIZE).astype(numpy.float32)
+    band_matrix = get_band_matrix()
+
+    energies = numpy.empty((len(frames), BANDS), dtype=numpy.float32)
+
+    for chunk_start in range(0, len(frames), FRAMES_PER_CHUNK):
+        chunk = frames[chunk_start:chunk_start + FRAMES_PER_CHUNK] * window
+        spectrum = numpy.abs(numpy.fft.rfft(chunk, axis=1)) ** 2
+        energies[chunk_start:chunk_start + FRAMES_PER_CHUNK] = spectrum @ band_matrix
+
+    band_differences = energies[:, :-1] - energies[:, 1:]
+    bits = (band_differences[1:] - band_differences[:-1]) > 0
+
+    return numpy.packbits(bits, axis=1).view('>u4').ravel().astype(numpy.uint32)
+
+
+def get_band_matrix():
+    """Return the matrix which sums the power spectrum of a frame into `BANDS` logarithmically spaced bands."""
+    import numpy
+
+    edges = numpy.geomspace(LOWEST_FREQUENCY, HIGHEST_FREQUENCY, BANDS + 1)
+    frequencies = numpy.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE)
+    band_of_bin = numpy.searchsorted(edges, frequencies, side='right') - 1
+
+    band_matrix = numpy.zeros((len(frequencies), BANDS), dtype=numpy.float32)
+    in_range = (band_of_bin >= 0) & (band_of_bin < BANDS)
+    band_matrix[numpy.nonzero(in_range)[0], band_of_bin[in_range]] = 1
+
+    return band_matrix
+
+
+def count_bit_errors(first, second) -> int:
+    """Count the bits which differ between two equally long fingerprints."""
+    import numpy
+
+    return int(numpy.unpackbits(numpy.bitwise_xor(first, second).view(numpy.uint8)).sum())
+
+
+def fingerprint_file(music_path: str):
+    """Fingerprint the first `FINGERPRINT_SECONDS` of a music. The time it takes per minute of audio is recorded in
+    the `fingerprint_seconds_per_audio_minute` metric.
+
+    **Keyword arguments:**
+     - music_path (str) -- The path of the music
+
+    **Returns:**
+     The fingerprint as a `numpy.ndarray` of `uint32`, or `None` if the music couldn't be decoded
+    """
+    started_at = time.perf_counter()
+
+    samples = decode_pcm(music_path, SAMPLE_RATE, FINGERPRINT_SECONDS)
+
+    if samples is None:
+        return None
+
+    fingerprint = compute_fingerprint(samples)
+    audio_minutes = len(samples) / SAMPLE_RATE / 60
+
+    if audio_minutes:
+        metrics.observe('fingerprint_seconds_per_audio_minute', (time.perf_counter() - started_at) / audio_minutes)
+
+    return fingerprint
@@ -0,0 +1,518 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING
+from uuid import uuid4
+
+from telegram import ChatAction, InputMediaAudio
+from telegram.error import TelegramError
+
+from utils import download_file, delete_file, create_user_directory, translate_key_to, save_tags_to_file, \
+    generate_start_over_keyboard, convert_seconds_to_human_readable_form, open_for_upload
+from utils.artwork import generate_thumbnail
+from utils.media import convert_to_voice, cut_music_clips, probe_audio, choose_media_path, choose_cut_extension
+from utils.metrics import metrics
+from utils.progress import ProgressReporter, track_upload, track_uploads
+
+if TYPE_CHECKING:
+    from telegram import Bot
+
+JOBS_DATABASE = os.getenv("JOBS_DATABASE") if os.getenv("JOBS_DATABASE") else 'jobs.sqlite3'
+JOBS_HEARTBEAT_SECONDS = int(os.getenv("JOBS_HEARTBEAT_SECONDS")) if os.getenv("JOBS_HEARTBEAT_SECONDS") else 30
+JOBS_OWNER_TIMEOUT_SECONDS = int(os.getenv("JOBS_OWNER_TIMEOUT_SECONDS")) \
+    if os.getenv("JOBS_OWNER_TIMEOUT_SECONDS") else 90
+JOBS_RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_SECONDS")) if os.getenv("JOBS_RETENTION_SECONDS") \
+    else 7 * 24 * 3600
+BOT_USERNAME = os.getenv("BOT_USERNAME")
+
+STAGE_CREATED = 'created'
+STAGE_DOWNLOADED = 'downloaded'
+STAGE_ENCODED = 'encoded'
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+
+# Who owns the jobs this process runs. A pid is no good, as a restarted container usually gets the same pids again
+INSTANCE_ID = uuid4().hex
+
+logger = logging.getLogger()
+
+_journal = None
+
+
+class JobJournal:
+    """An on-disk journal of media jobs. Each job records its inputs, the last stage it completed and the files it
+    has produced so far, so that a job which was interrupted by a restart can go on from where it stopped.
+
+    The journal is a SQLite database in WAL mode, so the worker processes of `cluster.py` can share it. Each job is
+    owned by the instance (one run of a process) which runs it, and every instance writes a heartbeat to the journal:
+    the unfinished jobs of an instance which has stopped beating are orphans, which any other instance can take over.
+    """
+
+    def __init__(self, path: str, owner: str = INSTANCE_ID):
+        """**Keyword arguments:**
+         - path (str) -- The path of the database
+         - owner (str) -- The id of this instance
+        """
+        self.owner = owner
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        # The workers of `cluster.py` open the journal at the same time; only the first one creates or migrates it
+        self._connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            self._create_tables()
+        except sqlite3.Error:
+            self._connection.execute('ROLLBACK')
+            raise
+
+        self._connection.execute('COMMIT')
+        self.heartbeat()
+
+    def _create_tables(self) -> None:
+        columns = [column[1] for column in self._connection.execute('PRAGMA table_info(jobs)')]
+
+        if 'owner_pid' in columns:
+            # Journals from before the owners were instances: their jobs are left without a live owner
+            self._connection.execute('ALTER TABLE jobs RENAME TO jobs_by_pid')
+
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' kind TEXT NOT NULL,'
+            ' user_id INTEGER NOT NULL,'
+            ' chat_id INTEGER NOT NULL,'
+            ' stage TEXT NOT NULL,'
+            ' inputs TEXT NOT NULL,'
+            ' outputs TEXT NOT NULL,'
+            ' owner TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ')'
+        )
+
+        if 'owner_pid' in columns:
+            self._connection.execute(
+                "INSERT INTO jobs SELECT id, kind, user_id, chat_id, stage, inputs, outputs, '', created_at, updated_at"
+                " FROM jobs_by_pid"
+            )
+            self._connection.execute('DROP TABLE jobs_by_pid')
+
+        self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_stage_index ON jobs (stage)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS owners (id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)'
+        )
+
+    def create(self, kind: str, user_id: int, chat_id: int, inputs: dict) -> dict:
+        """Record a new job.
+
+        **Keyword arguments:**
+         - kind (str) -- The kind of the job, either 'voice' or 'cut'
+         - user_id (int) -- The user id of the user
+         - chat_id (int) -- The chat to send the result to
+         - inputs (dict) -- Everything the job needs to run
+
+        **Returns:**
+         The job
+        """
+        now = time.time()
+
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT INTO jobs (kind, user_id, chat_id, stage, inputs, outputs, owner, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (kind, user_id, chat_id, STAGE_CREATED, json.dumps(inputs), '{}', self.owner, now, now)
+            )
+
+        return {
+            'id': cursor.lastrowid,
+            'kind': kind,
+            'user_id': user_id,
+            'chat_id': chat_id,
+            'stage': STAGE_CREATED,
+            'inputs': inputs,
+            'outputs': {},
+        }
+
+    def advance(self, job: dict, stage: str, **outputs) -> None:
+        """Record that a job has completed a stage, along with the files it produced.
+
+        **Keyword arguments:**
+         - job (dict) -- The job
+         - stage (str) -- The stage the job has completed
+         - outputs -- The outputs of the stage
+        """
+        job['stage'] = stage
+        job['outputs'].update(outputs)
+
+        with self._lock:
+            self._connection.execute(
+                'UPDATE jobs SET stage = ?, outputs = ?, updated_at = ? WHERE id = ?',
+                (stage, json.dumps(job['outputs']), time.time(), job['id'])
+            )
+
+    def heartbeat(self) -> None:
+        """Record that this instance is alive, so that its jobs are not taken over."""
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO owners (id, heartbeat_at) VALUES (?, ?)',
+                (self.owner, time.time())
+            )
+
+    def claim_orphaned_jobs(self, owner_timeout: float = JOBS_OWNER_TIMEOUT_SECONDS) -> [dict]:
+        """Take over the unfinished jobs of instances which have not written a heartbeat for `owner_timeout` seconds.
+
+        **Keyword arguments:**
+         - owner_timeout (float) -- The seconds without a heartbeat after which an instance is deemed stopped
+
+        **Returns:**
+         The claimed jobs
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, kind, user_id, chat_id, stage, inputs, outputs, owner FROM jobs'
+                ' WHERE stage NOT IN (?, ?) AND owner != ?'
+                ' AND owner NOT IN (SELECT id FROM owners WHERE heartbeat_at >= ?) ORDER BY id',
+                (STAGE_DONE, STAGE_FAILED, self.owner, time.time() - owner_timeout)
+            ).fetchall()
+
+            jobs = []
+
+            for job_id, kind, user_id, chat_id, stage, inputs, outputs, owner in rows:
+                # Another instance may claim the same job at the same time, only one of them wins
+                cursor = self._connection.execute(
+                    'UPDATE jobs SET owner = ? WHERE id = ? AND owner = ?',
+                    (self.owner, job_id, owner)
+                )
+
+                if cursor.rowcount == 1:
+                    jobs.append({
+                        'id': job_id,
+                        'kind': kind,
+                        'user_id': user_id,
+                        'chat_id': chat_id,
+                        'stage': stage,
+                        'inputs': json.loads(inputs),
+                        'outputs': json.loads(outputs),
+                    })
+
+        return jobs
+
+    def prune(self, retention_seconds: float = JOBS_RETENTION_SECONDS,
+              owner_timeout: float = JOBS_OWNER_TIMEOUT_SECONDS) -> int:
+        """Delete the finished and failed jobs which ended more than `retention_seconds` ago, and the heartbeats of
+        the instances which have stopped and own no unfinished job anymore.
+
+        **Returns:**
+         The number of deleted jobs
+        """
+        now = time.time()
+
+        with self._lock:
+            cursor = self._connection.execute(
+                'DELETE FROM jobs WHERE stage IN (?, ?) AND updated_at < ?',
+                (STAGE_DONE, STAGE_FAILED, now - retention_seconds)
+            )
+            self._connection.execute(
+                'DELETE FROM owners WHERE heartbeat_at < ?'
+                ' AND id NOT IN (SELECT owner FROM jobs WHERE stage NOT IN (?, ?))',
+                (now - owner_timeout, STAGE_DONE, STAGE_FAILED)
+            )
+
+        return cursor.rowcount
+
+
+def get_job_journal() -> JobJournal:
+    """Return the job journal of this process. The journal is opened on first use.
+
+    **Returns:**
+     JobJournal instance
+    """
+    global _journal
+
+    if _journal is None:
+        _journal = JobJournal(JOBS_DATABASE)
+
+    return _journal
+
+
+def run_job(bot: Bot, job: dict, resumed: bool = False) -> bool:
+    """Run the remaining stages of a job: download the music (unless it is still on the disk), encode it and send
+    the result. Every completed stage is recorded in the journal.
+
+    **Keyword arguments:**
+     - bot (Bot) -- The bot to download and send the files with
+     - job (dict) -- The job
+     - resumed (bool) -- Whether the job has been interrupted by a restart before
+
+    **Returns:**
+     `True` if the result was sent
+    """
+    journal = get_job_journal()
+    inputs = job['inputs']
+    outputs = job['outputs']
+    lang = inputs['language']
+
+    music_path = outputs.get('music_path', inputs['music_path'])
+
+    if not music_path or not os.path.exists(music_path):
+        try:
+            create_user_directory(job['user_id'])
+            music_path = download_file(
+                user_id=job['user_id'],
+                file_to_download=bot.get_file(inputs['file_id']),
+                file_type='audio',
+                context=None
+            )
+        except (ValueError, BaseException):
+            logger.error(f"Error on downloading the file of job {job['id']}.", exc_info=True)
+            journal.advance(job, STAGE_FAILED)
+            bot.send_message(job['chat_id'], translate_key_to('ERR_ON_DOWNLOAD_AUDIO_MESSAGE', lang))
+            return False
+
+        journal.advance(job, STAGE_DOWNLOADED, music_path=music_path, downloaded_by_job=True)
+
+    # Telegram shows "recording" while the voice is encoded, and "sending" for the upload
+    action = ChatAction.RECORD_AUDIO if job['kind'] == 'voice' else ChatAction.UPLOAD_AUDIO
+
+    output_paths = []
+    sent = False
+
+    try:
+        with ProgressReporter(bot, job['chat_id'], lang, action) as progress:
+            output_paths = encode_job(bot, job, music_path, progress)
+
+            if output_paths:
+                if resumed:
+                    bot.send_message(job['chat_id'], translate_key_to('JOB_RESUMED', lang))
+
+                sent = send_job_result(bot, job, output_paths, progress)
+    except (OSError, BaseException):
+        logger.error(f"Error on running job {job['id']}.", exc_info=True)
+    finally:
+        # A job which raised is over as well, otherwise it would be left to its owner, which is still alive
+        journal.advance(job, STAGE_DONE if sent else STAGE_FAILED)
+
+        for output_path in output_paths or outputs.get('output_paths', []):
+            delete_file(output_path)
+
+        # A job which was handed the files of the user's session deletes them, as the session has moved on
+        if outputs.get('downloaded_by_job') or inputs.get('owns_files'):
+            delete_file(music_path)
+        if inputs.get('owns_files') and inputs.get('art_path'):
+            delete_file(inputs['art_path'])
+
+    return sent
+
+
+def encode_job(bot: Bot, job: dict, music_path: str, progress: ProgressReporter) -> [str]:
+    """Encode the results of a job, unless they were encoded before a restart, and record them in the journal: a
+    voice, or a clip for every range of a cut.
+
+    **Keyword arguments:**
+     - bot (Bot) -- The bot to tell the user about errors with
+     - job (dict) -- The job
+     - music_path (str) -- The path of the downloaded music
+     - progress (ProgressReporter) -- Shows the user the progress of the encoding
+
+    **Returns:**
+     The paths of the results, or an empty list if ffmpeg failed, in which case the user is told so
+    """
+    inputs = job['inputs']
+    outputs = job['outputs']
+    # Jobs journaled before a cut could have several ranges have a single `output_path`
+    output_paths = outputs.get('output_paths')
+
+    if not output_paths and outputs.get('output_path'):
+        output_paths = [outputs['output_path']]
+
+    if job['stage'] == STAGE_ENCODED and output_paths and all(os.path.exists(path) for path in output_paths):
+        return output_paths
+
+    probe = probe_audio(music_path)
+
+    if job['kind'] == 'voice':
+        output_paths = [f"{music_path}.ogg"]
+        media_path = choose_media_path(probe, 'ogg')
+        # Only as many segments as the job was admitted with, and none for the jobs resumed without admission
+        encoded = convert_to_voice(music_path, output_paths[0], inputs['duration'], inputs.get('segments', 1),
+                                   media_path=media_path, on_progress=progress.encoding)
+    else:
+        ranges = get_cutting_ranges(inputs)
+        extension = choose_cut_extension(probe)
+        output_paths = [f"{music_path}_cut.{extension}"] if len(ranges) == 1 else \
+            [f"{music_path}_cut_{index}.{extension}" for index in range(1, len(ranges) + 1)]
+        media_path = choose_media_path(probe, extension)
+        encoded = cut_music_clips(
+            music_path,
+            [(output_path, beginning_sec, ending_sec) for output_path, (beginning_sec, ending_sec)
+             in zip(output_paths, ranges)],
+            media_path,
+            progress.encoding
+        )
+
+    metrics.increment('media_jobs_total', kind=job['kind'], path=media_path)
+
+    if not encoded:
+        logger.error(f"ffmpeg failed on job {job['id']}.")
+
+        for output_path in output_paths:
+            delete_file(output_path)
+
+        bot.send_message(
+            job['chat_id'],
+            translate_key_to('ERR_ON_ENCODING', inputs['language']),
+            reply_markup=generate_start_over_keyboard(inputs['language'])
+        )
+
+        return []
+
+    if job['kind'] == 'cut':
+        try:
+            for output_path in output_paths:
+                save_tags_to_file(
+                    file=output_path,
+                    tags=inputs['tags'],
+                    new_art_path=inputs['art_path'] if os.path.exists(inputs['art_path']) else ''
+                )
+        except (OSError, BaseException):
+            bot.send_message(job['chat_id'], translate_key_to('ERR_ON_UPDATING_TAGS', inputs['language']))
+            logger.error(f"Error on updating tags for the clips of job {job['id']}.", exc_info=True)
+
+    get_job_journal().advance(job, STAGE_ENCODED, output_paths=output_paths, media_path=media_path)
+
+    return output_paths
+
+
+def get_cutting_ranges(inputs: dict) -> [(int, int)]:
+    """The ranges of a cut job, in seconds. Jobs journaled before a cut could have several ranges have a single
+    `beginning_sec` and `ending_sec`.
+    """
+    if 'ranges' in inputs:
+        return [tuple(cutting_range) for cutting_range in inputs['ranges']]
+
+    return [(inputs['beginning_sec'], inputs['ending_sec'])]
+
+
+def send_job_result(bot: Bot, job: dict, output_paths: [str], progress: ProgressReporter) -> bool:
+    """Upload the results of a job to the user. Several clips of a cut are sent as a media group.
+
+    **Keyword arguments:**
+     - bot (Bot) -- The bot to send the results with
+     - job (dict) -- The job
+     - output_paths (list) -- The paths of the results
+     - progress (ProgressReporter) -- Shows the user the progress of the upload
+
+    **Returns:**
+     `True` if the results were sent
+    """
+    inputs = job['inputs']
+    lang = inputs['language']
+    start_over_button_keyboard = generate_start_over_keyboard(lang)
+
+    progress.uploading(0, 1)
+
+    sent = True
+
+    try:
+        if job['kind'] == 'voice':
+            bot.send_voice(
+                voice=track_upload(open_for_upload(output_paths[0]), progress.uploading),
+                duration=inputs['duration'],
+                chat_id=job['chat_id'],
+                caption=f"{BOT_USERNAME}",
+                reply_markup=start_over_button_keyboard,
+                reply_to_message_id=inputs['reply_to_message_id']
+            )
+        elif len(output_paths) == 1:
+            # FIXME: After sending the file, the album art can't be read back
+            thumbnail_path = generate_thumbnail(inputs['art_path'])
+            beginning_sec, ending_sec = get_cutting_ranges(inputs)[0]
+
+            bot.send_audio(
+                audio=track_upload(open_for_upload(output_paths[0]), progress.uploading),
+                thumb=open_for_upload(thumbnail_path) if thumbnail_path else None,
+                chat_id=job['chat_id'],
+                duration=ending_sec - beginning_sec,
+                caption=generate_clip_caption(beginning_sec, ending_sec),
+                reply_markup=start_over_button_keyboard,
+                reply_to_message_id=inputs['reply_to_message_id']
+            )
+        else:
+            thumbnail_path = generate_thumbnail(inputs['art_path'])
+            # Every clip refers to the same attached thumbnail, so it is uploaded once for the whole group
+            thumbnail = open_for_upload(thumbnail_path) if thumbnail_path else None
+            uploads = track_uploads([open_for_upload(output_path) for output_path in output_paths],
+                                    progress.uploading)
+
+            bot.send_media_group(
+                chat_id=job['chat_id'],
+                media=[
+                    InputMediaAudio(
+                        media=upload,
+                        thumb=thumbnail,
+                        duration=ending_sec - beginning_sec,
+                        caption=generate_clip_caption(beginning_sec, ending_sec),
+                        parse_mode='Markdown',
+                    )
+                    for upload, (beginning_sec, ending_sec) in zip(uploads, get_cutting_ranges(inputs))
+                ],
+                reply_to_message_id=inputs['reply_to_message_id']
+            )
+
+            bot.send_message(job['chat_id'], translate_key_to('DONE', lang), reply_markup=start_over_button_keyboard)
+    except (TelegramError, BaseException) as e:
+        bot.send_message(
+            job['chat_id'],
+            translate_key_to('ERR_ON_UPLOADING', lang),
+            reply_markup=start_over_button_keyboard
+        )
+        logger.exception(f"Telegram error: {e}")
+        sent = False
+
+    return sent
+
+
+def generate_clip_caption(beginning_sec: int, ending_sec: int) -> str:
+    return f"*From*: {convert_seconds_to_human_readable_form(beginning_sec)}\n" \
+           f"*To*: {convert_seconds_to_human_readable_form(ending_sec)}\n\n" \
+           f"{BOT_USERNAME}"
+
+
+def maintain_job_journal(context) -> None:
+    """A job queue callback which writes the heartbeat of this instance to the journal, deletes the jobs which
+    ended long ago and resumes the jobs of the instances which have stopped.
+    """
+    journal = get_job_journal()
+    journal.heartbeat()
+
+    pruned = journal.prune()
+
+    if pruned:
+        logger.info(f"Deleted {pruned} old jobs from the journal.")
+
+    context.dispatcher.run_async(resume_orphaned_jobs, context.bot)
+
+
+def resume_orphaned_jobs(bot: Bot) -> None:
+    """Claim the jobs which were interrupted by a restart and run them to the end.
+
+    **Keyword arguments:**
+     - bot (Bot) -- The bot to download and send the files with
+    """
+    for job in get_job_journal().claim_orphaned_jobs():
+        logger.info(f"Resuming job {job['id']} of user {job['user_id']} from stage '{job['stage']}'.")
+
+        try:
+            run_job(bot, job, resumed=True)
+        except (TelegramError, BaseException):
+            logger.error(f"Error on resuming job {job['id']}.", exc_info=True)
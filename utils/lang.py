@@ -124,10 +124,30 @@ keys = {
         "en": f"Sorry, I couldn't update tags the tags of the file... {REPORT_BUG_MESSAGE_EN}",
         "fa": f"متاسفم، نتونستم تگ های فایل رو آپدیت کنم... {REPORT_BUG_MESSAGE_FA}",
     },
+    "ERR_ON_ENCODING": {
+        "en": f"Sorry, I couldn't process your file... {REPORT_BUG_MESSAGE_EN}",
+        "fa": f"متاسفم، نتونستم فایلت رو پردازش کنم... {REPORT_BUG_MESSAGE_FA}",
+    },
     "ERR_ON_UPLOADING": {
         "en": "Sorry, due to network issues, I couldn't upload your file. Please try again.",
         "fa": "متاسفم. به دلیل اشکالات شبکه نتونستم فایل رو آپلود کنم. لطفا دوباره امتحان کن.",
     },
+    "ERR_BUSY": {
+        "en": "I'm too busy right now 😵 Please try again in ~{} s.",
+        "fa": "الان سرم خیلی شلوغه 😵 لطفا حدود {} ثانیه دیگه دوباره امتحان کن.",
+    },
+    "WAVEFORM_CAPTION": {
+        "en": "🎚 The music is {} long. Use the timeline to pick the part to cut out.",
+        "fa": "🎚 طول آهنگ {} هست. از روی خط زمان قسمتی که میخوای ببری رو انتخاب کن.",
+    },
+    "FINGERPRINT_MATCH": {
+        "en": "🔁 I've seen this music before, so I filled in the tags it was missing from last time.",
+        "fa": "🔁 این آهنگ رو قبلا دیدم، برای همین تگ هایی که نداشت رو از دفعه قبل پر کردم.",
+    },
+    "ERR_RATE_LIMITED": {
+        "en": "Slow down a little 🐢 Please try again in ~{} s.",
+        "fa": "یکم آروم تر 🐢 لطفا حدود {} ثانیه دیگه دوباره امتحان کن.",
+    },
     "ERR_NOT_IMPLEMENTED": {
         "en": "This feature has not been implemented yet. Sorry!",
         "fa": "این قابلیت هنوز پیاده سازی نشده. شرمنده!",
@@ -144,6 +164,10 @@ keys = {
         "en": "The ending point should be greater than starting point",
         "fa": "زمان پایان باید از زمان شروع بزرگتر باشد.",
     },
+    "ERR_TOO_MANY_RANGES": {
+        "en": "You can cut at most {} parts at once.",
+        "fa": "هر بار حداکثر {} قسمت رو میتونی ببری.",
+    },
     "BTN_TAG_EDITOR": {
         "en": "🎵 Tag Editor",
         "fa": "🎵 تغییر تگ ها",
@@ -208,7 +232,8 @@ keys = {
               "- m = minute, s = second\n"
               "- Leading zeroes are optional\n"
               "- Extra spaces are ignored\n"
-              "- Only English numbers",
+              "- Only English numbers\n"
+              f"- Separate several parts with commas to get them all:\n{EG_EN} 00:10-00:40, 01:30-02:00",
         "fa": "\n\nحالا بهم بگو کجای موزیک رو میخوای ببری؟\n\n"
               "الگو های مجاز:\n"
               f"*mm:ss-mm:ss*:\n{EG_FA} 00:10-02:30\n"
@@ -216,7 +241,38 @@ keys = {
               "- دقیقه: m، ثانیه s\n"
               "- صفرهای ابتدایی دل بخواه هستن\n"
               "- فاصله های اضافی در نظر گرفته نمیشن\n"
-              "- تنها اعداد انگلیسی",
+              "- تنها اعداد انگلیسی\n"
+              f"- برای بریدن چند قسمت، اونا رو با کاما جدا کن:\n{EG_FA} 00:10-00:40, 01:30-02:00",
+    },
+    "BATCH_STARTED": {
+        "en": "Batch mode is on. Send me the tracks of the album in order. Then set the shared tags and click /done "
+              "to get all of them back. Click /new to cancel.",
+        "fa": "حالت دسته ای فعال شد. ترک های آلبوم رو به ترتیب برام بفرست. بعد تگ های مشترک رو تنظیم کن و روی /done "
+              "کلیک کن تا همه رو تحویل بگیری. برای لغو از /new استفاده کن.",
+    },
+    "BATCH_TRACK_ADDED": {
+        "en": "Track {} added.",
+        "fa": "ترک {} اضافه شد.",
+    },
+    "ERR_BATCH_EMPTY": {
+        "en": "You haven't sent any tracks yet.",
+        "fa": "هنوز هیچ ترکی نفرستادی.",
+    },
+    "ERR_BATCH_FULL": {
+        "en": "You can send at most {} tracks in one batch.",
+        "fa": "در هر دسته حداکثر {} ترک میتونی بفرستی.",
+    },
+    "JOB_RESUMED": {
+        "en": "Sorry for the delay! I was restarted while I was working on your file. Here it is:",
+        "fa": "ببخشید که طول کشید! وقتی داشتم روی فایلت کار میکردم ری استارت شدم. بفرما:",
+    },
+    "PROGRESS_ENCODING": {
+        "en": "⏳ Working on your file... {}%",
+        "fa": "⏳ دارم روی فایلت کار میکنم... {}%",
+    },
+    "PROGRESS_UPLOADING": {
+        "en": "⏫ Sending your file... {}%",
+        "fa": "⏫ دارم فایلت رو میفرستم... {}%",
     },
     "DONE": {
         "en": "Done!",
@@ -0,0 +1,715 @@
+import json
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import wave
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.tracing import tracer
+
+# Segmented encoding is off unless this is set
+SEGMENTED_ENCODING_MIN_SECONDS = int(os.getenv("SEGMENTED_ENCODING_MIN_SECONDS")) \
+    if os.getenv("SEGMENTED_ENCODING_MIN_SECONDS") else 0
+SEGMENTED_ENCODING_WORKERS = int(os.getenv("SEGMENTED_ENCODING_WORKERS")) \
+    if os.getenv("SEGMENTED_ENCODING_WORKERS") else os.cpu_count()
+# The music is decoded to a WAV file before it is encoded in segments; music whose WAV would be larger is encoded
+# in one piece
+SEGMENTED_ENCODING_MAX_PCM_BYTES = int(os.getenv("SEGMENTED_ENCODING_MAX_PCM_BYTES")) \
+    if os.getenv("SEGMENTED_ENCODING_MAX_PCM_BYTES") else 512 * 1024 * 1024
+
+VOICE_ENCODER_ARGS = ['-c:a', 'libvorbis', '-q:a', '4']
+CUT_ENCODER_ARGS = ['-c:a', 'libmp3lame', '-q:a', '2']
+
+# How a job turns its input into its output: by copying the audio stream into a file of the same container, by
+# copying it into another container, or by encoding it again
+MEDIA_PATH_COPY = 'copy'
+MEDIA_PATH_REMUX = 'remux'
+MEDIA_PATH_TRANSCODE = 'transcode'
+
+# The extension of the file each codec is written to when its stream is copied
+CODEC_EXTENSIONS = {
+    'mp3': 'mp3',
+    'aac': 'm4a',
+    'alac': 'm4a',
+    'flac': 'flac',
+    'vorbis': 'ogg',
+    'opus': 'ogg',
+}
+# The names ffprobe gives the container of a file with each extension
+EXTENSION_FORMATS = {
+    'mp3': {'mp3'},
+    'm4a': {'mov', 'mp4', 'm4a', 'ipod'},
+    'flac': {'flac'},
+    'ogg': {'ogg'},
+}
+
+# Segments are encoded at a fixed sample rate from multiples of the long block of Vorbis
+SEGMENT_SAMPLE_RATE = 48000
+SEGMENT_FRAME_SAMPLES = 2048
+# Each segment is encoded with this many frames of its neighbours' audio around it, so that around a boundary both
+# encoders have settled on the same signal and the segments can be joined anywhere within half of it
+SEGMENT_OVERLAP_FRAMES = 24
+# How many bytes of packets the joined voice puts in each Ogg page
+OGG_PAGE_BYTES = 4096
+# Every byte with its bits reversed, to compute the CRC of Ogg, which isn't reflected, with the one of zlib, which is
+REVERSED_BITS = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+
+
+def probe_audio(input_path: str) -> dict:
+    """Find out the container of a music and the codec of its audio stream.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+
+    **Returns:**
+     A `dict` with the names of the `formats` ffprobe matched the container with and the `codec`, or `None` if
+     ffprobe failed
+    """
+    try:
+        process = subprocess.run(
+            ['ffprobe', '-loglevel', 'error', '-select_streams', 'a:0', '-show_entries',
+             'format=format_name:stream=codec_name', '-of', 'json', input_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+
+    if process.returncode != 0:
+        return None
+
+    try:
+        probe = json.loads(process.stdout)
+        streams = probe.get('streams') or [{}]
+
+        return {
+            'formats': probe['format']['format_name'].split(','),
+            'codec': streams[0].get('codec_name', ''),
+        }
+    except (ValueError, KeyError, AttributeError):
+        return None
+
+
+def choose_media_path(probe: dict, extension: str) -> str:
+    """Choose the cheapest way to write the audio of a probed music to a file with an extension.
+
+    **Keyword arguments:**
+     - probe (dict) -- What `probe_audio` found out about the music
+     - extension (str) -- The extension of the output, without the dot
+
+    **Returns:**
+     `MEDIA_PATH_COPY` if the codec fits the output and the container is the same, `MEDIA_PATH_REMUX` if only the
+     container differs and `MEDIA_PATH_TRANSCODE` otherwise
+    """
+    if not probe or CODEC_EXTENSIONS.get(probe['codec']) != extension:
+        return MEDIA_PATH_TRANSCODE
+
+    if EXTENSION_FORMATS[extension].intersection(probe['formats']):
+        return MEDIA_PATH_COPY
+
+    return MEDIA_PATH_REMUX
+
+
+def choose_cut_extension(probe: dict) -> str:
+    """Choose the extension of a part cut out of a probed music: the one its codec can be copied into, or `mp3`
+    which anything else is transcoded to.
+
+    **Keyword arguments:**
+     - probe (dict) -- What `probe_audio` found out about the music
+
+    **Returns:**
+     The extension, without the dot
+    """
+    return CODEC_EXTENSIONS.get(probe['codec'], 'mp3') if probe else 'mp3'
+
+
+@tracer.traced('ffmpeg')
+def convert_to_voice(input_path: str, voice_path: str, duration: int = 0, segments: int = 0,
+                     media_path: str = MEDIA_PATH_TRANSCODE, on_progress=None) -> bool:
+    """Convert a music to an OGG file which can be sent as a voice message. If `SEGMENTED_ENCODING_MIN_SECONDS` is
+    set, music at least that long is split into segments which are encoded in parallel.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+     - voice_path (str) -- The path to write the voice to
+     - duration (int) -- The duration of the music in seconds, 0 if it is not known
+     - segments (int) -- The number of segments to encode in parallel, 0 to decide from the duration, 1 for none
+     - media_path (str) -- What `choose_media_path` chose for the music and `ogg`
+     - on_progress (callable) -- Called with the fraction of the music converted so far, if `duration` is known
+
+    **Returns:**
+     `True` if ffmpeg succeeded
+    """
+    if media_path != MEDIA_PATH_TRANSCODE:
+        # Vorbis and Opus need no encoding, they are only taken out of their container if it isn't OGG already
+        return run_ffmpeg(['-i', input_path, '-map', '0:a:0', '-c:a', 'copy', voice_path], duration, on_progress)
+
+    if not segments:
+        segments = count_encoding_processes(duration)
+
+    if segments > 1 and encode_in_segments(input_path, voice_path, segments, on_progress):
+        return True
+
+    # Music which couldn't be split where its segments can be joined is encoded in one piece after all
+    return run_ffmpeg(['-i', input_path, *VOICE_ENCODER_ARGS, voice_path], duration, on_progress)
+
+
+def count_encoding_processes(duration: int) -> int:
+    """Count the ffmpeg processes `convert_to_voice` encodes a music with when it decides from the duration.
+
+    **Keyword arguments:**
+     - duration (int) -- The duration of the music in seconds, 0 if it is not known
+
+    **Returns:**
+     `SEGMENTED_ENCODING_WORKERS` if the music is encoded in segments, 1 otherwise
+    """
+    if SEGMENTED_ENCODING_MIN_SECONDS and (duration or 0) >= SEGMENTED_ENCODING_MIN_SECONDS \
+            and duration * SEGMENT_SAMPLE_RATE * 2 * 2 <= SEGMENTED_ENCODING_MAX_PCM_BYTES:
+        return max(SEGMENTED_ENCODING_WORKERS, 1)
+
+    return 1
+
+
+def plan_segments(duration: float, segments: int) -> [(float, float)]:
+    """Split a duration into about equally long segments which begin and end on multiples of
+    `SEGMENT_FRAME_SAMPLES`.
+
+    **Keyword arguments:**
+     - duration (float) -- The duration in seconds
+     - segments (int) -- The number of segments
+
+    **Returns:**
+     The beginning and the end of each segment in seconds
+    """
+    frame_seconds = SEGMENT_FRAME_SAMPLES / SEGMENT_SAMPLE_RATE
+    total_frames = max(1, round(duration / frame_seconds))
+    segments = max(1, min(segments, total_frames))
+
+    boundaries = [round(total_frames * index / segments) * frame_seconds for index in range(segments)]
+    # The last segment runs to the end, whatever is left after the last whole frame
+    boundaries.append(max(duration, boundaries[-1]))
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def encode_in_segments(input_path: str, output_path: str, segments: int, on_progress=None) -> bool:
+    """Encode a music to Vorbis in segments, one ffmpeg process per segment, and join the encoded segments without
+    re-encoding them.
+
+    The music is decoded to PCM once, so that every segment is encoded from exactly the samples it is planned to,
+    which seeking in the music can't promise. Each segment is encoded from `SEGMENT_OVERLAP_FRAMES` before its
+    beginning to as many after its end, with one packet per page, so that the granule position of every packet is
+    known. Two segments are joined on a packet boundary which both have at the same sample, between long blocks only:
+    the first block taken from the later segment then overlaps a block of the same size and window as the one it was
+    encoded after, and the joined voice has as many samples as the music. Short blocks move where the long blocks of
+    an encoder fall, so two segments may have none at the same samples around their boundary; the later one is then
+    encoded again, starting as many samples later as its long blocks fall before the ones of the earlier segment.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+     - output_path (str) -- The path to write the voice to
+     - segments (int) -- The number of segments, which are all encoded at the same time
+     - on_progress (callable) -- Called with the fraction of the music encoded so far, over all the segments
+
+    **Returns:**
+     `True` if the segments were encoded and joined, `False` if ffmpeg failed or two segments had no packet boundary
+     in common to be joined on
+    """
+    segments_dir = f"{output_path}.segments"
+    pcm_path = f"{segments_dir}/music.wav"
+    overlap_samples = SEGMENT_OVERLAP_FRAMES * SEGMENT_FRAME_SAMPLES
+
+    os.makedirs(segments_dir, exist_ok=True)
+
+    try:
+        # ffmpeg stops writing at the limit, music which reaches it is encoded in one piece
+        if not run_ffmpeg(['-i', input_path, '-vn', '-ar', str(SEGMENT_SAMPLE_RATE), '-af',
+                           'aformat=channel_layouts=mono|stereo', '-c:a', 'pcm_s16le', '-fs',
+                           str(SEGMENTED_ENCODING_MAX_PCM_BYTES), pcm_path]) \
+                or os.path.getsize(pcm_path) >= SEGMENTED_ENCODING_MAX_PCM_BYTES:
+            return False
+
+        with wave.open(pcm_path, 'rb') as pcm:
+            total_samples = pcm.getnframes()
+
+        beginnings = [round(beginning * SEGMENT_SAMPLE_RATE)
+                      for beginning, _ in plan_segments(total_samples / SEGMENT_SAMPLE_RATE, segments)]
+        boundaries = list(zip(beginnings, beginnings[1:] + [total_samples]))
+        encoded_ranges = [(max(0, beginning - overlap_samples), min(total_samples, ending + overlap_samples))
+                          for beginning, ending in boundaries]
+
+        progress_lock = threading.Lock()
+        encoded_samples = [0] * len(boundaries)
+
+        def on_segment_progress(index: int, samples: int) -> None:
+            with progress_lock:
+                encoded_samples[index] = samples
+                on_progress(sum(encoded_samples) / sum(ending - beginning for beginning, ending in encoded_ranges))
+
+        def encode_segment(index: int) -> bool:
+            return encode_pcm(
+                pcm_path, *encoded_ranges[index], f"{segments_dir}/{index}.ogg",
+                (lambda samples: on_segment_progress(index, samples)) if on_progress else None,
+            )
+
+        with ThreadPoolExecutor(max_workers=len(boundaries)) as executor:
+            encoded = list(executor.map(encode_segment, range(len(boundaries))))
+
+        if not all(encoded):
+            return False
+
+        encoded_segments = [read_vorbis_segment(f"{segments_dir}/{index}.ogg", encode_from)
+                            for index, (encode_from, _) in enumerate(encoded_ranges)]
+        long_samples = count_long_block_samples(encoded_segments[0][1][0])
+
+        for index, beginning in enumerate(beginnings[1:], 1):
+            shift = find_grid_shift(encoded_segments[index - 1][2], encoded_segments[index][2], long_samples,
+                                    beginning, overlap_samples // 2)
+
+            if shift:
+                encoded_ranges[index] = (encoded_ranges[index][0] + shift, encoded_ranges[index][1])
+
+                if not encode_pcm(pcm_path, *encoded_ranges[index], f"{segments_dir}/{index}.ogg"):
+                    return False
+
+                encoded_segments[index] = read_vorbis_segment(f"{segments_dir}/{index}.ogg",
+                                                              encoded_ranges[index][0])
+
+        return join_vorbis_segments(encoded_segments, beginnings[1:], overlap_samples // 2, output_path)
+    except (OSError, EOFError, ValueError, wave.Error):
+        return False
+    finally:
+        shutil.rmtree(segments_dir, ignore_errors=True)
+
+
+def encode_pcm(pcm_path: str, encode_from: int, encode_to: int, output_path: str, on_progress=None) -> bool:
+    """Encode a range of the samples of a WAV file to Vorbis, with one packet per Ogg page.
+
+    **Keyword arguments:**
+     - pcm_path (str) -- The path of the WAV file, of 16 bit samples at `SEGMENT_SAMPLE_RATE`
+     - encode_from (int) -- The first sample to encode
+     - encode_to (int) -- The sample to stop encoding at
+     - output_path (str) -- The path to write the encoded range to
+     - on_progress (callable) -- Called with the number of samples encoded so far
+
+    **Returns:**
+     `True` if ffmpeg succeeded
+    """
+    with wave.open(pcm_path, 'rb') as pcm:
+        pcm.setpos(encode_from)
+
+        with subprocess.Popen(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-f', 's16le', '-ar', str(SEGMENT_SAMPLE_RATE), '-ac',
+                 str(pcm.getnchannels()), '-i', 'pipe:0', '-threads', '1', *VOICE_ENCODER_ARGS, '-page_duration', '1',
+                 output_path],
+                stdin=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+        ) as process:
+            try:
+                for position in range(encode_from, encode_to, SEGMENT_SAMPLE_RATE):
+                    process.stdin.write(pcm.readframes(min(SEGMENT_SAMPLE_RATE, encode_to - position)))
+
+                    if on_progress:
+                        on_progress(min(position + SEGMENT_SAMPLE_RATE, encode_to) - encode_from)
+            except BrokenPipeError:
+                # ffmpeg has stopped, its exit code says why
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+    return process.returncode == 0
+
+
+def join_vorbis_segments(segments: [(int, [bytes], [(bytes, int)])], beginnings: [int], max_shift: int,
+                         output_path: str) -> bool:
+    """Join Vorbis segments which were encoded with `encode_pcm` into one Ogg file.
+
+    **Keyword arguments:**
+     - segments (list) -- The segments, in order, as `read_vorbis_segment` returns them
+     - beginnings (list) -- The sample of the music each segment but the first is planned to begin on
+     - max_shift (int) -- How many samples away from where it was planned a boundary may move
+     - output_path (str) -- The path to write the joined voice to
+
+    **Returns:**
+     `True` if every two segments had a boundary to be joined on
+    """
+    serial, headers, packets = segments[0]
+    long_samples = count_long_block_samples(headers[0])
+
+    for (_, segment_headers, segment_packets), beginning in zip(segments[1:], beginnings):
+        if (segment_headers[0], segment_headers[2]) != (headers[0], headers[2]):
+            return False
+
+        joints = find_long_joints(packets, long_samples, len(packets) - 1)
+        segment_joints = find_long_joints(segment_packets, long_samples, len(segment_packets))
+        common = [sample for sample in joints if sample in segment_joints and abs(sample - beginning) <= max_shift]
+
+        if not common:
+            return False
+
+        joint = min(common, key=lambda sample: abs(sample - beginning))
+        packets = packets[:joints[joint] + 1] + segment_packets[segment_joints[joint] + 1:]
+
+    with open(output_path, 'wb') as output:
+        writer = OggWriter(output, serial)
+
+        writer.write_packet(headers[0], 0, flush=True)
+        writer.write_packet(headers[1], 0)
+        writer.write_packet(headers[2], 0, flush=True)
+
+        for index, (packet, granule) in enumerate(packets):
+            writer.write_packet(packet, granule, last=index == len(packets) - 1)
+
+    return True
+
+
+def count_long_block_samples(identification_header: bytes) -> int:
+    """Count the samples a long block of a Vorbis stream gives when its neighbours are long blocks as well: half of
+    its size, which the identification header gives the logarithm of.
+    """
+    return 2 ** (identification_header[28] >> 4) // 2
+
+
+def find_grid_shift(packets: [(bytes, int)], segment_packets: [(bytes, int)], long_samples: int, beginning: int,
+                    max_shift: int) -> int:
+    """Find how many samples later a segment should be encoded from for its long blocks to fall on the ones of the
+    segment before it around their boundary.
+
+    **Keyword arguments:**
+     - packets (list) -- The audio packets of the earlier segment and the sample each ends on
+     - segment_packets (list) -- The audio packets of the later segment and the sample each ends on
+     - long_samples (int) -- How many samples a long block after a long block gives
+     - beginning (int) -- The sample the later segment is planned to begin on
+     - max_shift (int) -- How many samples away from where it was planned a boundary may move
+
+    **Returns:**
+     The number of samples, 0 if the segments already have a long block boundary in common or if either has none to
+     be joined on
+    """
+    joints = [sample for sample in find_long_joints(packets, long_samples, len(packets) - 1)
+              if abs(sample - beginning) <= max_shift]
+    segment_joints = [sample for sample in find_long_joints(segment_packets, long_samples, len(segment_packets))
+                      if abs(sample - beginning) <= max_shift]
+
+    if not joints or not segment_joints or set(joints) & set(segment_joints):
+        return 0
+
+    def nearest(samples: [int]) -> int:
+        return min(samples, key=lambda sample: abs(sample - beginning))
+
+    return (nearest(joints) - nearest(segment_joints)) % long_samples
+
+
+def read_vorbis_segment(path: str, encode_from: int) -> (int, [bytes], [(bytes, int)]):
+    """Read a segment encoded with `encode_pcm`.
+
+    **Keyword arguments:**
+     - path (str) -- The path of the segment
+     - encode_from (int) -- The sample of the music the segment was encoded from
+
+    **Returns:**
+     The serial number of its stream, its three header packets and its audio packets with the sample of the music
+     each ends on
+    """
+    serial, packets = read_ogg_packets(path)
+    headers, audio_packets = [packet for packet, _ in packets[:3]], packets[3:]
+
+    if len(headers) < 3 or any(granule < 0 for _, granule in audio_packets):
+        raise ValueError(f"{path} doesn't have one packet per page")
+
+    return serial, headers, [(packet, encode_from + granule) for packet, granule in audio_packets]
+
+
+def find_long_joints(packets: [(bytes, int)], long_samples: int, end: int) -> {int: int}:
+    """Find where a stream of Vorbis packets can be cut and continued by another one: after a long block which
+    follows a long block and is followed by one.
+
+    **Keyword arguments:**
+     - packets (list) -- The audio packets and the sample each ends on
+     - long_samples (int) -- How many samples a long block after a long block gives
+     - end (int) -- Look only at the packets before this one
+
+    **Returns:**
+     The index of the packet to cut after, by the sample it ends on
+    """
+    samples = [ending - previous_ending for (_, previous_ending), (_, ending) in zip(packets, packets[1:])]
+
+    return {
+        packets[index + 1][1]: index + 1
+        for index in range(min(end, len(packets)) - 2)
+        if samples[index] == samples[index + 1] == long_samples
+    }
+
+
+def read_ogg_packets(path: str) -> (int, [(bytes, int)]):
+    """Read the packets of an Ogg file with a single logical stream, raising `ValueError` if a page doesn't match its
+    CRC.
+
+    **Keyword arguments:**
+     - path (str) -- The path of the file
+
+    **Returns:**
+     The serial number of the stream and its packets, each with the granule position of the page it ends on if it
+     is the last packet to end there, -1 otherwise
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    serial, packets, packet, position = 0, [], b'', 0
+
+    while position < len(data):
+        if data[position:position + 4] != b'OggS':
+            raise ValueError(f"{path} isn't an Ogg file")
+
+        granule, serial, _, crc = struct.unpack_from('<qIII', data, position + 6)
+        lacing = data[position + 27:position + 27 + data[position + 26]]
+        page_end = position + 27 + len(lacing) + sum(lacing)
+
+        if ogg_crc(data[position:position + 22] + bytes(4) + data[position + 26:page_end]) != crc:
+            raise ValueError(f"{path} has a corrupt page")
+
+        position += 27 + len(lacing)
+        ended = []
+
+        for size in lacing:
+            packet += data[position:position + size]
+            position += size
+
+            if size < 255:
+                ended.append(packet)
+                packet = b''
+
+        packets += [(ended_packet, -1) for ended_packet in ended[:-1]] + [(ended_packet, granule)
+                                                                           for ended_packet in ended[-1:]]
+
+    return serial, packets
+
+
+class OggWriter:
+    """Writes the packets of a single logical stream to an Ogg file, packing them into pages of about
+    `OGG_PAGE_BYTES`.
+    """
+
+    def __init__(self, file, serial: int):
+        """**Keyword arguments:**
+         - file (file) -- The binary file to write to
+         - serial (int) -- The serial number of the stream
+        """
+        self.file = file
+        self.serial = serial
+        self.sequence = 0
+        self.lacing = []
+        self.body = []
+        self.granule = -1
+        self.continued = False
+
+    def write_packet(self, packet: bytes, granule: int, flush: bool = False, last: bool = False) -> None:
+        """**Keyword arguments:**
+         - packet (bytes) -- The packet
+         - granule (int) -- The granule position at the end of the packet
+         - flush (bool) -- Whether to end the page after the packet, so that the next one starts a page
+         - last (bool) -- Whether it is the last packet of the stream
+        """
+        sizes = [255] * (len(packet) // 255) + [len(packet) % 255]
+        offset = 0
+
+        for index, size in enumerate(sizes):
+            if len(self.lacing) == 255:
+                self._write_page(continues=index > 0)
+
+            self.lacing.append(size)
+            self.body.append(packet[offset:offset + size])
+            offset += size
+
+        self.granule = granule
+
+        if flush or last or sum(self.lacing) >= OGG_PAGE_BYTES:
+            self._write_page(last=last)
+
+    def _write_page(self, continues: bool = False, last: bool = False) -> None:
+        header_type = (0x01 if self.continued else 0) | (0x02 if not self.sequence else 0) | (0x04 if last else 0)
+        page = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, self.granule, self.serial, self.sequence, 0,
+                           len(self.lacing)) + bytes(self.lacing) + b''.join(self.body)
+
+        self.file.write(page[:22] + struct.pack('<I', ogg_crc(page)) + page[26:])
+
+        self.sequence += 1
+        self.lacing, self.body, self.granule, self.continued = [], [], -1, continues
+
+
+def ogg_crc(data: bytes) -> int:
+    """Compute the CRC of an Ogg page, whose CRC field is zero: CRC-32 with the polynomial 0x04C11DB7, not
+    reflected, with no initial value nor final XOR.
+    """
+    # zlib reflects the bits and starts from and XORs with 0xFFFFFFFF; the CRC of as many zero bytes takes both
+    # of these away, as CRCs are linear
+    reflected = zlib.crc32(data.translate(REVERSED_BITS)) ^ zlib.crc32(bytes(len(data)))
+
+    return int(f"{reflected:032b}"[::-1], 2)
+
+
+def cut_music(input_path: str, output_path: str, beginning_sec: int, ending_sec: int,
+              media_path: str = MEDIA_PATH_COPY, on_progress=None) -> bool:
+    """Cut a part of a music out, without re-encoding it unless `media_path` says so.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+     - output_path (str) -- The path to write the cut part to
+     - beginning_sec (int) -- Where the part begins, in seconds
+     - ending_sec (int) -- Where the part ends, in seconds
+     - media_path (str) -- What `choose_media_path` chose for the music and the extension of `output_path`
+     - on_progress (callable) -- Called with the fraction of the part cut out so far
+
+    **Returns:**
+     `True` if ffmpeg succeeded
+    """
+    return cut_music_clips(input_path, [(output_path, beginning_sec, ending_sec)], media_path, on_progress)
+
+
+@tracer.traced('ffmpeg')
+def cut_music_clips(input_path: str, clips: [(str, int, int)], media_path: str = MEDIA_PATH_COPY,
+                    on_progress=None) -> bool:
+    """Cut several parts of a music out with one ffmpeg, which reads the music once and writes every part as it
+    goes by. The music is read from the beginning of the first part on.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+     - clips (list) -- The path to write each part to, and where the part begins and ends, in seconds
+     - media_path (str) -- What `choose_media_path` chose for the music and the extension of the outputs
+     - on_progress (callable) -- Called with the fraction of the longest part cut out so far
+
+    **Returns:**
+     `True` if ffmpeg succeeded
+    """
+    seek_sec = min(beginning_sec for _, beginning_sec, _ in clips)
+    codec_args = CUT_ENCODER_ARGS if media_path == MEDIA_PATH_TRANSCODE else ['-c:a', 'copy']
+    output_args = []
+
+    # Only the audio is cut; the album art is put back with the tags
+    for output_path, beginning_sec, ending_sec in clips:
+        output_args += ['-map', '0:a:0', '-ss', str(beginning_sec - seek_sec), '-t', str(ending_sec - beginning_sec),
+                        *codec_args, output_path]
+
+    # ffmpeg reports the time of the output which is furthest along, so this is only a rough progress
+    longest_sec = max(ending_sec - beginning_sec for _, beginning_sec, ending_sec in clips)
+
+    return run_ffmpeg(['-ss', str(seek_sec), '-i', input_path, *output_args], longest_sec, on_progress)
+
+
+def run_ffmpeg(args: [str], duration: float = 0, on_progress=None) -> bool:
+    """Run ffmpeg, overwriting its output.
+
+    **Keyword arguments:**
+     - args (list) -- The arguments of ffmpeg
+     - duration (float) -- The duration of the output in seconds, 0 if it is not known
+     - on_progress (callable) -- Called with the fraction of the output written so far, as ffmpeg reports it
+
+    **Returns:**
+     `True` if ffmpeg succeeded
+    """
+    try:
+        if not on_progress or not duration:
+            return subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error', *args],
+                stderr=subprocess.DEVNULL,
+            ).returncode == 0
+
+        with subprocess.Popen(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', *args],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+        ) as process:
+            read_progress(process.stdout, duration, on_progress)
+
+        return process.returncode == 0
+    except OSError:
+        return False
+
+
+def read_progress(lines, duration: float, on_progress) -> None:
+    """Follow the output of `ffmpeg -progress`, which is a block of `key=value` lines every half a second or so.
+
+    **Keyword arguments:**
+     - lines (iterable) -- The lines ffmpeg writes
+     - duration (float) -- The duration of the output in seconds
+     - on_progress (callable) -- Called with the fraction of the output written so far
+    """
+    for line in lines:
+        key, _, value = line.strip().partition('=')
+
+        # `out_time_ms` is in microseconds as well, and is all older versions of ffmpeg write
+        if key in ('out_time_us', 'out_time_ms') and value.isdigit():
+            on_progress(min(1.0, int(value) / 1000000 / duration))
+        elif key == 'progress' and value == 'end':
+            on_progress(1.0)
+
+
+def decode_pcm(input_path: str, sample_rate: int = 8000, max_seconds: int = None):
+    """Decode a music to downsampled mono PCM, which is all the analyses of the audio need.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+     - sample_rate (int) -- The sample rate to decode at
+     - max_seconds (int) -- Decode only this many seconds from the beginning, `None` to decode everything
+
+    **Returns:**
+     The samples as a `numpy.ndarray` of `int16`, or `None` if ffmpeg failed
+    """
+    import numpy
+
+    duration_args = ['-t', str(max_seconds)] if max_seconds else []
+
+    try:
+        process = subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-i', input_path, *duration_args, '-ac', '1', '-ar', str(sample_rate),
+             '-f', 's16le', '-'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+
+    if process.returncode != 0:
+        return None
+
+    return numpy.frombuffer(process.stdout, dtype='<i2')
+
+
+def stream_pcm(input_path: str, sample_rate: int, chunk_samples: int):
+    """Decode a music to downsampled mono PCM like `decode_pcm`, but hand the samples over in chunks as ffmpeg
+    writes them, so that a long music is never in memory as a whole.
+
+    **Keyword arguments:**
+     - input_path (str) -- The path of the music
+     - sample_rate (int) -- The sample rate to decode at
+     - chunk_samples (int) -- The number of samples in a chunk; only the last one may be shorter
+
+    **Returns:**
+     A generator of the chunks as `numpy.ndarray`s of `int16`, which raises `OSError` once it is exhausted if ffmpeg
+     failed
+    """
+    import numpy
+
+    with subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-i', input_path, '-ac', '1', '-ar', str(sample_rate), '-f', 's16le',
+             '-'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+    ) as process:
+        while True:
+            data = process.stdout.read(chunk_samples * 2)
+
+            if not data:
+                break
+
+            yield numpy.frombuffer(data[:len(data) // 2 * 2], dtype='<i2')
+
+    if process.returncode != 0:
+        raise OSError(f"ffmpeg couldn't decode {input_path}")
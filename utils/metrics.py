@@ -0,0 +1,109 @@
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics:
+    """A tiny in-process registry of counters, gauges and summaries which can be rendered in the Prometheus text
+    format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._summaries = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """Add `value` to a counter.
+
+        **Keyword arguments:**
+         - name (str) -- The name of the counter
+         - value (float) -- The value to add
+         - labels -- The labels of the counter
+        """
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Set the current value of a gauge.
+
+        **Keyword arguments:**
+         - name (str) -- The name of the gauge
+         - value (float) -- The current value
+         - labels -- The labels of the gauge
+        """
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record a sample of a summary, e.g. a duration. The count, the sum and the maximum of the samples are kept.
+
+        **Keyword arguments:**
+         - name (str) -- The name of the summary
+         - value (float) -- The sample
+         - labels -- The labels of the summary
+        """
+        with self._lock:
+            summary = self._summaries[(name, tuple(sorted(labels.items())))]
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format.
+
+        **Returns:**
+         `str`
+        """
+        lines = []
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for (name, labels), (count, total, maximum) in sorted(self._summaries.items()):
+                lines.append(f"{name}_count{format_labels(labels)} {count:g}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total:g}")
+                lines.append(f"{name}_max{format_labels(labels)} {maximum:g}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve the metrics over HTTP in a background thread, so that Prometheus can scrape them.
+
+    **Keyword arguments:**
+     - port (int) -- The port to listen on
+
+    **Returns:**
+     The server
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+
+    return server
+
+
+metrics = Metrics()
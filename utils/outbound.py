@@ -0,0 +1,273 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.utils.helpers import DEFAULT_NONE
+
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+OUTBOUND_GLOBAL_PER_SECOND = float(os.getenv("OUTBOUND_GLOBAL_PER_SECOND")) \
+    if os.getenv("OUTBOUND_GLOBAL_PER_SECOND") else 25.0
+OUTBOUND_CHAT_PER_SECOND = float(os.getenv("OUTBOUND_CHAT_PER_SECOND")) \
+    if os.getenv("OUTBOUND_CHAT_PER_SECOND") else 1.0
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST")) if os.getenv("OUTBOUND_CHAT_BURST") else 3
+OUTBOUND_MAX_CONCURRENT_UPLOADS = int(os.getenv("OUTBOUND_MAX_CONCURRENT_UPLOADS")) \
+    if os.getenv("OUTBOUND_MAX_CONCURRENT_UPLOADS") else 2
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES")) if os.getenv("OUTBOUND_MAX_RETRIES") else 3
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_UPLOAD = 1
+# Requests nobody waits for, like the progress of a job, which go after everything else
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_UPLOAD: 'upload', PRIORITY_BACKGROUND: 'background'}
+
+# Methods which upload a file, and so hold a connection much longer than a text reply
+UPLOAD_METHODS = {'sendAudio', 'sendVoice', 'sendPhoto', 'sendMediaGroup', 'sendDocument', 'sendVideo'}
+# Methods which are not messages, so they don't count against the limit of a chat
+UNLIMITED_CHAT_METHODS = {'sendChatAction', 'answerCallbackQuery', 'deleteMessage'}
+
+logger = logging.getLogger()
+
+_request_context = threading.local()
+
+
+class OutboundScheduler:
+    """Decides when each request to the Bot API may go out.
+
+    Requests wait in a priority queue until both the global bucket and the bucket of their chat have a token. Among
+    the requests which may go, interactive ones (text replies, chat actions) go before uploads, which go before
+    background ones, and at most `max_concurrent_uploads` uploads are in flight at once, so a few large files can't
+    hold up every reply. When
+    Telegram answers with `RetryAfter`, the chat (or everything, for requests without a chat) is paused for as long
+    as it asks.
+    """
+
+    def __init__(self, global_per_second: float, chat_per_second: float, chat_burst: int,
+                 max_concurrent_uploads: int):
+        self.global_per_second = global_per_second
+        self.chat_per_second = chat_per_second
+        self.chat_burst = chat_burst
+        self.max_concurrent_uploads = max_concurrent_uploads
+
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+
+        self._global_tokens = global_per_second
+        self._global_updated_at = time.monotonic()
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._chat_paused_until = {}
+        self._uploads_in_flight = 0
+
+    def acquire(self, chat_id, priority: int, limit_chat: bool = True, sequence: int = None) -> int:
+        """Wait until a request may go out.
+
+        **Keyword arguments:**
+         - chat_id (int|str) -- The chat the request is for, `None` if it is not for a chat
+         - priority (int) -- `PRIORITY_INTERACTIVE`, `PRIORITY_UPLOAD` or `PRIORITY_BACKGROUND`
+         - limit_chat (bool) -- Whether the request counts against the limit of its chat
+         - sequence (int) -- The place in the queue of a request which is retried, so that it keeps its turn
+
+        **Returns:**
+         The place of the request in the queue, to pass back to `acquire` when the request is retried
+        """
+        if sequence is None:
+            sequence = next(self._sequence)
+
+        entry = (priority, sequence, chat_id, limit_chat)
+        queued_at = time.monotonic()
+
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+
+            while True:
+                now = time.monotonic()
+                wait = self._next_turn(now)
+
+                if wait == 0 and self._first_eligible(now) == entry:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._take(entry, now)
+                    break
+
+                self._condition.wait(wait if wait else None)
+
+            metrics.set_gauge('outbound_queue_depth', len(self._waiting))
+            # Another request may be able to go now, e.g. one for another chat
+            self._condition.notify_all()
+
+        metrics.observe('outbound_queue_delay_seconds', time.monotonic() - queued_at,
+                        priority=PRIORITY_NAMES[priority])
+
+        return sequence
+
+    def release(self, priority: int) -> None:
+        """Mark a request which `acquire` let go out as finished.
+
+        **Keyword arguments:**
+         - priority (int) -- The priority the request was acquired with
+        """
+        with self._condition:
+            if priority == PRIORITY_UPLOAD:
+                self._uploads_in_flight -= 1
+
+            self._condition.notify_all()
+
+    def pause(self, chat_id, seconds: float) -> None:
+        """Hold back the requests of a chat, or every request if `chat_id` is `None`, because of a `RetryAfter`.
+
+        **Keyword arguments:**
+         - chat_id (int|str) -- The chat Telegram asked to wait for
+         - seconds (float) -- How long Telegram asked to wait
+        """
+        with self._condition:
+            until = time.monotonic() + seconds
+
+            if chat_id is None:
+                self._paused_until = max(self._paused_until, until)
+            else:
+                self._chat_paused_until[chat_id] = max(self._chat_paused_until.get(chat_id, 0.0), until)
+
+            self._condition.notify_all()
+
+    def _first_eligible(self, now: float):
+        for entry in sorted(self._waiting):
+            if self._wait_for(entry, now) == 0:
+                return entry
+
+        return None
+
+    def _next_turn(self, now: float):
+        """Return 0 if a waiting request may go now, otherwise how long until one might, or `None` if that depends
+        on a running upload finishing.
+        """
+        self._refill(now)
+
+        waits = [self._wait_for(entry, now) for entry in self._waiting]
+        known_waits = [wait for wait in waits if wait is not None]
+
+        return min(known_waits) if known_waits else None
+
+    def _wait_for(self, entry: tuple, now: float):
+        priority, _, chat_id, limit_chat = entry
+
+        if priority == PRIORITY_UPLOAD and self._uploads_in_flight >= self.max_concurrent_uploads:
+            return None
+
+        wait = max(0.0, self._paused_until - now, self._chat_paused_until.get(chat_id, 0.0) - now)
+
+        if self._global_tokens < 1:
+            wait = max(wait, (1 - self._global_tokens) / self.global_per_second)
+
+        if limit_chat and chat_id is not None:
+            tokens, updated_at = self._chat_buckets.get(chat_id, (self.chat_burst, now))
+            tokens = min(self.chat_burst, tokens + (now - updated_at) * self.chat_per_second)
+
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / self.chat_per_second)
+
+        return wait
+
+    def _refill(self, now: float) -> None:
+        self._global_tokens = min(
+            self.global_per_second,
+            self._global_tokens + (now - self._global_updated_at) * self.global_per_second
+        )
+        self._global_updated_at = now
+
+    def _take(self, entry: tuple, now: float) -> None:
+        priority, _, chat_id, limit_chat = entry
+
+        self._global_tokens -= 1
+
+        if limit_chat and chat_id is not None:
+            tokens, updated_at = self._chat_buckets.get(chat_id, (self.chat_burst, now))
+            tokens = min(self.chat_burst, tokens + (now - updated_at) * self.chat_per_second)
+            self._chat_buckets[chat_id] = (tokens - 1, now)
+
+            if len(self._chat_buckets) > 10000:
+                self._forget_idle_chats(now)
+
+        if priority == PRIORITY_UPLOAD:
+            self._uploads_in_flight += 1
+
+    def _forget_idle_chats(self, now: float) -> None:
+        # A chat which has refilled its bucket is the same as a new one
+        for chat_id in [chat_id for chat_id, (tokens, updated_at) in self._chat_buckets.items()
+                        if tokens + (now - updated_at) * self.chat_per_second >= self.chat_burst]:
+            del self._chat_buckets[chat_id]
+
+        for chat_id in [chat_id for chat_id, until in self._chat_paused_until.items() if until <= now]:
+            del self._chat_paused_until[chat_id]
+
+
+class ScheduledBot(Bot):
+    """A `Bot` whose sends go through an `OutboundScheduler`. Requests which Telegram answers with `RetryAfter` are
+    sent again once the wait is over, up to `OUTBOUND_MAX_RETRIES` times.
+    """
+
+    def __init__(self, *args, scheduler: OutboundScheduler = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.scheduler = scheduler or OutboundScheduler(
+            global_per_second=OUTBOUND_GLOBAL_PER_SECOND,
+            chat_per_second=OUTBOUND_CHAT_PER_SECOND,
+            chat_burst=OUTBOUND_CHAT_BURST,
+            max_concurrent_uploads=OUTBOUND_MAX_CONCURRENT_UPLOADS,
+        )
+
+    def _post(self, endpoint: str, data: dict = None, timeout=DEFAULT_NONE, api_kwargs: dict = None):
+        if not is_scheduled_method(endpoint):
+            return super()._post(endpoint, data, timeout, api_kwargs)
+
+        chat_id = (data or {}).get('chat_id')
+        if endpoint in UPLOAD_METHODS:
+            priority = PRIORITY_UPLOAD
+        else:
+            priority = getattr(_request_context, 'priority', PRIORITY_INTERACTIVE)
+        limit_chat = endpoint not in UNLIMITED_CHAT_METHODS
+        sequence = None
+
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            with tracer.span('outbound_wait', method=endpoint):
+                sequence = self.scheduler.acquire(chat_id, priority, limit_chat, sequence)
+
+            try:
+                return super()._post(endpoint, data, timeout, api_kwargs)
+            except RetryAfter as e:
+                metrics.increment('outbound_retry_after_total', method=endpoint)
+                logger.warning(f"Telegram asked to wait {e.retry_after}s before {endpoint} to chat {chat_id}.")
+
+                self.scheduler.pause(chat_id, e.retry_after)
+
+                if attempt == OUTBOUND_MAX_RETRIES:
+                    raise
+            finally:
+                self.scheduler.release(priority)
+
+
+@contextmanager
+def background_requests():
+    """Send the requests which the current thread makes in this block, other than uploads, at
+    `PRIORITY_BACKGROUND`.
+    """
+    previous = getattr(_request_context, 'priority', PRIORITY_INTERACTIVE)
+    _request_context.priority = PRIORITY_BACKGROUND
+
+    try:
+        yield
+    finally:
+        _request_context.priority = previous
+
+
+def is_scheduled_method(endpoint: str) -> bool:
+    """Check if a Bot API method sends something to a chat, i.e. if it goes through the scheduler."""
+    return endpoint.startswith(('send', 'edit', 'forward', 'copy', 'delete', 'answer'))
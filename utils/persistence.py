@@ -0,0 +1,19 @@
+from collections import defaultdict
+
+from telegram.ext import PicklePersistence
+
+from utils.session import Session
+
+
+class SessionPersistence(PicklePersistence):
+    """A `PicklePersistence` which hands the dispatcher `Session`s instead of `dict`s as `user_data`. The `dict`s
+    of a file written before sessions are converted as they are loaded.
+    """
+
+    def get_user_data(self) -> defaultdict:
+        sessions = defaultdict(Session)
+
+        for user_id, data in super().get_user_data().items():
+            sessions[user_id] = data if isinstance(data, Session) else Session.from_dict(data)
+
+        return sessions
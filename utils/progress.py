@@ -0,0 +1,247 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import ChatAction
+from telegram.error import TelegramError
+
+from utils import translate_key_to
+from utils.outbound import background_requests
+from utils.upload import UploadFile
+
+PROGRESS_EDIT_SECONDS = float(os.getenv("PROGRESS_EDIT_SECONDS")) if os.getenv("PROGRESS_EDIT_SECONDS") else 3.0
+PROGRESS_MIN_STEP_PERCENT = int(os.getenv("PROGRESS_MIN_STEP_PERCENT")) if os.getenv("PROGRESS_MIN_STEP_PERCENT") \
+    else 10
+# Telegram shows a chat action for 5 seconds, or until the bot sends a message
+CHAT_ACTION_SECONDS = 4.0
+TICK_SECONDS = 0.5
+PROGRESS_SEND_THREADS = int(os.getenv("PROGRESS_SEND_THREADS")) if os.getenv("PROGRESS_SEND_THREADS") else 4
+
+STAGE_ENCODING = 'PROGRESS_ENCODING'
+STAGE_UPLOADING = 'PROGRESS_UPLOADING'
+
+logger = logging.getLogger()
+
+
+class ProgressReporter:
+    """Shows a user how far a media job has come: the chat action is sent again before it runs out, and once the
+    job has taken longer than `edit_seconds`, a status message with the percentage of the current stage is sent and
+    then edited in place, at most every `edit_seconds` and only when the percentage moved by `min_step` or the
+    stage changed.
+
+    The worker only records the progress with `encoding` and `uploading`; the requests are sent by the threads of
+    `progress_ticker` at `PRIORITY_BACKGROUND`, so a slow request never holds up the encoding, the upload or the
+    replies to other users. A reporter has at most one batch of requests on its way: it is skipped until the
+    previous one is done. The status message is deleted once the job has finished.
+    """
+
+    def __init__(self, bot, chat_id: int, language: str, action: str, edit_seconds: float = PROGRESS_EDIT_SECONDS,
+                 min_step: int = PROGRESS_MIN_STEP_PERCENT):
+        """**Keyword arguments:**
+         - bot (Bot) -- The bot to send the chat actions and the status message with
+         - chat_id (int) -- The chat of the job
+         - language (str) -- The language of the user
+         - action (str) -- The chat action while encoding, a `ChatAction`
+         - edit_seconds (float) -- The seconds between two edits of the status message
+         - min_step (int) -- The percentage points the progress has to move to be shown
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.language = language
+        self.encoding_action = action
+        self.edit_seconds = edit_seconds
+        self.min_step = min_step
+
+        self._lock = threading.Lock()
+        self._stage = STAGE_ENCODING
+        self._action = action
+        self._percent = 0
+        self._started_at = None
+        self._action_sent_at = None
+        self._shown = None
+        self._shown_at = None
+        self._message_id = None
+        self._finished = False
+        self._pending = False
+
+    def __enter__(self) -> 'ProgressReporter':
+        self.start()
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.finish()
+
+    def start(self) -> None:
+        self._started_at = time.monotonic()
+        progress_ticker.add(self)
+
+    def encoding(self, fraction: float) -> None:
+        """Record the progress of the encoding, from 0 to 1."""
+        self._record(STAGE_ENCODING, self.encoding_action, fraction)
+
+    def uploading(self, sent: int, total: int) -> None:
+        """Record the number of bytes of the result which have been sent so far."""
+        self._record(STAGE_UPLOADING, ChatAction.UPLOAD_AUDIO, sent / total if total else 1.0)
+
+    def finish(self) -> None:
+        """Stop reporting. The status message is deleted by `progress_ticker`, so that the job doesn't wait for a
+        request which is still on its way.
+        """
+        with self._lock:
+            self._finished = True
+
+    def tick(self, now: float) -> bool:
+        """Send the chat action or the status message if they are due, or delete the status message once the job
+        has finished, without waiting for the requests. Called by `progress_ticker`.
+
+        **Returns:**
+         `False` once the job has finished and there is nothing left to send
+        """
+        with self._lock:
+            if self._pending:
+                return True
+
+            stage, percent, action, finished = self._stage, self._percent, self._action, self._finished
+
+        if finished:
+            if self._message_id:
+                self._submit([(self.bot.delete_message, {'chat_id': self.chat_id, 'message_id': self._message_id})])
+
+            return False
+
+        requests = []
+
+        if self._action_sent_at is None or now - self._action_sent_at >= CHAT_ACTION_SECONDS:
+            self._action_sent_at = now
+            requests.append((self.bot.send_chat_action, {'chat_id': self.chat_id, 'action': action}))
+
+        if now - (self._shown_at or self._started_at) >= self.edit_seconds and not (
+                self._shown and self._shown[0] == stage and percent - self._shown[1] < self.min_step):
+            text = translate_key_to(stage, self.language).format(percent)
+            self._shown, self._shown_at = (stage, percent), now
+
+            if self._message_id is None:
+                requests.append((self.bot.send_message, {'chat_id': self.chat_id, 'text': text}))
+            else:
+                requests.append((self.bot.edit_message_text,
+                                 {'text': text, 'chat_id': self.chat_id, 'message_id': self._message_id}))
+
+        if requests:
+            self._submit(requests)
+
+        return True
+
+    def _record(self, stage: str, action: str, fraction: float) -> None:
+        with self._lock:
+            self._stage = stage
+            self._action = action
+            self._percent = max(0, min(100, int(fraction * 100)))
+
+    def _submit(self, requests: [tuple]) -> None:
+        with self._lock:
+            self._pending = True
+
+        progress_ticker.submit(self._send, requests)
+
+    def _send(self, requests: [tuple]) -> None:
+        try:
+            with background_requests():
+                for method, kwargs in requests:
+                    try:
+                        result = method(**kwargs)
+                    except (TelegramError, BaseException):
+                        logger.warning(f"Couldn't report the progress of a job in {self.chat_id}.", exc_info=True)
+                        continue
+
+                    if method == self.bot.send_message:
+                        self._message_id = result.message_id
+        finally:
+            with self._lock:
+                self._pending = False
+
+
+class ProgressTicker:
+    """One thread which ticks every running `ProgressReporter` every `tick_seconds`, and `send_threads` threads
+    which send the requests of the reporters. They are started by the first reporter.
+    """
+
+    def __init__(self, tick_seconds: float = TICK_SECONDS, send_threads: int = PROGRESS_SEND_THREADS):
+        self.tick_seconds = tick_seconds
+        self.send_threads = send_threads
+
+        self._lock = threading.Lock()
+        self._reporters = set()
+        self._thread = None
+        self._executor = None
+
+    def add(self, reporter: ProgressReporter) -> None:
+        with self._lock:
+            self._reporters.add(reporter)
+
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.send_threads, thread_name_prefix='progress')
+                self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+                self._thread.start()
+
+    def submit(self, function, *args) -> None:
+        """Run a function of a reporter on one of the threads which send the requests."""
+        self._executor.submit(function, *args)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                reporters = list(self._reporters)
+
+            for reporter in reporters:
+                if not reporter.tick(time.monotonic()):
+                    with self._lock:
+                        self._reporters.discard(reporter)
+
+            time.sleep(self.tick_seconds)
+
+
+def track_upload(upload, on_read):
+    """Report the bytes sent of a file prepared with `open_for_upload`. A path, which a Bot API server in local mode
+    reads by itself, is returned as it is.
+
+    **Keyword arguments:**
+     - upload (str|UploadFile) -- What `open_for_upload` returned
+     - on_read (callable) -- Called with the bytes sent so far and the size of the file
+
+    **Returns:**
+     The file to upload
+    """
+    if isinstance(upload, UploadFile):
+        upload.on_progress = on_read
+
+    return upload
+
+
+def track_uploads(uploads: list, on_read) -> list:
+    """Like `track_upload`, for files which are sent in one request, e.g. a media group: the bytes sent of all of
+    them are reported together.
+
+    **Keyword arguments:**
+     - uploads (list) -- What `open_for_upload` returned for each file
+     - on_read (callable) -- Called with the bytes sent so far and the size of all the files
+
+    **Returns:**
+     The files to upload
+    """
+    total = sum(upload.size for upload in uploads if isinstance(upload, UploadFile))
+    sent = [0] * len(uploads)
+
+    def on_file_read(index: int, file_sent: int) -> None:
+        sent[index] = file_sent
+        on_read(sum(sent), total)
+
+    return [
+        track_upload(upload, lambda file_sent, _, index=index: on_file_read(index, file_sent))
+        for index, upload in enumerate(uploads)
+    ]
+
+
+progress_ticker = ProgressTicker()
@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+import time
+
+from utils import is_user_admin
+from utils.metrics import metrics
+
+RATE_LIMIT_UPLOADS_PER_MINUTE = float(os.getenv("RATE_LIMIT_UPLOADS_PER_MINUTE")) \
+    if os.getenv("RATE_LIMIT_UPLOADS_PER_MINUTE") else 6.0
+RATE_LIMIT_UPLOADS_BURST = int(os.getenv("RATE_LIMIT_UPLOADS_BURST")) \
+    if os.getenv("RATE_LIMIT_UPLOADS_BURST") else 10
+RATE_LIMIT_CONVERSIONS_PER_MINUTE = float(os.getenv("RATE_LIMIT_CONVERSIONS_PER_MINUTE")) \
+    if os.getenv("RATE_LIMIT_CONVERSIONS_PER_MINUTE") else 3.0
+RATE_LIMIT_CONVERSIONS_BURST = int(os.getenv("RATE_LIMIT_CONVERSIONS_BURST")) \
+    if os.getenv("RATE_LIMIT_CONVERSIONS_BURST") else 5
+RATE_LIMIT_CUTS_PER_MINUTE = float(os.getenv("RATE_LIMIT_CUTS_PER_MINUTE")) \
+    if os.getenv("RATE_LIMIT_CUTS_PER_MINUTE") else 4.0
+RATE_LIMIT_CUTS_BURST = int(os.getenv("RATE_LIMIT_CUTS_BURST")) \
+    if os.getenv("RATE_LIMIT_CUTS_BURST") else 6
+RATE_LIMIT_ADMIN_CACHE_SECONDS = int(os.getenv("RATE_LIMIT_ADMIN_CACHE_SECONDS")) \
+    if os.getenv("RATE_LIMIT_ADMIN_CACHE_SECONDS") else 300
+
+# Buckets which have been refilled to their burst are dropped once there are this many of them
+SWEEP_THRESHOLD = 10000
+
+
+class TokenBucket:
+    """Holds up to `burst` tokens and gains `rate` tokens per second. Every operation takes one token."""
+    __slots__ = ['rate', 'burst', 'tokens', 'updated_at']
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now: float) -> float:
+        """Take a token if there is one.
+
+        **Keyword arguments:**
+         - now (float) -- The current time of `time.monotonic()`
+
+        **Returns:**
+         0 if a token was taken, otherwise the seconds until there is one
+        """
+        self.refill(now)
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated_at) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """Keeps a token bucket per user for every kind of expensive operation, e.g. 'upload', 'conversion' and
+    'cut'. Users who `is_exempt` accepts are never limited.
+    """
+
+    def __init__(self, limits: dict, is_exempt=None):
+        """**Keyword arguments:**
+         - limits (dict) -- The rate limits by kind, as `(operations per minute, burst)`
+         - is_exempt (callable) -- Takes a user id and returns whether the user is exempt
+        """
+        self.limits = limits
+        self.is_exempt = is_exempt
+
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._exemptions = {}
+
+    def try_acquire(self, kind: str, user_id: int) -> int:
+        """Take a token from the bucket of a user for an operation of the given kind.
+
+        **Keyword arguments:**
+         - kind (str) -- The kind of the operation
+         - user_id (int) -- The user id of the user
+
+        **Returns:**
+         0 if the operation is allowed, otherwise the seconds to wait before trying again
+        """
+        if self.is_user_exempt(user_id):
+            return 0
+
+        per_minute, burst = self.limits[kind]
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get((kind, user_id))
+
+            if bucket is None:
+                if len(self._buckets) >= SWEEP_THRESHOLD:
+                    self._sweep(now)
+
+                bucket = self._buckets[(kind, user_id)] = TokenBucket(per_minute / 60, burst)
+
+            retry_after = bucket.try_take(now)
+
+        metrics.increment('rate_limit_checks_total', kind=kind)
+
+        if retry_after:
+            metrics.increment('rate_limit_hits_total', kind=kind)
+
+        return math.ceil(retry_after)
+
+    def is_user_exempt(self, user_id: int) -> bool:
+        """Ask `is_exempt` whether a user is exempt. The answer is cached for `RATE_LIMIT_ADMIN_CACHE_SECONDS`, so
+        that the database is not queried on every operation.
+        """
+        if self.is_exempt is None:
+            return False
+
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._exemptions.get(user_id)
+
+        if cached is not None and now - cached[1] < RATE_LIMIT_ADMIN_CACHE_SECONDS:
+            return cached[0]
+
+        # The database is queried without the lock, so that the other users are not held up by it
+        exempt = self.is_exempt(user_id)
+
+        with self._lock:
+            self._exemptions[user_id] = (exempt, now)
+
+        return exempt
+
+    def _sweep(self, now: float) -> None:
+        # A full bucket is the same as a new one, so it can go
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[key]
+
+        for user_id in [user_id for user_id, (_, checked_at) in self._exemptions.items()
+                        if now - checked_at >= RATE_LIMIT_ADMIN_CACHE_SECONDS]:
+            del self._exemptions[user_id]
+
+        metrics.set_gauge('rate_limit_buckets', len(self._buckets))
+
+
+RATE_LIMITS = {
+    'upload': (RATE_LIMIT_UPLOADS_PER_MINUTE, RATE_LIMIT_UPLOADS_BURST),
+    'conversion': (RATE_LIMIT_CONVERSIONS_PER_MINUTE, RATE_LIMIT_CONVERSIONS_BURST),
+    'cut': (RATE_LIMIT_CUTS_PER_MINUTE, RATE_LIMIT_CUTS_BURST),
+}
+
+
+rate_limiter = RateLimiter(
+    limits=RATE_LIMITS,
+    is_exempt=is_user_admin,
+)
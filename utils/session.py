@@ -0,0 +1,205 @@
+import logging
+import os
+import shutil
+import time
+
+from utils import reset_user_data
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS")) if os.getenv("SESSION_TTL_SECONDS") else 6 * 60 * 60
+SESSION_SWEEP_SECONDS = int(os.getenv("SESSION_SWEEP_SECONDS")) if os.getenv("SESSION_SWEEP_SECONDS") else 10 * 60
+
+# The fields which are empty once a session has been reset, i.e. which tell whether there is anything to evict
+SCRATCH_FIELDS = ('tag_editor', 'music_path', 'music_file_id', 'art_path', 'new_art_path', 'current_active_module',
+                  'batch_files')
+
+# `...` stays itself when it is copied or pickled, unlike a sentinel `object()`
+MISSING = Ellipsis
+
+logger = logging.getLogger()
+
+
+class Session:
+    """The `user_data` of a user, with a fixed set of fields instead of a free-form `dict`. It is read and written
+    like a `dict` (`user_data['music_path']`, `in`, `get`, `len`), so the handlers don't tell the difference, but a
+    session takes about half the memory of the `dict` it replaces and a typo in a key fails loudly.
+
+    A field which was never set is missing, like a missing key of a `dict`, unless it has a value in `DEFAULTS`:
+    that value is then set the first time the field is read, so that a session which `evict_session` emptied holds
+    its language only until it is used again. `last_active_at` is not a field; it is kept by `touch_session` for
+    `sweep_sessions`.
+    """
+    FIELDS = (
+        'language', 'tag_editor', 'music_path', 'music_file_id', 'music_file_unique_id', 'music_file_size',
+        'music_duration', 'art_path', 'art_extracted', 'new_art_path', 'current_active_module', 'music_message_id',
+        'music_fingerprint_id', 'batch_files',
+    )
+    __slots__ = FIELDS + ('last_active_at',)
+    # The slots of the sessions pickled while they still kept the fingerprint of the music, which is only kept in the
+    # fingerprint index now
+    LEGACY_SLOTS = FIELDS[:12] + ('music_fingerprint',) + FIELDS[12:] + ('last_active_at',)
+    # What `reset_user_data` sets the fields to, made anew for every session which reads them
+    DEFAULTS = {
+        'tag_editor': dict,
+        'music_path': str,
+        'music_file_id': str,
+        'music_file_unique_id': str,
+        'music_file_size': int,
+        'music_duration': str,
+        'art_path': str,
+        'art_extracted': bool,
+        'new_art_path': str,
+        'current_active_module': str,
+        'music_message_id': str,
+        'music_fingerprint_id': lambda: None,
+        'batch_files': list,
+    }
+
+    def __init__(self, **fields):
+        self.last_active_at = time.time()
+
+        # A missing field holds `MISSING` rather than being unset, because the persistence of python-telegram-bot
+        # copies every slot of the objects in `user_data`
+        for key in self.FIELDS:
+            setattr(self, key, fields.pop(key, MISSING))
+
+        if fields:
+            raise KeyError(f"{', '.join(fields)} are not fields of a session")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Session':
+        """Make a session out of the `dict` a user had before sessions, dropping the keys which are not fields."""
+        return cls(**{key: value for key, value in data.items() if key in cls.FIELDS})
+
+    def __getitem__(self, key: str):
+        value = getattr(self, key, MISSING) if key in self.FIELDS else MISSING
+
+        if value is MISSING:
+            if key not in self.DEFAULTS:
+                raise KeyError(key)
+
+            value = self.DEFAULTS[key]()
+            setattr(self, key, value)
+
+        return value
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.FIELDS:
+            raise KeyError(f"{key} is not a field of a session")
+
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+
+        setattr(self, key, MISSING)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS and getattr(self, key) is not MISSING
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __getstate__(self) -> tuple:
+        # The values in the order of `__slots__`, so that the names are not pickled with every session
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state: tuple) -> None:
+        slots = self.LEGACY_SLOTS if len(state) == len(self.LEGACY_SLOTS) else self.__slots__
+
+        for key, value in zip(slots, state):
+            if key in self.__slots__:
+                setattr(self, key, value)
+
+    def __eq__(self, other) -> bool:
+        if other is self:
+            return True
+
+        return isinstance(other, Session) and self.keys() == other.keys() and all(
+            are_equal(getattr(self, key), getattr(other, key)) for key in self.keys()
+        )
+
+    def __repr__(self) -> str:
+        return f"Session({self.to_dict()!r})"
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key, MISSING) if key in self.FIELDS else MISSING
+
+        return default if value is MISSING else value
+
+    def clear(self) -> None:
+        for key in self.FIELDS:
+            setattr(self, key, MISSING)
+
+    def keys(self) -> list:
+        return [key for key in self.FIELDS if getattr(self, key) is not MISSING]
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.keys()}
+
+
+def are_equal(first, second) -> bool:
+    if first is second:
+        return True
+
+    try:
+        return bool(first == second)
+    except ValueError:
+        # `==` of two numpy arrays compares them element by element
+        return False
+
+
+def touch_session(update, context) -> None:
+    """A handler which marks the session of the user of an update as active. A dispatcher without
+    `SessionPersistence` may hand out plain `dict`s, which are never swept.
+    """
+    if update.effective_user and isinstance(context.user_data, Session):
+        context.user_data.last_active_at = time.time()
+
+
+def sweep_sessions(context) -> None:
+    """A job which evicts the sessions of the users who have been idle for `SESSION_TTL_SECONDS`. Only the language
+    of an evicted session is kept; its downloaded files are deleted.
+    """
+    dispatcher = context.dispatcher
+    idle_since = time.time() - SESSION_TTL_SECONDS
+    evicted = 0
+
+    for user_id, session in list(dispatcher.user_data.items()):
+        if isinstance(session, Session) and session.last_active_at < idle_since and evict_session(user_id, session):
+            evicted += 1
+
+    if evicted:
+        logger.info(f"Evicted {evicted} idle sessions.")
+        dispatcher.update_persistence()
+
+
+def evict_session(user_id: int, session: Session) -> bool:
+    """Empty a session but for its language and delete the files of the user. The other fields are only made again
+    once the user comes back and they are read.
+
+    **Keyword arguments:**
+     - user_id (int) -- The user id of the user
+     - session (Session) -- The session of the user
+
+    **Returns:**
+     `False` if the session had nothing to evict
+    """
+    if not any(session.get(field) for field in SCRATCH_FIELDS):
+        return False
+
+    try:
+        language = session.get('language')
+
+        # Deletes the files of the session
+        reset_user_data(session)
+        session.clear()
+
+        if language:
+            session['language'] = language
+
+        shutil.rmtree(f"downloads/{user_id}", ignore_errors=True)
+    except (OSError, BaseException):
+        logger.error(f"Error on evicting the session of {user_id}.", exc_info=True)
+
+    return True
@@ -0,0 +1,262 @@
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+from utils.metrics import metrics
+
+# Empty turns tracing off
+TRACE_FILE = os.getenv("TRACE_FILE") if os.getenv("TRACE_FILE") else ''
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE")) if os.getenv("TRACE_SAMPLE_RATE") else 0.01
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS")) if os.getenv("TRACE_SLOW_SECONDS") else 5.0
+
+logger = logging.getLogger()
+
+
+class Trace:
+    """The timeline of one update: when each of its spans (a query, a download, an ffmpeg run, ...) began, relative
+    to the update, and how long it took.
+    """
+
+    def __init__(self, name: str, attributes: dict):
+        self.id = uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = None
+        self.error = None
+        self.spans = []
+
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        # The threads which still add spans; the trace ends when the last of them is done
+        self._holders = 1
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.error) or any('error' in span for span in self.spans)
+
+    def add_span(self, name: str, started: float, duration: float, attributes: dict, error: str = None) -> None:
+        span = {
+            'name': name,
+            'start_ms': round((started - self._started) * 1000, 3),
+            'duration_ms': round(duration * 1000, 3),
+            'thread': threading.current_thread().name,
+        }
+
+        if attributes:
+            span['attributes'] = attributes
+        if error:
+            span['error'] = error
+
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_ms'])
+
+        trace = {
+            'trace_id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'spans': spans,
+        }
+
+        if self.error:
+            trace['error'] = self.error
+
+        return trace
+
+
+class Tracer:
+    """Traces updates and exports them as JSON lines to `path`. The current trace is kept per thread, so the spans
+    of a handler go to the update it handles without passing the trace around; `bind` carries it over to the
+    functions which run on another thread.
+
+    Whether a trace is kept is decided once it has ended (tail-based sampling): traces which failed or took at least
+    `slow_seconds` are always kept, and a `sample_rate` share of the rest.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, sample_rate: float = TRACE_SAMPLE_RATE,
+                 slow_seconds: float = TRACE_SLOW_SECONDS, seed: int = None):
+        """**Keyword arguments:**
+         - path (str) -- The file to append the kept traces to, empty to trace nothing
+         - sample_rate (float) -- The share of the fast and successful traces to keep, from 0 to 1
+         - slow_seconds (float) -- The duration from which a trace is always kept
+         - seed (int) -- The seed of the sampling, for tests
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+
+        self._random = random.Random(seed)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def start(self, name: str, **attributes) -> Trace:
+        """Start a trace on the current thread. A trace which was left unfinished on the thread is finished first.
+
+        **Returns:**
+         The trace, or `None` if tracing is off
+        """
+        if self.current():
+            self.finish()
+
+        if not self.path:
+            return None
+
+        trace = self._local.trace = Trace(name, attributes)
+
+        return trace
+
+    def current(self) -> Trace:
+        return getattr(self._local, 'trace', None)
+
+    def fail(self, error: BaseException) -> None:
+        """Mark the current trace as failed, so that it is kept."""
+        trace = self.current()
+
+        if trace:
+            trace.error = f"{type(error).__name__}: {error}"
+
+    def finish(self) -> None:
+        """End the current trace of the thread. It is exported once the functions it was bound to have returned."""
+        trace = self.current()
+        self._local.trace = None
+
+        if trace:
+            self._release(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time a block as a span of the current trace. Does nothing if the thread has no trace."""
+        trace = self.current()
+
+        if not trace:
+            yield
+            return
+
+        started = time.monotonic()
+        error = None
+
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            trace.add_span(name, started, time.monotonic() - started, attributes, error)
+
+    def record(self, name: str, seconds: float, **attributes) -> None:
+        """Add a span which has just ended and took `seconds`, e.g. one timed by a library."""
+        trace = self.current()
+
+        if trace:
+            trace.add_span(name, time.monotonic() - seconds, seconds, attributes)
+
+    def traced(self, name: str):
+        """Decorate a function to trace each of its calls as a span named `name`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def bind(self, func):
+        """Wrap a function which is to run on another thread, e.g. with `run_async`, so that its spans go to the
+        current trace. The trace is not exported before the function has returned.
+        """
+        trace = self.current()
+
+        if not trace:
+            return func
+
+        with trace._lock:
+            trace._holders += 1
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._local.trace = trace
+
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                # The error handlers of `run_async` only run once this thread has let go of the trace
+                trace.error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                self._local.trace = None
+                self._release(trace)
+
+        return wrapper
+
+    def keep(self, trace: Trace) -> bool:
+        if trace.failed or trace.duration >= self.slow_seconds:
+            return True
+
+        with self._lock:
+            return self._random.random() < self.sample_rate
+
+    def _release(self, trace: Trace) -> None:
+        with trace._lock:
+            trace._holders -= 1
+
+            if trace._holders:
+                return
+
+            trace.duration = time.monotonic() - trace._started
+
+        kept = self.keep(trace)
+        metrics.increment('traces_total', sampling='kept' if kept else 'dropped')
+
+        if kept:
+            self._export(trace)
+
+    def _export(self, trace: Trace) -> None:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.path, 'a', encoding='utf-8')
+
+                self._file.write(line + '\n')
+                self._file.flush()
+        except OSError:
+            logger.error(f"Error on writing trace {trace.id} to {self.path}.", exc_info=True)
+
+
+def start_trace(update, context) -> None:
+    """A handler which starts the trace of an update."""
+    user = update.effective_user
+
+    tracer.start('update', update_id=update.update_id, user_id=user.id if user else None)
+
+
+def finish_trace(*args) -> None:
+    """A handler which finishes the trace of an update, once the other handlers are done with it. Takes any
+    arguments, so that it can be used as a handler or a job callback.
+    """
+    tracer.finish()
+
+
+def handle_error(update, context) -> None:
+    """An error handler which marks the trace of an update as failed and logs the error."""
+    tracer.fail(context.error)
+    logger.error(f"Error on handling update {getattr(update, 'update_id', None)}.", exc_info=context.error)
+
+
+tracer = Tracer()
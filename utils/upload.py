@@ -0,0 +1,218 @@
+import json
+import mimetypes
+import os
+import threading
+from contextlib import closing
+from uuid import uuid4
+
+from telegram import InputFile, InputMedia
+from telegram.files.inputfile import DEFAULT_MIME_TYPE
+from telegram.utils.request import Request, RequestField, Timeout
+
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES")) if os.getenv("UPLOAD_CHUNK_BYTES") else 64 * 1024
+
+_in_flight_lock = threading.Lock()
+_bytes_in_flight = 0
+
+
+class UploadFile(InputFile):
+    """A file on the disk to send to Telegram. Unlike `InputFile`, which reads the whole file into memory when it is
+    made, it is only opened while `StreamingRequest` sends it, and read in chunks of `UPLOAD_CHUNK_BYTES`.
+    """
+
+    def __init__(self, path: str, filename: str = None, on_progress=None):
+        """**Keyword arguments:**
+         - path (str) -- The path of the file
+         - filename (str) -- The name of the file for Telegram, its base name by default
+         - on_progress (callable) -- Called with the bytes sent so far and the size of the file
+        """
+        # `InputFile.__init__` is not called, as it reads the file
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.filename = filename or os.path.basename(path)
+        self.on_progress = on_progress
+        # Telegram finds a file of a media group by this name; it is ignored otherwise
+        self.attach = 'attached' + uuid4().hex
+
+        with open(path, 'rb') as file:
+            image_mime_type = self.is_image(file.read(32))
+
+        self.mimetype = image_mime_type or mimetypes.guess_type(self.filename)[0] or DEFAULT_MIME_TYPE
+
+    @property
+    def input_file_content(self) -> bytes:
+        # Only for a `Request` which doesn't stream
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def chunks(self):
+        """Read the file in chunks, and close it as soon as it has been read or the upload has stopped."""
+        sent = 0
+
+        with open(self.path, 'rb') as file:
+            while True:
+                chunk = file.read(UPLOAD_CHUNK_BYTES)
+
+                if not chunk:
+                    break
+
+                yield chunk
+
+                sent += len(chunk)
+
+                if self.on_progress:
+                    self.on_progress(sent, self.size)
+
+
+class MultipartBody:
+    """A `multipart/form-data` body which is generated part by part while it is sent, so that only one chunk of a
+    file is in memory at a time. It can be iterated more than once, e.g. when urllib3 retries a request.
+    """
+
+    def __init__(self, fields: [(str, object)]):
+        """**Keyword arguments:**
+         - fields (list) -- The names and the values of the fields: strings, `UploadFile`s or other `InputFile`s
+        """
+        self.boundary = uuid4().hex
+        self.parts = []
+
+        for name, value in fields:
+            if isinstance(value, InputFile):
+                field = RequestField(name, b'', filename=value.filename)
+                field.make_multipart(content_type=value.mimetype)
+            else:
+                field = RequestField(name, value)
+                field.make_multipart()
+
+            self.parts.append((f"--{self.boundary}\r\n{field.render_headers()}".encode(), value))
+
+        self.closing = f"--{self.boundary}--\r\n".encode()
+        self.length = len(self.closing) + sum(
+            len(headers) + self._value_length(value) + len(b'\r\n') for headers, value in self.parts
+        )
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        remaining = self.length
+        track_in_flight(remaining)
+
+        try:
+            with closing(self._pieces()) as pieces:
+                for piece in pieces:
+                    yield piece
+
+                    remaining -= len(piece)
+                    track_in_flight(-len(piece))
+        finally:
+            track_in_flight(-remaining)
+
+    def _pieces(self):
+        for headers, value in self.parts:
+            yield headers
+
+            if isinstance(value, UploadFile):
+                yield from value.chunks()
+            else:
+                yield self._value_bytes(value)
+
+            yield b'\r\n'
+
+        yield self.closing
+
+    @staticmethod
+    def _value_length(value) -> int:
+        return value.size if isinstance(value, UploadFile) else len(MultipartBody._value_bytes(value))
+
+    @staticmethod
+    def _value_bytes(value) -> bytes:
+        if isinstance(value, InputFile):
+            return value.input_file_content
+
+        return value if isinstance(value, bytes) else str(value).encode()
+
+
+class StreamingRequest(Request):
+    """A `Request` which streams the requests with an `UploadFile` from the disk, instead of building the whole body
+    in memory. Every other request is sent like `Request` sends it.
+    """
+
+    def post(self, url: str, data: dict, timeout: float = None):
+        with tracer.span('bot_api', method=url.rsplit('/', 1)[-1]):
+            if not data or not any(isinstance(value, UploadFile) for value in iterate_files(data)):
+                return super().post(url, data, timeout)
+
+            return self._stream(url, data, timeout)
+
+    def _stream(self, url: str, data: dict, timeout: float = None):
+        body = MultipartBody(list(flatten_fields(data)))
+        urlopen_kwargs = {}
+
+        if timeout is not None:
+            urlopen_kwargs['timeout'] = Timeout(read=timeout, connect=self._connect_timeout)
+
+        metrics.increment('upload_bytes_total', body.length)
+
+        result = self._request_wrapper(
+            'POST',
+            url,
+            body=body,
+            headers={'Content-Type': body.content_type, 'Content-Length': str(body.length)},
+            **urlopen_kwargs,
+        )
+
+        return self._parse(result)
+
+
+def iterate_files(data: dict):
+    """Yield the files of the parameters of a request, including the ones of a media group."""
+    for key, value in data.items():
+        if isinstance(value, InputFile):
+            yield value
+        elif key == 'media':
+            for media in value if isinstance(value, list) else [value]:
+                for file in (getattr(media, 'media', None), getattr(media, 'thumb', None)):
+                    if isinstance(file, InputFile):
+                        yield file
+
+
+def flatten_fields(data: dict):
+    """Turn the parameters of a request into the fields of a multipart body, like `Request.post` does. A file which
+    several medias of a group refer to, e.g. a shared thumbnail, is a single field.
+    """
+    for key, value in data.items():
+        if key == 'media':
+            medias = value if isinstance(value, list) else [value]
+            attached = set()
+
+            yield key, medias[0].to_json() if isinstance(value, InputMedia) else json.dumps(
+                [media.to_dict() for media in medias]
+            )
+
+            for media in medias:
+                for file in (getattr(media, 'media', None), getattr(media, 'thumb', None)):
+                    if isinstance(file, InputFile) and file.attach not in attached:
+                        attached.add(file.attach)
+
+                        yield file.attach, file
+        elif isinstance(value, list):
+            yield key, json.dumps(value)
+        else:
+            yield key, value
+
+
+def track_in_flight(change: int) -> None:
+    """Add the bytes which are about to be sent, or take away the ones sent, to the `upload_bytes_in_flight` gauge."""
+    global _bytes_in_flight
+
+    with _in_flight_lock:
+        _bytes_in_flight += change
+        metrics.set_gauge('upload_bytes_in_flight', _bytes_in_flight)
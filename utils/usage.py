@@ -0,0 +1,275 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.db_pool import releases_database_connection
+from utils.metrics import metrics
+
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE")) if os.getenv("USAGE_BATCH_SIZE") else 500
+USAGE_FLUSH_SECONDS = int(os.getenv("USAGE_FLUSH_SECONDS")) if os.getenv("USAGE_FLUSH_SECONDS") else 10
+USAGE_MAX_BUFFERED = int(os.getenv("USAGE_MAX_BUFFERED")) if os.getenv("USAGE_MAX_BUFFERED") else 50000
+USAGE_ROLLUP_SECONDS = int(os.getenv("USAGE_ROLLUP_SECONDS")) if os.getenv("USAGE_ROLLUP_SECONDS") else 300
+
+MODULE_TAG_EDITOR = 'tag_editor'
+MODULE_MUSIC_CUTTER = 'music_cutter'
+MODULE_VOICE_CONVERTER = 'voice_converter'
+
+# Dates are bound as strings, so that MySQL and SQLite compare them the same way
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+logger = logging.getLogger()
+
+
+class UsageRecorder:
+    """Buffers usage events in memory and writes them to `usage_events` in batches, so that using a module costs
+    an append to a list instead of a query. The buffer is written once it holds `batch_size` events, and by
+    `flush_usage` every `USAGE_FLUSH_SECONDS`.
+
+    If the database is unreachable, the events are kept for the next flush, up to `max_buffered` of them; the oldest
+    ones are dropped after that.
+    """
+
+    def __init__(self, batch_size: int, max_buffered: int, insert=None):
+        """**Keyword arguments:**
+         - batch_size (int) -- The number of events to write with one query
+         - max_buffered (int) -- The number of events to keep at most while they can't be written
+         - insert (callable) -- Takes a list of rows and inserts them, `insert_usage_events` by default
+        """
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.insert = insert or insert_usage_events
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []
+
+    def record(self, user_id: int, module: str) -> None:
+        """Record that a user used a module.
+
+        **Keyword arguments:**
+         - user_id (int) -- The user id of the user
+         - module (str) -- The module, one of the `MODULE_*` constants
+        """
+        with self._lock:
+            self._events.append({
+                'user_id': user_id,
+                'module': module,
+                'created_at': datetime.now().strftime(DATETIME_FORMAT),
+            })
+            is_full = len(self._events) >= self.batch_size
+
+            if len(self._events) > self.max_buffered:
+                dropped = len(self._events) - self.max_buffered
+                del self._events[:dropped]
+                metrics.increment('usage_events_dropped_total', dropped)
+
+        metrics.increment('usage_events_total', module=module)
+
+        if is_full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write the buffered events.
+
+        **Returns:**
+         The number of events written
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+
+            written = 0
+            started_at = time.perf_counter()
+
+            try:
+                for batch_start in range(0, len(events), self.batch_size):
+                    self.insert(events[batch_start:batch_start + self.batch_size])
+                    written = batch_start + self.batch_size
+            except (OSError, BaseException):
+                logger.error(f"Error on writing {len(events) - written} usage events.", exc_info=True)
+
+                with self._lock:
+                    self._events = (events[written:] + self._events)[-self.max_buffered:]
+
+            written = min(written, len(events))
+
+            if written:
+                metrics.observe('usage_flush_seconds', time.perf_counter() - started_at)
+
+            return written
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+
+def insert_usage_events(rows: list) -> None:
+    """Insert usage events with one multi-row `INSERT`."""
+    from models.usage import UsageEvent
+
+    UsageEvent.insert(rows)
+
+
+def roll_up_usage(now: datetime = None) -> None:
+    """Build `usage_hourly` and `usage_daily` from the events which came after the last rollup. The last hour and
+    day which were rolled up are built again, because they may have been incomplete then, so running this more
+    than once is harmless.
+
+    **Keyword arguments:**
+     - now (datetime) -- The current time
+    """
+    from models.usage import UsageHourly, UsageDaily
+
+    started_at = time.perf_counter()
+    current_hour = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+
+    roll_up_periods(UsageHourly, 'hour', DATETIME_FORMAT, timedelta(hours=1), current_hour)
+    roll_up_periods(UsageDaily, 'day', DATE_FORMAT, timedelta(days=1), current_hour.replace(hour=0))
+
+    metrics.observe('usage_rollup_seconds', time.perf_counter() - started_at)
+
+
+def roll_up_periods(model, column: str, period_format: str, length: timedelta, current: datetime) -> None:
+    """Build the rows of a rollup table from its last period up to the current one.
+
+    **Keyword arguments:**
+     - model (Model) -- The model of the rollup table
+     - column (str) -- The column which holds the beginning of a period
+     - period_format (str) -- The format of that column
+     - length (timedelta) -- The length of a period, i.e. an hour or a day
+     - current (datetime) -- The beginning of the current period
+    """
+    period = parse_datetime(model.max(column))
+
+    if period is None:
+        period = next_active_period(None, length, current)
+
+    while period is not None:
+        replace_rollup(model, column, period.strftime(period_format), aggregate_usage_events(period, period + length))
+        period = next_active_period(period + length, length, current)
+
+
+def next_active_period(start, length: timedelta, current: datetime):
+    """Find the first period at or after `start` which has events, so that the rollup skips the hours and days
+    when the bot was idle or down. The current period is built even without events, so that it is never stale.
+
+    **Keyword arguments:**
+     - start (datetime) -- The beginning of the first period to look at, `None` to start from the first event
+     - length (timedelta) -- The length of a period
+     - current (datetime) -- The beginning of the current period, which is the last one
+
+    **Returns:**
+     The beginning of the period as `datetime`, or `None` if there is none
+    """
+    from models.usage import UsageEvent
+
+    if start is not None and start > current:
+        return None
+
+    query = UsageEvent.where('created_at', '<', (current + length).strftime(DATETIME_FORMAT))
+
+    if start is not None:
+        query = query.where('created_at', '>=', start.strftime(DATETIME_FORMAT))
+
+    first_event_at = parse_datetime(query.min('created_at'))
+
+    if first_event_at is None:
+        return current if start is not None else None
+
+    return current + ((first_event_at - current) // length) * length
+
+
+def aggregate_usage_events(start: datetime, end: datetime) -> dict:
+    """Count the events and the distinct users of every module between two times.
+
+    **Returns:**
+     `dict` of `(events, users)` by module
+    """
+    from models.usage import UsageEvent
+
+    connection = UsageEvent.resolve_connection()
+    rows = connection.table('usage_events') \
+        .select('module', connection.raw('COUNT(*) AS events'), connection.raw('COUNT(DISTINCT user_id) AS users')) \
+        .where('created_at', '>=', start.strftime(DATETIME_FORMAT)) \
+        .where('created_at', '<', end.strftime(DATETIME_FORMAT)) \
+        .group_by('module') \
+        .get()
+
+    return {row['module']: (int(row['events']), int(row['users'])) for row in rows}
+
+
+def replace_rollup(model, column: str, period: str, aggregates: dict) -> None:
+    """Replace the rows of a period in a rollup table in one transaction."""
+    with model.resolve_connection().transaction():
+        model.where(column, '=', period).delete()
+
+        if aggregates:
+            model.insert([
+                {column: period, 'module': module, 'events': events, 'users': users}
+                for module, (events, users) in sorted(aggregates.items())
+            ])
+
+
+def get_usage_summary(days: int, now: datetime = None) -> dict:
+    """Read the usage of every module in the last `days` days, today included, from `usage_daily`.
+
+    **Keyword arguments:**
+     - days (int) -- The number of days
+     - now (datetime) -- The current time
+
+    **Returns:**
+     `dict` of `(events, users today)` by module
+    """
+    from models.usage import UsageDaily
+
+    today = (now or datetime.now()).date()
+    summary = {}
+
+    rows = UsageDaily.where('day', '>', (today - timedelta(days=days)).strftime(DATE_FORMAT)).get()
+
+    for row in rows:
+        events, users_today = summary.get(row.module, (0, 0))
+
+        if parse_datetime(row.day).date() == today:
+            users_today = row.users
+
+        summary[row.module] = (events + row.events, users_today)
+
+    return summary
+
+
+def parse_datetime(value):
+    """Convert a date or a time read from the database to `datetime`; MySQL returns objects and SQLite strings."""
+    if value is None or isinstance(value, datetime):
+        return value
+
+    if hasattr(value, 'year'):
+        return datetime(value.year, value.month, value.day)
+
+    return datetime.fromisoformat(str(value))
+
+
+@releases_database_connection
+def flush_usage(context=None) -> None:
+    """A job for the job queue which writes the buffered usage events."""
+    usage_recorder.flush()
+
+
+@releases_database_connection
+def roll_up_usage_job(context=None) -> None:
+    """A job for the job queue which writes the buffered usage events and updates the rollups."""
+    usage_recorder.flush()
+
+    try:
+        roll_up_usage()
+    except (OSError, BaseException):
+        logger.error("Error on rolling up usage events.", exc_info=True)
+
+
+usage_recorder = UsageRecorder(
+    batch_size=USAGE_BATCH_SIZE,
+    max_buffered=USAGE_MAX_BUFFERED,
+)
@@ -0,0 +1,259 @@
+import os
+import struct
+import zlib
+from pathlib import Path
+
+from utils.artwork import evict_cache
+from utils.media import stream_pcm
+
+WAVEFORM_CACHE_DIR = os.getenv("WAVEFORM_CACHE_DIR") if os.getenv("WAVEFORM_CACHE_DIR") else 'downloads/waveforms'
+WAVEFORM_CACHE_MAX_BYTES = int(os.getenv("WAVEFORM_CACHE_MAX_BYTES")) if os.getenv("WAVEFORM_CACHE_MAX_BYTES") \
+    else 20 * 1024 * 1024
+WAVEFORM_WIDTH = int(os.getenv("WAVEFORM_WIDTH")) if os.getenv("WAVEFORM_WIDTH") else 800
+WAVEFORM_HEIGHT = int(os.getenv("WAVEFORM_HEIGHT")) if os.getenv("WAVEFORM_HEIGHT") else 120
+WAVEFORM_SAMPLE_RATE = 8000
+# The decoded music is reduced to the peak and the energy of every block of this many samples as it is read, 10 ms,
+# so that a long music takes a few MB rather than being held in memory whole
+ENVELOPE_BLOCK_SAMPLES = 80
+PCM_CHUNK_SAMPLES = ENVELOPE_BLOCK_SAMPLES * 1024
+
+TIMELINE_HEIGHT = 24
+FONT_SCALE = 2
+
+BACKGROUND = 255
+PEAK_COLOR = 170
+RMS_COLOR = 60
+TICK_COLOR = 0
+
+# Seconds between two marks on the timeline, the first one which leaves room for every label is used
+TICK_INTERVALS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800]
+
+# 3x5 bitmaps of the characters of a timestamp
+FONT = {
+    '0': ['111', '101', '101', '101', '111'],
+    '1': ['010', '110', '010', '010', '111'],
+    '2': ['111', '001', '111', '100', '111'],
+    '3': ['111', '001', '111', '001', '111'],
+    '4': ['101', '101', '111', '001', '001'],
+    '5': ['111', '100', '111', '001', '111'],
+    '6': ['111', '100', '111', '101', '111'],
+    '7': ['111', '001', '010', '010', '010'],
+    '8': ['111', '101', '111', '101', '111'],
+    '9': ['111', '101', '111', '001', '111'],
+    ':': ['000', '010', '000', '010', '000'],
+}
+
+
+def generate_waveform(music_path: str, cache_key: str, duration: int) -> str:
+    """Draw the waveform of a music on a timeline, so that the user can see where to cut it. Waveforms are cached by
+    `cache_key`, e.g. the `file_unique_id` of the music, so each music is decoded only once.
+
+    **Keyword arguments:**
+     - music_path (str) -- The path of the music
+     - cache_key (str) -- A key which is unique to the audio of the music
+     - duration (int) -- The duration of the music in seconds
+
+    **Returns:**
+     The path of the PNG image or an empty string if it couldn't be made
+    """
+    waveform_path = f"{WAVEFORM_CACHE_DIR}/{cache_key}.png"
+
+    if os.path.exists(waveform_path):
+        os.utime(waveform_path)
+        return waveform_path
+
+    if not music_path or not os.path.exists(music_path):
+        return ''
+
+    import numpy
+
+    # Music shorter than a block per column is reduced in smaller blocks, so that every column gets some of it
+    block_size = max(1, min(ENVELOPE_BLOCK_SAMPLES, int(duration * WAVEFORM_SAMPLE_RATE) // WAVEFORM_WIDTH)) \
+        if duration else ENVELOPE_BLOCK_SAMPLES
+    block_peaks, block_energies, total_samples = [], [], 0
+
+    try:
+        for chunk in stream_pcm(music_path, WAVEFORM_SAMPLE_RATE, PCM_CHUNK_SAMPLES // block_size * block_size):
+            peaks, energies = reduce_blocks(chunk, block_size)
+            block_peaks.append(peaks)
+            block_energies.append(energies)
+            total_samples += len(chunk)
+    except OSError:
+        return ''
+
+    if not total_samples:
+        return ''
+
+    peaks, rms = merge_blocks(numpy.concatenate(block_peaks), numpy.concatenate(block_energies), block_size,
+                              WAVEFORM_WIDTH)
+    pixels = render_waveform(peaks, rms, duration or total_samples / WAVEFORM_SAMPLE_RATE, WAVEFORM_HEIGHT)
+
+    Path(WAVEFORM_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+    temp_waveform_path = f"{waveform_path}.{os.getpid()}.tmp"
+
+    with open(temp_waveform_path, 'wb') as waveform_file:
+        waveform_file.write(encode_png(pixels))
+
+    os.replace(temp_waveform_path, waveform_path)
+
+    evict_cache(WAVEFORM_CACHE_DIR, WAVEFORM_CACHE_MAX_BYTES)
+
+    return waveform_path
+
+
+def compute_envelopes(samples, columns: int):
+    """Split the samples into `columns` equal windows and compute the peak and the RMS of each of them.
+
+    **Keyword arguments:**
+     - samples (numpy.ndarray) -- The PCM samples
+     - columns (int) -- The number of windows
+
+    **Returns:**
+     The peaks and the RMS values, both scaled to [0, 1]
+    """
+    return merge_blocks(*reduce_blocks(samples, 1), 1, columns)
+
+
+def reduce_blocks(samples, block_size: int):
+    """Compute the peak and the energy, i.e. the sum of the squares, of every block of samples. The last block is
+    padded with silence.
+
+    **Keyword arguments:**
+     - samples (numpy.ndarray) -- The PCM samples
+     - block_size (int) -- The number of samples in a block
+
+    **Returns:**
+     The peaks and the energies, scaled as if the samples were in [-1, 1]
+    """
+    import numpy
+
+    padded = numpy.zeros(-(-len(samples) // block_size) * block_size, dtype=numpy.float32)
+    padded[:len(samples)] = samples
+    blocks = padded.reshape(-1, block_size) / 32768
+
+    return numpy.abs(blocks).max(axis=1), numpy.square(blocks).sum(axis=1, dtype=numpy.float64)
+
+
+def merge_blocks(peaks, energies, block_size: int, columns: int):
+    """Merge the blocks `reduce_blocks` made into `columns` equal windows, padding the last ones with silence.
+
+    **Keyword arguments:**
+     - peaks (numpy.ndarray) -- The peak of every block
+     - energies (numpy.ndarray) -- The energy of every block
+     - block_size (int) -- The number of samples in a block
+     - columns (int) -- The number of windows
+
+    **Returns:**
+     The peaks and the RMS values of the windows, both scaled to [0, 1]
+    """
+    import numpy
+
+    window = max(1, -(-len(peaks) // columns))
+    padded_peaks = numpy.zeros(window * columns, dtype=numpy.float32)
+    padded_peaks[:len(peaks)] = peaks
+    padded_energies = numpy.zeros(window * columns, dtype=numpy.float64)
+    padded_energies[:len(energies)] = energies
+
+    return (
+        padded_peaks.reshape(columns, window).max(axis=1),
+        numpy.sqrt(padded_energies.reshape(columns, window).sum(axis=1) / (window * block_size)).astype(numpy.float32),
+    )
+
+
+def render_waveform(peaks, rms, duration: float, height: int):
+    """Draw the envelopes as mirrored bars over a timeline with a mark and a timestamp every few seconds.
+
+    **Keyword arguments:**
+     - peaks (numpy.ndarray) -- The peak of each column, in [0, 1]
+     - rms (numpy.ndarray) -- The RMS of each column, in [0, 1]
+     - duration (float) -- The duration of the music in seconds
+     - height (int) -- The height of the waveform, without the timeline
+
+    **Returns:**
+     The grayscale pixels as a `numpy.ndarray` of `uint8` with one row per line of the image
+    """
+    import numpy
+
+    width = len(peaks)
+    middle = height // 2
+    pixels = numpy.full((height + TIMELINE_HEIGHT, width), BACKGROUND, dtype=numpy.uint8)
+
+    # Distance of every row from the middle line, compared against the half height of every column at once
+    distance = numpy.abs(numpy.arange(height) - middle)[:, numpy.newaxis]
+    peak_heights = numpy.ceil(peaks * (middle - 1))[numpy.newaxis, :]
+    rms_heights = numpy.ceil(rms * (middle - 1))[numpy.newaxis, :]
+
+    waveform = pixels[:height]
+    waveform[distance <= peak_heights] = PEAK_COLOR
+    waveform[distance <= rms_heights] = RMS_COLOR
+    waveform[middle] = RMS_COLOR
+
+    pixels[height] = TICK_COLOR
+
+    # The labels at the edges are pushed inwards by half their width, so leave room for that
+    label_width = (len('00:00') * 4 - 1) * FONT_SCALE
+    interval = next(
+        (interval for interval in TICK_INTERVALS if width * interval / max(duration, 1) > label_width * 1.5 + 8),
+        TICK_INTERVALS[-1]
+    )
+    last_label_end = -width
+
+    for second in range(0, int(duration) + 1, interval):
+        x = min(int(second / max(duration, 1) * width), width - 1)
+        pixels[height:height + 4, x] = TICK_COLOR
+
+        label_x = min(max(x - label_width // 2, 0), width - label_width)
+
+        if label_x > last_label_end + 8:
+            draw_text(pixels, f"{second // 60:02}:{second % 60:02}", label_x, height + 7)
+            last_label_end = label_x + label_width
+
+    return pixels
+
+
+def draw_text(pixels, text: str, x: int, y: int) -> None:
+    """Draw a text with the bitmap font, `FONT_SCALE` times the size of the bitmaps.
+
+    **Keyword arguments:**
+     - pixels (numpy.ndarray) -- The pixels to draw on
+     - text (str) -- The text, made of characters in `FONT`
+     - x (int) -- The left edge of the text
+     - y (int) -- The top edge of the text
+    """
+    import numpy
+
+    for index, character in enumerate(text):
+        glyph = numpy.array([[bit == '1' for bit in row] for row in FONT[character]])
+        glyph = glyph.repeat(FONT_SCALE, axis=0).repeat(FONT_SCALE, axis=1)
+
+        left = x + index * 4 * FONT_SCALE
+        area = pixels[y:y + glyph.shape[0], left:left + glyph.shape[1]]
+        area[glyph[:area.shape[0], :area.shape[1]]] = TICK_COLOR
+
+
+def encode_png(pixels) -> bytes:
+    """Encode grayscale pixels as a PNG image.
+
+    **Keyword arguments:**
+     - pixels (numpy.ndarray) -- The pixels as `uint8`, with one row per line of the image
+
+    **Returns:**
+     The PNG file
+    """
+    import numpy
+
+    height, width = pixels.shape
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    # Every line starts with its filter type, 0 leaves the line as it is
+    lines = numpy.hstack([numpy.zeros((height, 1), dtype=numpy.uint8), pixels])
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(lines.tobytes(), 9))
+        + chunk(b'IEND', b'')
+    )